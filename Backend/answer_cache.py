@@ -0,0 +1,159 @@
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+import numpy as np
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    question TEXT NOT NULL,
+    embedding BLOB NOT NULL,
+    answer TEXT NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+class AnswerCache:
+    """
+    Answers keyed by the question's embedding.
+
+    A lookup returns the cached answer whose question is the most similar
+    one above `threshold` (cosine). Entries expire after `ttl` seconds and
+    the least recently used ones are evicted beyond `max_entries`. Entries
+    live in SQLite so they survive restarts; the embeddings are kept in
+    memory as one normalized matrix for the search.
+    """
+
+    def __init__(self, path: str, threshold: float = 0.96, ttl: float = 7 * 86400, max_entries: int = 5000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+        self.hits = 0
+        self.misses = 0
+        self.lookup_time = 0.0
+        self.lookups = 0
+
+        self.ids = []
+        self.answers = []
+        self.last_used = []
+        self.created = []
+        self.matrix = None
+        self._load()
+
+    def _load(self):
+        self._purge_expired()
+        rows = self.conn.execute(
+            "SELECT id, embedding, answer, created, last_used FROM answers ORDER BY id"
+        ).fetchall()
+        vectors = []
+        for row_id, blob, answer, created, last_used in rows:
+            vector = np.frombuffer(blob, dtype=np.float32)
+            if vectors and vector.shape != vectors[0].shape:
+                # Written with a different embedding model; it can never match.
+                continue
+            vectors.append(vector)
+            self.ids.append(row_id)
+            self.answers.append(answer)
+            self.created.append(created)
+            self.last_used.append(last_used)
+        self.matrix = np.vstack(vectors) if vectors else None
+
+    def _purge_expired(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM answers WHERE created < ?", (time.time() - self.ttl,))
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding: List[float]) -> Optional[str]:
+        started = time.perf_counter()
+        try:
+            with self.lock:
+                if self.matrix is None or self.matrix.shape[1] != len(embedding):
+                    self.misses += 1
+                    return None
+                scores = self.matrix @ self._normalize(embedding)
+                best = int(np.argmax(scores))
+                now = time.time()
+                if scores[best] < self.threshold or now - self.created[best] > self.ttl:
+                    self.misses += 1
+                    return None
+                self.hits += 1
+                self.last_used[best] = now
+                with self.conn:
+                    self.conn.execute(
+                        "UPDATE answers SET last_used = ?, hits = hits + 1 WHERE id = ?",
+                        (now, self.ids[best]),
+                    )
+                return self.answers[best]
+        finally:
+            self.lookup_time += time.perf_counter() - started
+            self.lookups += 1
+
+    def store(self, question: str, embedding: List[float], answer: str):
+        vector = self._normalize(embedding)
+        now = time.time()
+        with self.lock:
+            if self.matrix is not None and self.matrix.shape[1] != vector.shape[0]:
+                # The embedding model changed; start over.
+                with self.conn:
+                    self.conn.execute("DELETE FROM answers")
+                self.ids, self.answers, self.created, self.last_used = [], [], [], []
+                self.matrix = None
+            with self.conn:
+                cursor = self.conn.execute(
+                    "INSERT INTO answers (question, embedding, answer, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                    (question, vector.tobytes(), answer, now, now),
+                )
+            self.ids.append(cursor.lastrowid)
+            self.answers.append(answer)
+            self.created.append(now)
+            self.last_used.append(now)
+            self.matrix = vector[None, :] if self.matrix is None else np.vstack([self.matrix, vector])
+            if len(self.ids) > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        """Drop expired entries, then the least recently used ones, down to max_entries."""
+        now = time.time()
+        order = sorted(range(len(self.ids)), key=lambda i: self.last_used[i])
+        expired = {i for i in order if now - self.created[i] > self.ttl}
+        excess = len(self.ids) - len(expired) - self.max_entries
+        evict = set(expired)
+        for i in order:
+            if excess <= 0:
+                break
+            if i not in evict:
+                evict.add(i)
+                excess -= 1
+        with self.conn:
+            self.conn.executemany("DELETE FROM answers WHERE id = ?", [(self.ids[i],) for i in evict])
+        keep = [i for i in range(len(self.ids)) if i not in evict]
+        self.ids = [self.ids[i] for i in keep]
+        self.answers = [self.answers[i] for i in keep]
+        self.created = [self.created[i] for i in keep]
+        self.last_used = [self.last_used[i] for i in keep]
+        self.matrix = self.matrix[keep] if keep else None
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.ids),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            "lookup_ms_avg": self.lookup_time / self.lookups * 1000 if self.lookups else 0.0,
+        }
@@ -0,0 +1,122 @@
+import asyncio
+import re
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+
+def word_overlap(a: str, b: str) -> float:
+    """Share of the words of b that also appear in a."""
+    words_a = set(re.findall(r"\w+", a.lower()))
+    words_b = set(re.findall(r"\w+", b.lower()))
+    if not words_b:
+        return 0.0
+    return len(words_a & words_b) / len(words_b)
+
+
+class SpeculativeAudioQuestion:
+    """
+    Transcribes a question while it is still being recorded.
+
+    Audio chunks are fed in as they arrive. Every `partial_interval` seconds
+    the audio so far is transcribed and retrieval starts on that partial
+    transcript, one partial at a time and at most `max_partials` times, as
+    each partial is billed for the whole recording so far. When recording
+    ends, the full audio is transcribed and retrieved for. If the last
+    partial transcript covers at least `reuse_overlap` of the final one,
+    its retrieval is passed to `retrieve` along with the final transcript
+    so whatever still applies to the final question can be kept.
+    """
+
+    def __init__(
+        self,
+        transcribe: Callable[[bytes], Awaitable[str]],
+        retrieve: Callable[[str, Optional[Any]], Awaitable[Any]],
+        partial_interval: float = 1.5,
+        reuse_overlap: float = 0.8,
+        max_partials: int = 2,
+    ):
+        self.transcribe = transcribe
+        self.retrieve = retrieve
+        self.partial_interval = partial_interval
+        self.reuse_overlap = reuse_overlap
+        self.max_partials = max_partials
+        self.chunks = []
+        self.size = 0
+        self.started = time.monotonic()
+        self.last_partial = self.started
+        self.partial_task: Optional[asyncio.Task] = None
+        self.speculation = None
+        self.partials = 0
+        self.partials_started = 0
+
+    def feed(self, chunk: bytes):
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        now = time.monotonic()
+        if (
+            self.partial_interval > 0
+            and self.partials_started < self.max_partials
+            and now - self.last_partial >= self.partial_interval
+            and (self.partial_task is None or self.partial_task.done())
+        ):
+            self.last_partial = now
+            self.partials_started += 1
+            self.partial_task = asyncio.create_task(self._partial(b"".join(self.chunks)))
+
+    async def _partial(self, audio: bytes):
+        try:
+            transcript = await self.transcribe(audio)
+        except Exception:
+            return
+        if not transcript.strip():
+            return
+        self.partials += 1
+        previous = self.speculation
+        self.speculation = (transcript, asyncio.create_task(self.retrieve(transcript, None)))
+        if previous and not previous[1].done():
+            previous[1].cancel()
+
+    def cancel(self):
+        if self.partial_task and not self.partial_task.done():
+            self.partial_task.cancel()
+        if self.speculation and not self.speculation[1].done():
+            self.speculation[1].cancel()
+
+    async def finish(self):
+        """Return (question, retrieval, timings) once the recording has ended."""
+        ended = time.monotonic()
+        if self.partial_task and not self.partial_task.done():
+            self.partial_task.cancel()
+
+        try:
+            question = await self.transcribe(b"".join(self.chunks))
+        except BaseException:
+            # No question to answer: stop the speculative retrieval too.
+            self.cancel()
+            raise
+        transcribed = time.monotonic()
+
+        speculative = None
+        if self.speculation and word_overlap(self.speculation[0], question) >= self.reuse_overlap:
+            try:
+                speculative = await self.speculation[1]
+            except Exception:
+                speculative = None
+        elif self.speculation and not self.speculation[1].done():
+            self.speculation[1].cancel()
+        try:
+            retrieval = await self.retrieve(question, speculative)
+        except Exception:
+            # The answer path retries retrieval and reports the error.
+            retrieval = None
+        reused = retrieval is not None and speculative is not None
+
+        timings = {
+            "recording_ms": (ended - self.started) * 1000,
+            "audio_bytes": self.size,
+            "partial_transcripts": self.partials,
+            "speculative_retrieval": reused,
+            "transcribe_ms": (transcribed - ended) * 1000,
+            "retrieval_ms": (time.monotonic() - transcribed) * 1000,
+        }
+        return question, retrieval, timings
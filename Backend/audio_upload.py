@@ -0,0 +1,165 @@
+import io
+import os
+import struct
+import wave
+from typing import Optional
+
+import numpy as np
+
+# Enough of the file to tell the container formats below apart.
+HEADER_BYTES = 12
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class AudioUploadError(ValueError):
+    """The upload is too large or is not a recording that can be transcribed."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def sniff_audio_format(header: bytes) -> Optional[str]:
+    """Container format from the first bytes of a recording, as a file extension."""
+    if header[:4] == b"RIFF" and header[8:12] == b"WAVE":
+        return "wav"
+    if header[:4] == b"\x1a\x45\xdf\xa3":
+        # EBML; MediaRecorder in Chrome and Edge writes WebM.
+        return "webm"
+    if header[:4] == b"OggS":
+        return "ogg"
+    if header[4:8] == b"ftyp":
+        return "mp4"
+    if header[:3] == b"ID3" or (len(header) > 1 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0):
+        return "mp3"
+    return None
+
+
+async def check_audio_upload(file, max_bytes: int) -> str:
+    """
+    Check an UploadFile's size and header without reading it into memory,
+    and return its format.
+
+    The browser's filename and content type are ignored; the format comes
+    from the first bytes. The file is left rewound so the spooled buffer
+    can be handed to the transcription client as is.
+    """
+    size = file.size
+    if size is None:
+        size = file.size = file.file.seek(0, os.SEEK_END)
+    if size > max_bytes:
+        raise AudioUploadError(f"Audio upload is larger than {max_bytes} bytes", 413)
+    await file.seek(0)
+    audio_format = check_audio_header(await file.read(HEADER_BYTES))
+    await file.seek(0)
+    return audio_format
+
+
+def check_audio_header(header: bytes) -> str:
+    audio_format = sniff_audio_format(header)
+    if audio_format is None:
+        raise AudioUploadError("Upload is not a WAV, WebM, Ogg, MP4 or MP3 recording", 415)
+    return audio_format
+
+
+def _parse_wav(audio: bytes):
+    """Return (format tag, channels, rate, bits, sample data) or None."""
+    fmt = None
+    pos = HEADER_BYTES
+    while pos + 8 <= len(audio):
+        chunk_id = audio[pos:pos + 4]
+        size = int.from_bytes(audio[pos + 4:pos + 8], "little")
+        if chunk_id == b"fmt " and size >= 16:
+            tag, channels, rate, _, _, bits = struct.unpack("<HHIIHH", audio[pos + 8:pos + 24])
+            if tag == WAVE_FORMAT_EXTENSIBLE and size >= 26:
+                tag = int.from_bytes(audio[pos + 32:pos + 34], "little")
+            fmt = (tag, channels, rate, bits)
+        elif chunk_id == b"data":
+            if fmt is None:
+                return None
+            end = pos + 8 + size
+            # Recorders that stream WAV leave the size as 0 or 0xFFFFFFFF.
+            if size in (0, 0xFFFFFFFF) or end > len(audio):
+                end = len(audio)
+            return (*fmt, memoryview(audio)[pos + 8:end])
+        pos += 8 + size + (size & 1)
+    return None
+
+
+def _decode_samples(tag: int, bits: int, data) -> Optional[np.ndarray]:
+    """Samples as float32 in [-1, 1], interleaved across channels."""
+    if tag == WAVE_FORMAT_IEEE_FLOAT and bits == 32:
+        return np.frombuffer(data, dtype="<f4").astype(np.float32)
+    if tag != WAVE_FORMAT_PCM:
+        return None
+    if bits == 8:
+        return (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / 128
+    if bits == 16:
+        return np.frombuffer(data, dtype="<i2").astype(np.float32) / 32768
+    if bits == 24:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        values = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+        values = np.where(values & 0x800000, values - 0x1000000, values)
+        return values.astype(np.float32) / 8388608
+    if bits == 32:
+        return np.frombuffer(data, dtype="<i4").astype(np.float32) / 2147483648
+    return None
+
+
+def downsample_wav(audio: bytes, rate: int = 16000, block_seconds: float = 10.0) -> bytes:
+    """
+    Re-encode a WAV recording as 16-bit mono at `rate` Hz, which is what
+    Whisper resamples to anyway. Recordings that are already that small,
+    and WAV variants this does not decode, are returned unchanged.
+
+    The samples are converted `block_seconds` at a time so the float copy
+    stays small next to the recording itself.
+    """
+    parsed = _parse_wav(audio)
+    if parsed is None:
+        return audio
+    tag, channels, source_rate, bits, data = parsed
+    if channels < 1 or source_rate <= 0 or bits % 8 or bits == 0:
+        return audio
+    if tag == WAVE_FORMAT_PCM and channels == 1 and bits <= 16 and source_rate <= rate:
+        return audio
+    if _decode_samples(tag, bits, b"") is None:
+        return audio
+
+    frame_bytes = channels * bits // 8
+    frames = len(data) // frame_bytes
+    out_rate = min(rate, source_rate)
+    # Averaging groups of samples low-passes before decimating; other
+    # ratios fall back to linear interpolation.
+    factor = source_rate // out_rate if source_rate % out_rate == 0 else 0
+    step = source_rate / out_rate
+    block = max(1, int(block_seconds * out_rate))
+    if factor:
+        total = frames // factor
+    else:
+        total = int(frames / step)
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(out_rate)
+        for first in range(0, total, block):
+            count = min(block, total - first)
+            if factor:
+                start, end = first * factor, (first + count) * factor
+            else:
+                positions = (first + np.arange(count)) * step
+                start = int(positions[0])
+                end = min(frames, int(positions[-1]) + 2)
+            samples = _decode_samples(tag, bits, data[start * frame_bytes:end * frame_bytes])
+            samples = samples.reshape(-1, channels).mean(axis=1)
+            if factor:
+                samples = samples.reshape(-1, factor).mean(axis=1)
+            else:
+                samples = np.interp(positions - start, np.arange(end - start), samples)
+            out.writeframes((np.clip(samples, -1.0, 1.0) * 32767).astype("<i2").tobytes())
+    return buffer.getvalue()
@@ -0,0 +1,118 @@
+"""
+Replays recorded questions through the answer cache and compares answer
+latency with and without it. The log is JSONL with one question per line,
+in a "question" field (or "title"/"body", as in requests.jsonl).
+
+    python benchmarks/bench_answer_cache.py --log benchmarks/data/questions.jsonl
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from answer_cache import AnswerCache
+from streaming import replay_chunks
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "questions.jsonl")
+
+
+def load_questions(path: str):
+    questions = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                questions.append(record.get("question") or record.get("title") or record.get("body"))
+    return questions
+
+
+def bag_of_words_embedding(text: str, dim: int = 256):
+    """Hashing-trick embedding, so rephrasings of a question land close together."""
+    vector = [0.0] * dim
+    for word in re.findall(r"[a-z0-9]+", text.lower()):
+        vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % dim] += 1.0
+    return vector
+
+
+async def generate(tokens: int, first_token_delay: float, token_delay: float):
+    await asyncio.sleep(first_token_delay)
+    for i in range(tokens):
+        await asyncio.sleep(token_delay)
+        yield f" word{i}"
+
+
+async def answer(question, cache, args):
+    started = time.perf_counter()
+    first = None
+    await asyncio.sleep(args.embed_delay)
+    embedding = bag_of_words_embedding(question)
+    cached = cache.lookup(embedding) if cache else None
+    if cached is not None:
+        chunks = replay_chunks(cached, args.replay, delay=args.replay_delay)
+    else:
+        await asyncio.sleep(args.retrieval_delay)
+        chunks = generate(args.tokens, args.first_token_delay, args.token_delay)
+    parts = []
+    async for chunk in chunks:
+        if first is None:
+            first = time.perf_counter() - started
+        parts.append(chunk)
+    if cache is not None and cached is None:
+        cache.store(question, embedding, "".join(parts))
+    return first, time.perf_counter() - started, cached is not None
+
+
+async def run(questions, cache, args):
+    results = [await answer(q, cache, args) for q in questions]
+    hits = [r for r in results if r[2]]
+    misses = [r for r in results if not r[2]]
+
+    def p50(rows, index):
+        return statistics.median(r[index] * 1000 for r in rows) if rows else 0.0
+
+    return {
+        "hits": len(hits),
+        "hit_ttft": p50(hits, 0),
+        "hit_answer": p50(hits, 1),
+        "miss_ttft": p50(misses, 0),
+        "miss_answer": p50(misses, 1),
+        "total": sum(r[1] for r in results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--log", default=DATA)
+    parser.add_argument("--threshold", type=float, default=0.9)
+    parser.add_argument("--replay", choices=["stream", "instant"], default="stream")
+    parser.add_argument("--replay-delay", type=float, default=0.002)
+    parser.add_argument("--embed-delay", type=float, default=0.03)
+    parser.add_argument("--retrieval-delay", type=float, default=0.05)
+    parser.add_argument("--first-token-delay", type=float, default=0.3)
+    parser.add_argument("--token-delay", type=float, default=0.002)
+    parser.add_argument("--tokens", type=int, default=200)
+    args = parser.parse_args()
+
+    questions = load_questions(args.log)
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = AnswerCache(os.path.join(tmp, "cache.db"), threshold=args.threshold)
+        for name, c in (("no cache", None), ("answer cache", cache)):
+            r = asyncio.run(run(questions, c, args))
+            print(
+                f"{name:<14} questions={len(questions)} hits={r['hits']} total={r['total']:.2f}s\n"
+                f"    miss p50: ttft={r['miss_ttft']:.1f}ms answer={r['miss_answer']:.1f}ms\n"
+                f"    hit  p50: ttft={r['hit_ttft']:.1f}ms answer={r['hit_answer']:.1f}ms"
+            )
+        print(cache.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Time-to-first-token after the speaker stops, for the upload-then-process
+/ask-audio flow and the streamed SpeculativeAudioQuestion flow, using a
+fake ASR, retrieval and LLM, with the seconds of audio each flow sends to
+the ASR (what Whisper bills).
+
+    python benchmarks/bench_audio_pipeline.py --durations 3 6 10 60
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_pipeline import SpeculativeAudioQuestion
+
+SENTENCE = (
+    "so can you walk me through how you would partition a large fact table in spark "
+    "and what you would do when one key is much hotter than the rest"
+).split()
+BYTES_PER_SECOND = 4000
+
+
+class FakeASR:
+    """Latency grows with audio length; the transcript covers the audio heard so far."""
+
+    def __init__(self, base: float, per_second: float, total_bytes: int):
+        self.base = base
+        self.per_second = per_second
+        self.total_bytes = total_bytes
+        self.calls = 0
+        self.billed_bytes = 0
+
+    async def __call__(self, audio: bytes) -> str:
+        self.calls += 1
+        self.billed_bytes += len(audio)
+        seconds = len(audio) / BYTES_PER_SECOND
+        await asyncio.sleep(self.base + self.per_second * seconds)
+        words = round(len(SENTENCE) * len(audio) / self.total_bytes)
+        return " ".join(SENTENCE[:words])
+
+
+def fake_retrieve(delay: float, embedding: float):
+    async def retrieve(question: str, speculative=None):
+        # A kept speculative retrieval still embeds the final question.
+        await asyncio.sleep(embedding if speculative else delay)
+        return {"context": speculative["context"] if speculative else f"context for: {question}"}
+    return retrieve
+
+
+async def first_token(delay: float):
+    await asyncio.sleep(delay)
+
+
+async def sequential(args, duration: float):
+    total = int(duration * BYTES_PER_SECOND)
+    asr = FakeASR(args.asr_base, args.asr_per_second, total)
+    # The whole clip exists when the speaker stops; upload is not counted.
+    ended = time.monotonic()
+    question = await asr(b"\0" * total)
+    await fake_retrieve(args.retrieval, args.embedding)(question)
+    await first_token(args.first_token)
+    return time.monotonic() - ended
+
+
+async def pipelined(args, duration: float):
+    total = int(duration * BYTES_PER_SECOND)
+    asr = FakeASR(args.asr_base, args.asr_per_second, total)
+    pipeline = SpeculativeAudioQuestion(
+        asr, fake_retrieve(args.retrieval, args.embedding), partial_interval=args.partial_interval, reuse_overlap=args.reuse_overlap,
+        max_partials=args.max_partials,
+    )
+    chunk = int(BYTES_PER_SECOND * args.chunk_ms / 1000)
+    sent = 0
+    while sent < total:
+        await asyncio.sleep(args.chunk_ms / 1000)
+        size = min(chunk, total - sent)
+        pipeline.feed(b"\0" * size)
+        sent += size
+    ended = time.monotonic()
+    _, _, timings = await pipeline.finish()
+    await first_token(args.first_token)
+    timings["billed_s"] = asr.billed_bytes / BYTES_PER_SECOND
+    return time.monotonic() - ended, timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--durations", type=float, nargs="+", default=[3, 6, 10])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--asr-base", type=float, default=0.35)
+    parser.add_argument("--asr-per-second", type=float, default=0.04)
+    parser.add_argument("--retrieval", type=float, default=0.25, help="embedding + Chroma query")
+    parser.add_argument("--embedding", type=float, default=0.08, help="embedding alone")
+    parser.add_argument("--first-token", type=float, default=0.4)
+    parser.add_argument("--chunk-ms", type=int, default=250)
+    parser.add_argument("--partial-interval", type=float, default=1.5)
+    parser.add_argument("--reuse-overlap", type=float, default=0.8)
+    parser.add_argument("--max-partials", type=int, default=2)
+    args = parser.parse_args()
+
+    print(f"{'speech':>7} {'sequential ttft':>16} {'pipelined ttft':>15} {'billed audio':>13}  speculative hits")
+    for duration in args.durations:
+        before = [asyncio.run(sequential(args, duration)) for _ in range(args.runs)]
+        after = [asyncio.run(pipelined(args, duration)) for _ in range(args.runs)]
+        hits = sum(t["speculative_retrieval"] for _, t in after)
+        print(
+            f"{duration:>6.1f}s {statistics.median(before) * 1000:>14.0f}ms "
+            f"{statistics.median(a for a, _ in after) * 1000:>13.0f}ms "
+            f"{statistics.median(t['billed_s'] for _, t in after):>12.1f}s  {hits}/{args.runs}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Memory and latency of handling one /ask-audio upload, from the spooled
+upload Starlette hands the endpoint to the transcription request reaching
+a local fake Whisper server. Compares the old temp-file round trip with
+handing the spooled upload straight to the client, with and without
+16 kHz mono re-encoding.
+
+    python benchmarks/bench_audio_upload.py --durations 10 60 300 --rate 48000
+
+Upload time over a real uplink is estimated from the bytes sent
+(--uplink-mbps), since loopback hides it.
+"""
+import argparse
+import asyncio
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import wave
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakes import FakeOpenAIServer
+from audio_upload import check_audio_upload, downsample_wav
+
+
+def make_wav(seconds: float, rate: int, channels: int) -> bytes:
+    t = np.arange(int(seconds * rate)) / rate
+    tone = 0.3 * np.sin(2 * np.pi * 220 * t) + 0.05 * np.random.default_rng(0).standard_normal(len(t))
+    pcm = (np.repeat(tone[:, None], channels, axis=1) * 32767).astype("<i2")
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as out:
+        out.setnchannels(channels)
+        out.setsampwidth(2)
+        out.setframerate(rate)
+        out.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+
+def make_upload(audio: bytes):
+    from starlette.datastructures import UploadFile
+
+    # What the multipart parser produces: spooled to disk past 1 MB.
+    spooled = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    spooled.write(audio)
+    spooled.seek(0)
+    return UploadFile(spooled, size=len(audio), filename="audio")
+
+
+async def temp_file_path(client, upload):
+    # The previous handler: read it all, write a temp file, reopen it.
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_audio:
+        audio_bytes = await upload.read()
+        temp_audio.write(audio_bytes)
+        temp_audio_path = temp_audio.name
+    try:
+        with open(temp_audio_path, "rb") as audio_file:
+            client.audio.transcriptions.create(model="whisper-1", file=audio_file)
+    finally:
+        os.remove(temp_audio_path)
+    return len(audio_bytes)
+
+
+async def spooled(client, upload, resample_rate=0):
+    audio_format = await check_audio_upload(upload, 1 << 31)
+    audio = upload.file
+    sent = upload.size
+    if audio_format == "wav" and resample_rate:
+        audio = downsample_wav(await upload.read(), resample_rate)
+        sent = len(audio)
+    client.audio.transcriptions.create(model="whisper-1", file=(f"audio.{audio_format}", audio))
+    return sent
+
+
+def measure(handler, client, audio, runs):
+    times, peaks, sent = [], [], 0
+    for _ in range(runs):
+        upload = make_upload(audio)
+        tracemalloc.start()
+        started = time.perf_counter()
+        sent = asyncio.run(handler(client, upload))
+        times.append(time.perf_counter() - started)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        upload.file.close()
+    return statistics.median(times), max(peaks), sent
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--durations", type=float, nargs="+", default=[10, 60, 300])
+    parser.add_argument("--rate", type=int, default=48000)
+    parser.add_argument("--channels", type=int, default=1)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--uplink-mbps", type=float, default=20.0)
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(transcribe_delay=0).start()
+    from openai import OpenAI
+
+    client = OpenAI(api_key="sk-fake", base_url=server.base_url)
+    handlers = (
+        ("temp file", temp_file_path),
+        ("spooled", spooled),
+        ("spooled 16k", lambda c, u: spooled(c, u, 16000)),
+    )
+    print(f"{'clip':>6} {'path':<14} {'handle':>9} {'peak mem':>10} {'sent':>9} {'est. upload':>12}")
+    try:
+        for duration in args.durations:
+            audio = make_wav(duration, args.rate, args.channels)
+            for name, handler in handlers:
+                elapsed, peak, sent = measure(handler, client, audio, args.runs)
+                upload = sent * 8 / (args.uplink_mbps * 1e6)
+                print(
+                    f"{duration:>5.0f}s {name:<14} {elapsed * 1000:>7.0f}ms {peak / 1e6:>8.1f}MB "
+                    f"{sent / 1e6:>7.1f}MB {upload * 1000:>10.0f}ms"
+                )
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+p50/p99 latency of concurrent /send-message requests against a stand-in
+Chroma with blocking per-call latency and a local fake OpenAI server.
+Also reports the worst event-loop stall seen while the requests ran, which
+is what freezes every other session's token stream.
+
+    python benchmarks/bench_blocking_io.py --concurrency 32 --chroma-latency 0.05
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import FakeOpenAIServer, install_fake_chroma, percentile, seed_knowledge
+
+
+async def watch_loop(stalls: list, stop: asyncio.Event, interval: float = 0.005):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        stalls.append(time.perf_counter() - started - interval)
+
+
+async def run(args):
+    import httpx
+    import main
+
+    seed_knowledge(main.collection(), args.documents)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        stalls = []
+        stop = asyncio.Event()
+        watcher = asyncio.create_task(watch_loop(stalls, stop))
+
+        async def one(i: int):
+            started = time.perf_counter()
+            response = await client.post(
+                "/send-message",
+                data={"sessionId": f"bench-{i % args.sessions}", "message": f"Question {i}?"},
+            )
+            response.raise_for_status()
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(one(i) for i in range(args.concurrency)))
+        total = time.perf_counter() - started
+        stop.set()
+        await watcher
+
+    print(f"requests={args.concurrency} total={total:.2f}s")
+    print(
+        f"latency ms: p50={percentile(latencies, 50) * 1000:.1f} "
+        f"p99={percentile(latencies, 99) * 1000:.1f} max={max(latencies) * 1000:.1f}"
+    )
+    print(f"event loop stall ms: p99={percentile(stalls, 99) * 1000:.1f} max={max(stalls) * 1000:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--chroma-latency", type=float, default=0.05)
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    parser.add_argument("--first-token-delay", type=float, default=0.1)
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(
+        tokens=args.tokens,
+        token_delay=args.token_delay,
+        first_token_delay=args.first_token_delay,
+    ).start()
+    server.install_env()
+    install_fake_chroma(args.chroma_latency)
+    try:
+        asyncio.run(run(args))
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+Multi-process load test of the broadcast backends.
+
+Starts `uvicorn main:app --workers N` against a real `chroma run` server,
+the fake OpenAI server and, for the broker backend, broker.py on a UNIX
+socket. --sessions sessions each get --viewers WebSocket viewers, which
+the kernel spreads over the workers, and ask --questions questions in a
+row through /send-message while every session runs at once. Reports:
+
+- answers/s and frames/s delivered to viewers over the whole run;
+- delivered: share of the answers that reached every viewer (with the
+  local backend and several workers, viewers on another worker than the
+  POST miss them);
+- ordered: every viewer of a session saw the same frames in the same
+  order, each answer's seq increasing and its deltas adding up to the
+  final text;
+- CPU ms per answer, summed over the workers and the broker: on a host
+  with C free cores, throughput tops out near C / that.
+
+    python benchmarks/bench_broadcast.py --workers 1 2 4 --backends local broker
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import websockets
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_startup import port_open, start_chroma, status, wait_until
+from fakes import FakeOpenAIServer
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def cpu_seconds(pids) -> float:
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        total += int(fields[11]) + int(fields[12])
+    return total / CLOCK_TICKS
+
+
+def worker_pids(pid: int):
+    # With --workers 1 uvicorn serves from the process it was started as.
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()] or [pid]
+
+
+def all_ready(base: str, checks: int) -> bool:
+    # New connections land on whichever worker accepts first; several in a
+    # row answering 200 means every worker is up.
+    return all(status(f"{base}/readyz") == 200 for _ in range(checks))
+
+
+async def viewer(url: str, frames: list, stop: asyncio.Event):
+    async with websockets.connect(url, max_size=None) as ws:
+        while not stop.is_set():
+            try:
+                frames.append(json.loads(await asyncio.wait_for(ws.recv(), 0.2)))
+            except asyncio.TimeoutError:
+                pass
+
+
+def check(frames: list, questions: int):
+    """Final answers seen, and whether the frames are consistent."""
+    texts, order, ok = {}, [], True
+    for frame in frames:
+        if frame.get("role") == "user":
+            order.append(("user", frame.get("content")))
+            continue
+        message_id = frame.get("message_id")
+        seqs, parts = texts.setdefault(message_id, ([], []))
+        if seqs and frame["seq"] <= seqs[-1]:
+            ok = False
+        seqs.append(frame["seq"])
+        if frame.get("is_complete"):
+            ok = ok and (not parts or "".join(parts) == frame["content"])
+            order.append(("answer", message_id, frame["content"]))
+        elif "delta" in frame:
+            parts.append(frame["delta"])
+    finals = sum(1 for entry in order if entry[0] == "answer")
+    return finals, order, ok
+
+
+async def run_load(base: str, ws_base: str, args, tag: str):
+    stop = asyncio.Event()
+    sessions = [f"bench-{tag}-{s}" for s in range(args.sessions)]
+    frames = {session: [[] for _ in range(args.viewers)] for session in sessions}
+    viewers = [
+        asyncio.create_task(viewer(f"{ws_base}/ws/{session}", frames[session][v], stop))
+        for session in sessions for v in range(args.viewers)
+    ]
+    await asyncio.sleep(1.0)
+
+    async def ask(client: httpx.AsyncClient, session: str):
+        for q in range(args.questions):
+            await client.post(f"{base}/send-message", timeout=120,
+                              data={"sessionId": session, "message": f"{session} question {q}: what is a partition?"})
+
+    expected = args.questions
+    started = time.perf_counter()
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=args.sessions)) as client:
+        await asyncio.gather(*(ask(client, session) for session in sessions))
+    elapsed = time.perf_counter() - started
+    # Frames to viewers on other workers may still be in flight.
+    deadline = time.perf_counter() + 5
+    while time.perf_counter() < deadline:
+        if all(check(f, expected)[0] >= expected for views in frames.values() for f in views):
+            break
+        await asyncio.sleep(0.05)
+    stop.set()
+    await asyncio.gather(*viewers, return_exceptions=True)
+
+    delivered = total_frames = 0
+    ordered = True
+    for views in frames.values():
+        results = [check(f, expected) for f in views]
+        delivered += sum(min(finals, expected) for finals, _, _ in results)
+        total_frames += sum(len(f) for f in views)
+        ordered = ordered and all(ok for _, _, ok in results)
+        ordered = ordered and all(order == results[0][1] for _, order, _ in results)
+    answers = args.sessions * args.questions
+    return {
+        "elapsed": elapsed,
+        "answers_per_s": answers / elapsed,
+        "frames_per_s": total_frames / elapsed,
+        "delivered": delivered / (answers * args.viewers),
+        "ordered": ordered,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--backends", nargs="+", choices=["local", "broker"], default=["local", "broker"])
+    parser.add_argument("--sessions", type=int, default=16)
+    parser.add_argument("--viewers", type=int, default=4)
+    parser.add_argument("--questions", type=int, default=4)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--chroma-port", type=int, default=8000)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    server = FakeOpenAIServer(tokens=args.tokens, first_token_delay=0.05, token_delay=0.002, embed_delay=0.01).start()
+    chroma = start_chroma(args.chroma_port, os.path.join(tmp, "chroma"))
+    socket_path = os.path.join(tmp, "broker.sock")
+    broker = subprocess.Popen([sys.executable, "broker.py", "--unix", socket_path], cwd=BACKEND_DIR,
+                              stdout=subprocess.DEVNULL)
+    wait_until(lambda: os.path.exists(socket_path), 10)
+    base = f"http://127.0.0.1:{args.port}"
+    ws_base = f"ws://127.0.0.1:{args.port}"
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="sk-fake",
+        OPENAI_BASE_URL=server.base_url,
+        CHROMA_PORT=str(args.chroma_port),
+        BROADCAST_URL=f"unix://{socket_path}",
+        ANSWER_CACHE_ENABLED="false",
+        SESSION_DB_PATH=os.path.join(tmp, "sessions.db"),
+        EMBEDDING_CACHE_PATH=os.path.join(tmp, "embeddings.db"),
+        MEMORY_DB_PATH=os.path.join(tmp, "memory.db"),
+    )
+
+    print(f"{args.sessions} sessions x {args.viewers} viewers x {args.questions} questions, {args.tokens} tokens each")
+    print(f"{'backend':<8} {'workers':>7} {'answers/s':>10} {'frames/s':>9} {'delivered':>10} {'ordered':>8} {'cpu/answer':>11}")
+    try:
+        for backend in args.backends:
+            for workers in args.workers:
+                worker = subprocess.Popen(
+                    [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port),
+                     "--workers", str(workers), "--log-level", "warning"],
+                    cwd=BACKEND_DIR, env=dict(env, BROADCAST_BACKEND=backend),
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                )
+                try:
+                    wait_until(lambda: port_open(args.port), 120, worker)
+                    wait_until(lambda: all_ready(base, 4 * workers), 120, worker)
+                    pids = worker_pids(worker.pid) + ([broker.pid] if backend == "broker" else [])
+                    cpu = cpu_seconds(pids)
+                    result = asyncio.run(run_load(base, ws_base, args, f"{backend}{workers}-{time.time_ns()}"))
+                    cpu = cpu_seconds(pids) - cpu
+                finally:
+                    worker.terminate()
+                    worker.wait()
+                print(
+                    f"{backend:<8} {workers:>7} {result['answers_per_s']:>10.1f} {result['frames_per_s']:>9.0f} "
+                    f"{result['delivered']:>9.1%} {str(result['ordered']):>8} "
+                    f"{cpu / (args.sessions * args.questions) * 1000:>9.1f}ms"
+                )
+    finally:
+        broker.terminate()
+        broker.wait()
+        chroma.terminate()
+        chroma.wait()
+        server.stop()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Load test for ConnectionManager: hundreds of simulated sockets on one
+session, a share of them slow or dead, receiving one streamed answer.
+
+    python benchmarks/bench_connections.py --sockets 500 --slow 0.05 --dead 0.02
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from streaming import AnswerStreamer, stream_answer
+from websocket_manager import ConnectionManager
+
+
+class FakeWebSocket:
+    def __init__(self, send_delay: float, dead: bool):
+        self.send_delay = send_delay
+        self.dead = dead
+        self.received = 0
+        self.closed = False
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, message: dict):
+        if self.dead:
+            raise ConnectionResetError("socket is gone")
+        await asyncio.sleep(self.send_delay)
+        self.received += 1
+
+    async def close(self, code: int = 1000):
+        self.closed = True
+
+
+async def fake_llm(tokens: int, token_delay: float):
+    for i in range(tokens):
+        await asyncio.sleep(token_delay)
+        yield f" tok{i}"
+
+
+async def run(args):
+    rng = random.Random(42)
+    manager = ConnectionManager(max_queue=args.max_queue, send_timeout=args.send_timeout)
+    sockets = []
+    for _ in range(args.sockets):
+        roll = rng.random()
+        if roll < args.dead:
+            ws = FakeWebSocket(0, dead=True)
+        elif roll < args.dead + args.slow:
+            ws = FakeWebSocket(args.slow_delay, dead=False)
+        else:
+            ws = FakeWebSocket(0.0005, dead=False)
+        sockets.append(ws)
+        await manager.connect(ws, "load-test")
+
+    broadcast_times = []
+
+    async def send(frame: dict):
+        started = time.perf_counter()
+        await manager.broadcast("load-test", frame)
+        broadcast_times.append(time.perf_counter() - started)
+
+    streamer = AnswerStreamer(send, flush_interval=args.flush_interval, flush_chars=args.flush_chars)
+    started = time.perf_counter()
+    await stream_answer(fake_llm(args.tokens, args.token_delay), streamer)
+    producer_time = time.perf_counter() - started
+
+    # Let the writers drain before reading the per-connection stats.
+    await asyncio.sleep(args.slow_delay * 4 + 0.1)
+    metrics = manager.metrics()
+    stats = metrics["per_session"].get("load-test", [])
+    latencies = [s["send_ms_avg"] for s in stats if s["sent"]]
+
+    print(f"sockets={args.sockets} frames={streamer.seq} producer_time={producer_time * 1000:.1f}ms")
+    print(
+        f"broadcast per frame: avg={statistics.mean(broadcast_times) * 1e6:.1f}us "
+        f"max={max(broadcast_times) * 1e6:.1f}us"
+    )
+    print(
+        f"alive={metrics['connections']} evicted={metrics['evicted']} "
+        f"dead_removed={args.sockets - metrics['connections'] - metrics['evicted']}"
+    )
+    if latencies:
+        print(
+            f"send latency avg ms: p50={statistics.median(latencies):.2f} "
+            f"max={max(latencies):.2f}; max queue depth={max(s['max_queue_depth'] for s in stats)}; "
+            f"coalesced={sum(s['coalesced'] for s in stats)}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sockets", type=int, default=500)
+    parser.add_argument("--slow", type=float, default=0.05, help="share of slow sockets")
+    parser.add_argument("--dead", type=float, default=0.02, help="share of sockets that fail on send")
+    parser.add_argument("--slow-delay", type=float, default=0.2)
+    parser.add_argument("--tokens", type=int, default=600)
+    parser.add_argument("--token-delay", type=float, default=0.002)
+    parser.add_argument("--flush-interval", type=float, default=0.05)
+    parser.add_argument("--flush-chars", type=int, default=64)
+    parser.add_argument("--max-queue", type=int, default=256)
+    parser.add_argument("--send-timeout", type=float, default=10.0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+API calls and latency of the shared EmbeddingProvider with a deterministic
+local fake embedder, compared with one API call per request.
+
+    python benchmarks/bench_embeddings.py --callers 64 --requests 20 --vocabulary 200
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import fake_embedding, percentile
+from embeddings import EmbeddingProvider
+
+
+class FakeEmbedder:
+    """Counts API calls; each call costs a fixed latency plus a little per text."""
+
+    def __init__(self, latency: float, per_text: float):
+        self.latency = latency
+        self.per_text = per_text
+        self.calls = 0
+        self.texts = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, texts):
+        with self.lock:
+            self.calls += 1
+            self.texts += len(texts)
+        time.sleep(self.latency + self.per_text * len(texts))
+        return [fake_embedding(t) for t in texts]
+
+
+async def drive(embed, callers: int, requests: int, vocabulary: int, seed: int = 7):
+    rng = random.Random(seed)
+    workload = [[f"question {rng.randrange(vocabulary)}" for _ in range(requests)] for _ in range(callers)]
+    latencies = []
+
+    async def caller(texts):
+        for text in texts:
+            started = time.perf_counter()
+            await embed([text])
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(caller(texts) for texts in workload))
+    return time.perf_counter() - started, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--callers", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--vocabulary", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--per-text", type=float, default=0.0002)
+    parser.add_argument("--batch-window", type=float, default=0.005)
+    args = parser.parse_args()
+
+    def report(name, fake, wall, latencies):
+        print(
+            f"{name:<22} api_calls={fake.calls:<5} texts_sent={fake.texts:<5} wall={wall:.2f}s "
+            f"p50={percentile(latencies, 50) * 1000:.1f}ms p99={percentile(latencies, 99) * 1000:.1f}ms"
+        )
+
+    direct = FakeEmbedder(args.latency, args.per_text)
+
+    async def direct_embed(texts):
+        return await asyncio.get_running_loop().run_in_executor(None, direct, texts)
+
+    wall, latencies = asyncio.run(drive(direct_embed, args.callers, args.requests, args.vocabulary))
+    report("one call per request", direct, wall, latencies)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "embeddings.db")
+        fake = FakeEmbedder(args.latency, args.per_text)
+        provider = EmbeddingProvider(fake, "fake", cache_path=path, batch_window=args.batch_window)
+        wall, latencies = asyncio.run(drive(provider.aembed, args.callers, args.requests, args.vocabulary))
+        report("provider, cold", fake, wall, latencies)
+
+        # A fresh provider on the same file only has the disk tier warm.
+        fake = FakeEmbedder(args.latency, args.per_text)
+        provider = EmbeddingProvider(fake, "fake", cache_path=path, batch_window=args.batch_window)
+        wall, latencies = asyncio.run(drive(provider.aembed, args.callers, args.requests, args.vocabulary))
+        report("provider, after restart", fake, wall, latencies)
+        print(provider.stats())
+
+
+if __name__ == "__main__":
+    main()
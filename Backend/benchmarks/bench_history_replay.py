@@ -0,0 +1,151 @@
+"""
+Reconnect latency for sessions with long histories.
+
+Starts the app (serve_fake.py) on a session store seeded with sessions of
+each of --sizes messages, half questions and half answers, then connects
+to each session --repeat times in three ways and times connect until the
+replay is all in:
+
+- per message: no cursor, as older clients connect; one frame per message;
+- paged: ?after=0, the whole history in {"type": "history"} pages;
+- missed: ?after=<seq>, the last --missed messages only, as a client
+  reconnecting after a short drop does.
+
+Reports the median and p95 in ms, the frames and bytes received, and the
+app's CPU ms per connect.
+
+    python benchmarks/bench_history_replay.py --sizes 10 1000 10000 --repeat 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import websockets
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_broadcast import cpu_seconds
+from bench_startup import port_open, status, wait_until
+from fakes import FakeOpenAIServer, percentile
+from session_store import SessionStore, new_row
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUESTION = "How would you design a rate limiter for a public API, and what would you measure? "
+ANSWER = ("A token bucket per API key is a good start: it allows short bursts while holding the average "
+          "rate, and the state is two numbers per key. ") * 5
+
+
+def seed(path: str, sizes) -> dict:
+    """Write a session of each size; returns session id -> seq of every message."""
+    store = SessionStore(path)
+    seqs = {}
+    for size in sizes:
+        session_id = f"replay-{size}"
+        rows = [
+            new_row(session_id, "user" if i % 2 == 0 else "assistant", QUESTION if i % 2 == 0 else ANSWER,
+                    timestamp=1.0 + i)
+            for i in range(size)
+        ]
+        seqs[session_id] = []
+        for start in range(0, size, 1000):
+            seqs[session_id] += store.append_many(rows[start:start + 1000])
+    return seqs
+
+
+async def reconnect(url: str, expected: int) -> tuple:
+    """Connect and read until the replay is in; returns (ms, frames, bytes)."""
+    started = time.perf_counter()
+    frames = received = messages = 0
+    async with websockets.connect(url, max_size=None) as ws:
+        while True:
+            raw = await ws.recv()
+            frames += 1
+            received += len(raw)
+            data = json.loads(raw)
+            if data.get("type") == "history":
+                messages += len(data["messages"])
+                if data["done"]:
+                    break
+            else:
+                messages += 1
+                if messages >= expected:
+                    break
+    elapsed = (time.perf_counter() - started) * 1000
+    if messages != expected:
+        raise SystemExit(f"{url}: expected {expected} messages, got {messages}")
+    return elapsed, frames, received
+
+
+async def run(ws_base: str, seqs: dict, args, pid: int):
+    print(f"{'messages':>8} {'mode':<12} {'p50 ms':>9} {'p95 ms':>9} {'frames':>7} {'KB':>9} {'cpu ms':>8}")
+    for size in args.sizes:
+        session_id = f"replay-{size}"
+        missed = min(args.missed, size)
+        after = seqs[session_id][size - missed - 1] if missed < size else 0
+        modes = (
+            ("per message", f"{ws_base}/ws/{session_id}", size),
+            ("paged", f"{ws_base}/ws/{session_id}?after=0", size),
+            ("missed", f"{ws_base}/ws/{session_id}?after={after}", missed),
+        )
+        for mode, url, expected in modes:
+            await reconnect(url, expected)
+            cpu = cpu_seconds([pid])
+            results = [await reconnect(url, expected) for _ in range(args.repeat)]
+            cpu_ms = (cpu_seconds([pid]) - cpu) / args.repeat * 1000
+            latencies = sorted(ms for ms, _, _ in results)
+            _, frames, received = results[-1]
+            print(f"{size:>8} {mode:<12} {percentile(latencies, 50):>9.1f} {percentile(latencies, 95):>9.1f} "
+                  f"{frames:>7} {received / 1024:>9.1f} {cpu_ms:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--missed", type=int, default=10, help="messages a reconnecting client missed")
+    parser.add_argument("--page-size", type=int, default=None, help="HISTORY_PAGE_SIZE for the app")
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    server = FakeOpenAIServer().start()
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="sk-fake",
+        OPENAI_BASE_URL=server.base_url,
+        SESSION_DB_PATH=os.path.join(tmp, "sessions.db"),
+        EMBEDDING_CACHE_PATH=os.path.join(tmp, "embeddings.db"),
+        ANSWER_CACHE_PATH=os.path.join(tmp, "answers.db"),
+        MEMORY_DB_PATH=os.path.join(tmp, "memory.db"),
+    )
+    if args.page_size:
+        env["HISTORY_PAGE_SIZE"] = str(args.page_size)
+    seqs = seed(env["SESSION_DB_PATH"], args.sizes)
+    app = subprocess.Popen(
+        [sys.executable, "benchmarks/serve_fake.py", "--port", str(args.port), "--documents", "10"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL,
+    )
+    try:
+        wait_until(lambda: port_open(args.port), 60, app)
+        wait_until(lambda: status(f"http://127.0.0.1:{args.port}/readyz") == 200, 60, app)
+        if app.poll() is not None:
+            raise SystemExit("the app did not start; run with --verbose to see why")
+        asyncio.run(run(f"ws://127.0.0.1:{args.port}", seqs, args, app.pid))
+    finally:
+        app.terminate()
+        app.wait()
+        server.stop()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Latency and payload size of image questions, end to end.
+
+Runs `uvicorn main:app` (from --backend-dir, so an older checkout can be
+measured the same way) against the fake OpenAI server, whose uplink is
+--uplink-mbps, and posts generated images to /send-message while a
+WebSocket viewer watches the session. Per case it reports:
+
+- upload: bytes posted by the browser;
+- payload: bytes of the chat request sent to the model;
+- first frame: POST until the viewer sees the first answer frame;
+- total: POST until the answer is complete.
+
+Cases are a phone photo (4032x3024 JPEG), a Retina screenshot (2880x1800
+PNG), five images at once, and the same screenshot sent again.
+
+    python benchmarks/bench_images.py --repeat 5 --uplink-mbps 20
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import numpy as np
+import websockets
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_startup import port_open, wait_until
+from fakes import FakeOpenAIServer
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def photo(seed: int, size=(4032, 3024)) -> bytes:
+    # Smooth shading plus sensor noise, so it compresses like a photo.
+    rng = np.random.default_rng(seed)
+    width, height = size
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([
+        127 + 100 * np.sin(x / (300 + 50 * c) + y / (410 - 40 * c) + seed) for c in range(3)
+    ], axis=-1)
+    pixels = np.clip(base + rng.normal(0, 12, base.shape), 0, 255).astype(np.uint8)
+    out = io.BytesIO()
+    Image.fromarray(pixels).save(out, "JPEG", quality=92)
+    return out.getvalue()
+
+
+def screenshot(seed: int, size=(2880, 1800)) -> bytes:
+    rng = np.random.default_rng(seed)
+    image = Image.new("RGB", size, (250, 250, 250))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, size[0], 90), fill=(40, 44, 52))
+    # A picture in the page, as most real screenshots have.
+    width, height = size[0] // 3, size[1] // 2
+    image.paste(Image.open(io.BytesIO(photo(seed, (width, height)))), (size[0] - width - 60, 150))
+    for row in range(120, size[1] - 40, 36):
+        indent = int(rng.integers(0, 6)) * 40
+        draw.text((60 + indent, row), " ".join("x" * int(n) for n in rng.integers(2, 12, 14)),
+                  fill=tuple(int(c) for c in rng.integers(0, 160, 3)), font_size=26)
+    out = io.BytesIO()
+    image.save(out, "PNG")
+    return out.getvalue()
+
+
+async def ask(base: str, ws_base: str, session: str, images: list) -> dict:
+    first = {}
+    done = asyncio.Event()
+    armed = False
+
+    async def watch():
+        nonlocal armed
+        async with websockets.connect(f"{ws_base}/ws/{session}", max_size=None) as ws:
+            ready.set()
+            while True:
+                frame = json.loads(await ws.recv())
+                # Earlier answers replayed from history are not this one.
+                if frame.get("role") != "assistant" or not armed:
+                    continue
+                first.setdefault("at", time.perf_counter())
+                if frame.get("is_complete"):
+                    first["done"] = time.perf_counter()
+                    first["timings"] = frame.get("timings") or {}
+                    done.set()
+                    return
+
+    ready = asyncio.Event()
+    watcher = asyncio.create_task(watch())
+    await ready.wait()
+    await asyncio.sleep(0.2)
+    armed = True
+    files = [("files", (f"image{i}", data, "image/jpeg")) for i, data in enumerate(images)]
+    started = time.perf_counter()
+    async with httpx.AsyncClient(timeout=120) as client:
+        response = await client.post(f"{base}/send-message", data={"sessionId": session, "message": "What is on this screen?"},
+                                     files=files)
+    response.raise_for_status()
+    await asyncio.wait_for(done.wait(), 30)
+    watcher.cancel()
+    return {
+        "first": first["at"] - started,
+        "total": first["done"] - started,
+        "upload": sum(len(data) for data in images),
+        "timings": first["timings"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--uplink-mbps", type=float, default=20.0)
+    parser.add_argument("--tokens", type=int, default=150)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--backend-dir", default=BACKEND_DIR)
+    args = parser.parse_args()
+
+    photos = [photo(seed) for seed in range(args.repeat + 4)]
+    shots = [screenshot(seed) for seed in range(args.repeat + 4)]
+    cases = [
+        ("photo", lambda r: [photos[r]]),
+        ("screenshot", lambda r: [shots[r]]),
+        ("5 images", lambda r: [photos[r], shots[r], photos[r + 1], shots[r + 1], photos[r + 2]]),
+        ("same screenshot again", lambda r: [shots[-1]]),
+    ]
+
+    tmp = tempfile.mkdtemp()
+    server = FakeOpenAIServer(tokens=args.tokens, first_token_delay=0.3, token_delay=0.01,
+                              upload_bandwidth=args.uplink_mbps * 1e6 / 8).start()
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="sk-fake",
+        OPENAI_BASE_URL=server.base_url,
+        CHROMA_PORT="1",
+        SESSION_DB_PATH=os.path.join(tmp, "sessions.db"),
+        EMBEDDING_CACHE_PATH=os.path.join(tmp, "embeddings.db"),
+        ANSWER_CACHE_PATH=os.path.join(tmp, "answers.db"),
+        MEMORY_DB_PATH=os.path.join(tmp, "memory.db"),
+    )
+    worker = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=args.backend_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base, ws_base = f"http://127.0.0.1:{args.port}", f"ws://127.0.0.1:{args.port}"
+    try:
+        wait_until(lambda: port_open(args.port), 60, worker)
+        print(f"uplink {args.uplink_mbps:g} Mbit/s, {args.tokens} tokens, median of {args.repeat}")
+        print(f"{'case':<22} {'upload':>8} {'payload':>8} {'prepare':>8} {'first frame':>12} {'total':>8}")
+        for name, images in cases:
+            again = name.endswith("again")
+            session = f"images-again-{time.time_ns()}"
+            if again:
+                # The first send fills the session's cache; the repeats are measured.
+                asyncio.run(ask(base, ws_base, session, images(0)))
+            rows = []
+            for r in range(args.repeat):
+                sent = len(server.chat_request_bytes)
+                row = asyncio.run(ask(base, ws_base, session if again else f"images-{r}-{time.time_ns()}", images(r)))
+                row["payload"] = sum(server.chat_request_bytes[sent:])
+                rows.append(row)
+            median = lambda key: statistics.median(row[key] for row in rows)
+            prepare = statistics.median(row["timings"].get("prepare_ms", float("nan")) for row in rows)
+            print(f"{name:<22} {median('upload') / 1e6:>7.2f}M {median('payload') / 1e6:>7.2f}M {prepare:>6.0f}ms "
+                  f"{median('first') * 1000:>10.0f}ms {median('total') * 1000:>6.0f}ms")
+    finally:
+        worker.terminate()
+        worker.wait()
+        server.stop()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Ingest throughput and idempotency against a local persistent Chroma and a
+fake embedder with per-call latency and a requests-per-second limit that
+answers 429 when exceeded.
+
+    python benchmarks/bench_ingest.py --qa 5000 --docs 20 --rps 20
+
+Runs, each against the same collection unless noted:
+  sequential   concurrency 1, fresh collection
+  parallel     --concurrency, fresh collection
+  rerun        no checkpoint: every chunk is found by content hash
+  one edit     one Markdown paragraph changed, with --prune
+  interrupted  the embedder dies partway, then the run is resumed
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ingest import Checkpoint, Ingester, hash_embedder
+from tokens import token_counter
+
+WORDS = (
+    "spark kafka airflow partition shuffle executor cluster warehouse snowflake schema pipeline batch "
+    "streaming latency throughput join skew cache index query optimizer replication backup terraform"
+).split()
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+    def __init__(self, wait: float):
+        super().__init__("429 Too Many Requests")
+        self.response = type("Response", (), {"headers": {"retry-after-ms": str(int(wait * 1000))}})()
+
+
+class FakeEmbedder:
+    def __init__(self, rps: float, call_latency: float, per_text: float, fail_after: int = 0):
+        self.embed = hash_embedder()
+        self.rps = rps
+        self.call_latency = call_latency
+        self.per_text = per_text
+        self.fail_after = fail_after
+        self.calls = 0
+        self.rejected = 0
+        self.window = []
+        self.lock = threading.Lock()
+
+    def __call__(self, texts):
+        with self.lock:
+            now = time.monotonic()
+            self.window = [t for t in self.window if now - t < 1.0]
+            if len(self.window) >= self.rps:
+                self.rejected += 1
+                raise RateLimited(1.0 - (now - self.window[0]))
+            self.window.append(now)
+            self.calls += 1
+            if self.fail_after and self.calls > self.fail_after:
+                raise RuntimeError("embedder went away")
+        time.sleep(self.call_latency + self.per_text * len(texts))
+        return self.embed(texts)
+
+
+def sentence(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(12, 30))).capitalize() + "."
+
+
+def write_corpus(root, qa: int, docs: int, rng):
+    os.makedirs(os.path.join(root, "notes"))
+    with open(os.path.join(root, "qa_bank.jsonl"), "w") as f:
+        for i in range(qa):
+            f.write(json.dumps({"question": f"Question {i}: {sentence(rng)}", "answer": sentence(rng) * 2}) + "\n")
+    for d in range(docs):
+        with open(os.path.join(root, "notes", f"note_{d:03}.md"), "w") as f:
+            for section in range(10):
+                f.write(f"# Section {section}\n\n")
+                for _ in range(20):
+                    f.write(" ".join(sentence(rng) for _ in range(3)) + "\n\n")
+    with open(os.path.join(root, "resume.txt"), "w") as f:
+        for page in range(30):
+            f.write("\n\n".join(" ".join(sentence(rng) for _ in range(4)) for _ in range(8)) + "\n\f")
+
+
+def run(name, collection, embedder, root, args, concurrency, checkpoint=None, prune=False):
+    ingester = Ingester(
+        collection, embedder, token_counter(), batch_size=args.batch_size, concurrency=concurrency,
+        checkpoint=Checkpoint(checkpoint), prune=prune, out=io.StringIO(),
+    )
+    try:
+        stats = ingester.run([root])
+        error = ""
+    except RuntimeError as e:
+        stats = {**ingester.stats, "seconds": time.monotonic() - ingester.started}
+        error = f"  ({e})"
+    print(
+        f"{name:<12} {stats['seconds']:>7.2f}s {stats['chunks']:>7} {stats['embedded']:>8} "
+        f"{stats['unchanged']:>9} {stats['resumed']:>7} {stats['pruned']:>6} {stats['retries']:>7} "
+        f"{stats['embedded'] / max(stats['seconds'], 1e-9):>8.0f}/s{error}"
+    )
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--qa", type=int, default=5000)
+    parser.add_argument("--docs", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rps", type=float, default=20)
+    parser.add_argument("--call-latency", type=float, default=0.15)
+    parser.add_argument("--per-text", type=float, default=0.001)
+    args = parser.parse_args()
+
+    import chromadb
+
+    tmp = tempfile.mkdtemp()
+    root = os.path.join(tmp, "corpus")
+    write_corpus(root, args.qa, args.docs, random.Random(0))
+    client = chromadb.PersistentClient(path=os.path.join(tmp, "chroma"))
+
+    def embedder(**kwargs):
+        return FakeEmbedder(args.rps, args.call_latency, args.per_text, **kwargs)
+
+    print(f"{'run':<12} {'time':>8} {'chunks':>7} {'embedded':>8} {'unchanged':>9} {'resumed':>7} "
+          f"{'pruned':>6} {'retries':>7} {'rate':>10}")
+    run("sequential", client.get_or_create_collection("seq", embedding_function=None), embedder(), root, args, 1)
+    collection = client.get_or_create_collection("par", embedding_function=None)
+    run("parallel", collection, embedder(), root, args, args.concurrency)
+    run("rerun", collection, embedder(), root, args, args.concurrency)
+
+    note = os.path.join(root, "notes", "note_000.md")
+    with open(note) as f:
+        text = f.read()
+    with open(note, "w") as f:
+        f.write(text.replace("\n\n", "\n\nAn edited paragraph about skew.\n\n", 1))
+    run("one edit", collection, embedder(), root, args, args.concurrency, prune=True)
+
+    fresh = client.get_or_create_collection("resume", embedding_function=None)
+    checkpoint = os.path.join(tmp, "checkpoint.json")
+    run("interrupted", fresh, embedder(fail_after=40), root, args, args.concurrency, checkpoint=checkpoint)
+    run("resumed", fresh, embedder(), root, args, args.concurrency, checkpoint=checkpoint)
+    print(f"collection sizes: par={collection.count()} resume={fresh.count()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+"""
+Load test of the whole answer path, with baselines to compare against.
+
+Starts the app (serve_fake.py: in-memory Chroma) against the fake OpenAI
+server, which streams --tokens tokens at --token-rate tokens/s after
+--first-token-ms and transcribes in --transcribe-ms. --sessions sessions
+each get --viewers WebSocket viewers and ask --questions questions in a
+row, all sessions at once; --audio-share of them are recordings posted to
+/ask-audio, the rest text to /send-message. Reports:
+
+- answers/s over the run, and the share of answers every viewer saw;
+- time to first token: question sent until a viewer sees answer text;
+- latency: question sent until a viewer has the final frame (p50/p95/p99);
+- bytes the app sent to viewers, per answer;
+- the app's CPU ms per answer, and its peak and final RSS.
+
+With --runs, the app is started afresh for each run and every result is
+the median over the runs.
+
+--save NAME stores the results, with the settings and host they came
+from, as baselines/NAME.json; --compare NAME runs with that baseline's
+settings and number of runs, and exits non-zero when a result is worse by more than
+--tolerance. Baselines only compare on the same host.
+
+    python benchmarks/bench_load.py --sessions 8 --viewers 3 --questions 5 --runs 3 --save default
+    python benchmarks/bench_load.py --compare default
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+
+import httpx
+import websockets
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_broadcast import cpu_seconds
+from bench_startup import port_open, status, wait_until
+from fakes import FakeOpenAIServer, percentile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+# Settings that change the results, and so are stored with a baseline.
+SETTINGS = ("sessions", "viewers", "questions", "audio_share", "tokens", "token_rate", "first_token_ms",
+            "transcribe_ms", "embed_ms", "chroma_latency", "documents")
+# Result -> whether a higher value is better.
+RESULTS = {
+    "answers_per_s": True,
+    "delivered": True,
+    "ttft_p50_ms": False,
+    "ttft_p95_ms": False,
+    "ttft_p99_ms": False,
+    "latency_p50_ms": False,
+    "latency_p95_ms": False,
+    "latency_p99_ms": False,
+    "bytes_per_answer": False,
+    "cpu_ms_per_answer": False,
+    "rss_peak_mb": False,
+    "rss_end_mb": False,
+}
+
+
+def recording(seconds: float = 2.0, rate: int = 16000) -> bytes:
+    out = io.BytesIO()
+    with wave.open(out, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(b"\x00\x00" * int(seconds * rate))
+    return out.getvalue()
+
+
+def rss_mb(pid: int, field: str) -> float:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+class Viewer:
+    """One WebSocket of a session: when each request's frames arrived, and the bytes received."""
+
+    def __init__(self):
+        self.first = {}
+        self.final = {}
+        self.bytes = 0
+        self.ready = asyncio.Event()
+
+    async def watch(self, url: str, stop: asyncio.Event):
+        async with websockets.connect(url, max_size=None) as ws:
+            self.ready.set()
+            while not stop.is_set():
+                try:
+                    raw = await asyncio.wait_for(ws.recv(), 0.2)
+                except asyncio.TimeoutError:
+                    continue
+                now = time.perf_counter()
+                self.bytes += len(raw)
+                frame = json.loads(raw)
+                request_id = frame.get("request_id")
+                if frame.get("role") != "assistant" or request_id is None:
+                    continue
+                self.first.setdefault(request_id, now)
+                if frame.get("is_complete"):
+                    self.final[request_id] = now
+
+
+async def run_load(base: str, ws_base: str, args, tag: str) -> dict:
+    stop = asyncio.Event()
+    sessions = [f"load-{tag}-{s}" for s in range(args.sessions)]
+    viewers = {session: [Viewer() for _ in range(args.viewers)] for session in sessions}
+    watchers = [
+        asyncio.create_task(viewer.watch(f"{ws_base}/ws/{session}", stop))
+        for session in sessions for viewer in viewers[session]
+    ]
+    await asyncio.wait_for(asyncio.gather(*(v.ready.wait() for vs in viewers.values() for v in vs)), 30)
+    audio = recording()
+    asked = {session: [] for session in sessions}
+    audio_every = round(1 / args.audio_share) if args.audio_share else 0
+
+    async def ask(client: httpx.AsyncClient, s: int, session: str):
+        for q in range(args.questions):
+            known = set(viewers[session][0].first)
+            started = time.perf_counter()
+            if audio_every and (s * args.questions + q) % audio_every == 0:
+                response = await client.post(f"{base}/ask-audio", data={"sessionId": session},
+                                             files={"file": ("question.wav", audio, "audio/wav")})
+            else:
+                response = await client.post(f"{base}/send-message", data={
+                    "sessionId": session, "message": f"{session} question {q}: how would you partition this table?",
+                })
+            response.raise_for_status()
+            # Questions of a session are asked one at a time, so the new
+            # request id the first viewer saw is this question's.
+            deadline = time.perf_counter() + 10
+            while time.perf_counter() < deadline:
+                new = set(viewers[session][0].first) - known
+                if new:
+                    asked[session].append((started, new.pop()))
+                    break
+                await asyncio.sleep(0.01)
+
+    started = time.perf_counter()
+    async with httpx.AsyncClient(timeout=120, limits=httpx.Limits(max_connections=args.sessions)) as client:
+        await asyncio.gather(*(ask(client, s, session) for s, session in enumerate(sessions)))
+    elapsed = time.perf_counter() - started
+    deadline = time.perf_counter() + 5
+    while time.perf_counter() < deadline:
+        if all(request_id in v.final for session in sessions for _, request_id in asked[session] for v in viewers[session]):
+            break
+        await asyncio.sleep(0.05)
+    stop.set()
+    await asyncio.gather(*watchers, return_exceptions=True)
+
+    ttft, latency = [], []
+    delivered = 0
+    for session in sessions:
+        for sent, request_id in asked[session]:
+            seen = [v for v in viewers[session] if request_id in v.final]
+            delivered += len(seen)
+            if seen:
+                ttft.append((min(v.first[request_id] for v in seen) - sent) * 1000)
+                latency.append((max(v.final[request_id] for v in seen) - sent) * 1000)
+    answers = args.sessions * args.questions
+    return {
+        "elapsed": elapsed,
+        "answers_per_s": answers / elapsed,
+        "delivered": delivered / (answers * args.viewers),
+        **{f"ttft_p{p}_ms": percentile(ttft, p) for p in (50, 95, 99)},
+        **{f"latency_p{p}_ms": percentile(latency, p) for p in (50, 95, 99)},
+        "bytes_per_answer": sum(v.bytes for vs in viewers.values() for v in vs) / answers,
+    }
+
+
+def measure(args) -> dict:
+    tmp = tempfile.mkdtemp()
+    server = FakeOpenAIServer(
+        tokens=args.tokens,
+        first_token_delay=args.first_token_ms / 1000,
+        token_delay=1 / args.token_rate if args.token_rate else 0.0,
+        transcribe_delay=args.transcribe_ms / 1000,
+        embed_delay=args.embed_ms / 1000,
+    ).start()
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="sk-fake",
+        OPENAI_BASE_URL=server.base_url,
+        ANSWER_CACHE_ENABLED="false",
+        SESSION_DB_PATH=os.path.join(tmp, "sessions.db"),
+        EMBEDDING_CACHE_PATH=os.path.join(tmp, "embeddings.db"),
+        MEMORY_DB_PATH=os.path.join(tmp, "memory.db"),
+    )
+    app = subprocess.Popen(
+        [sys.executable, "benchmarks/serve_fake.py", "--port", str(args.port), "--documents", str(args.documents),
+         "--chroma-latency", str(args.chroma_latency)],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL,
+    )
+    base, ws_base = f"http://127.0.0.1:{args.port}", f"ws://127.0.0.1:{args.port}"
+    try:
+        wait_until(lambda: port_open(args.port), 60, app)
+        wait_until(lambda: status(f"{base}/readyz") == 200, 60, app)
+        if app.poll() is not None:
+            raise SystemExit("the app did not start; run with --verbose to see why")
+        # One question first, so the upstream connections are open.
+        httpx.post(f"{base}/send-message", data={"sessionId": "load-warmup", "message": "warm up"}, timeout=60)
+        rss_start = rss_mb(app.pid, "VmRSS")
+        cpu = cpu_seconds([app.pid])
+        result = asyncio.run(run_load(base, ws_base, args, str(time.time_ns())))
+        result["cpu_ms_per_answer"] = (cpu_seconds([app.pid]) - cpu) / (args.sessions * args.questions) * 1000
+        result["rss_start_mb"] = rss_start
+        result["rss_peak_mb"] = rss_mb(app.pid, "VmHWM")
+        result["rss_end_mb"] = rss_mb(app.pid, "VmRSS")
+        return result
+    finally:
+        app.terminate()
+        app.wait()
+        server.stop()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def host() -> dict:
+    return {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()}
+
+
+def compare(baseline: dict, result: dict, tolerance: float) -> bool:
+    """Print each result against the baseline; False if any is worse by more than tolerance."""
+    ok = True
+    print(f"{'':<18} {'baseline':>10} {'now':>10} {'change':>8}")
+    for name, higher_is_better in RESULTS.items():
+        old, new = baseline["results"].get(name), result.get(name)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old if old else 0.0
+        worse = -change if higher_is_better else change
+        flag = ""
+        if worse > tolerance:
+            flag = "  worse"
+            ok = False
+        print(f"{name:<18} {old:>10.4g} {new:>10.4g} {change:>+7.1%}{flag}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--viewers", type=int, default=3)
+    parser.add_argument("--questions", type=int, default=5)
+    parser.add_argument("--audio-share", type=float, default=0.2)
+    parser.add_argument("--tokens", type=int, default=150)
+    parser.add_argument("--token-rate", type=float, default=100.0, help="tokens/s streamed by the fake model")
+    parser.add_argument("--first-token-ms", type=float, default=300.0)
+    parser.add_argument("--transcribe-ms", type=float, default=400.0)
+    parser.add_argument("--embed-ms", type=float, default=30.0)
+    parser.add_argument("--chroma-latency", type=float, default=0.005)
+    parser.add_argument("--documents", type=int, default=500)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--save", metavar="NAME")
+    parser.add_argument("--compare", metavar="NAME")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    parser.add_argument("--verbose", action="store_true", help="show the app's output")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f"{args.compare}.json")) as f:
+            baseline = json.load(f)
+        for name, value in baseline["settings"].items():
+            setattr(args, name, value)
+        args.runs = max(args.runs, baseline.get("runs", 1))
+        if baseline["host"] != host():
+            print(f"baseline was measured on {baseline['host']}, this is {host()}")
+
+    settings = {name: getattr(args, name) for name in SETTINGS}
+    print(", ".join(f"{name}={value}" for name, value in settings.items()))
+    runs = [measure(args) for _ in range(args.runs)]
+    result = {name: statistics.median(run[name] for run in runs) for name in runs[0]}
+    print(
+        f"answers/s {result['answers_per_s']:.2f}, delivered {result['delivered']:.1%}\n"
+        f"ttft      p50 {result['ttft_p50_ms']:.0f} ms, p95 {result['ttft_p95_ms']:.0f} ms, "
+        f"p99 {result['ttft_p99_ms']:.0f} ms\n"
+        f"latency   p50 {result['latency_p50_ms']:.0f} ms, p95 {result['latency_p95_ms']:.0f} ms, "
+        f"p99 {result['latency_p99_ms']:.0f} ms\n"
+        f"sent      {result['bytes_per_answer'] / 1024:.1f} KiB per answer\n"
+        f"cpu       {result['cpu_ms_per_answer']:.1f} ms per answer\n"
+        f"rss       {result['rss_start_mb']:.0f} MB before, {result['rss_peak_mb']:.0f} MB peak, "
+        f"{result['rss_end_mb']:.0f} MB after"
+    )
+
+    if args.save:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, f"{args.save}.json")
+        with open(path, "w") as f:
+            json.dump({"settings": settings, "runs": args.runs, "host": host(), "results": result}, f, indent=2)
+            f.write("\n")
+        print(f"saved {path}")
+    if baseline is not None and not compare(baseline, result, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Write throughput and reconnect-replay latency of the SQLite session store
+at different total history sizes.
+
+    python benchmarks/bench_session_store.py --totals 10000 1000000
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from session_store import BatchedWriter, SessionStore, new_row
+
+
+def fill(store: SessionStore, total: int, sessions: int, batch: int = 5000):
+    rows = []
+    for i in range(total):
+        rows.append(new_row(f"s{i % sessions}", "user" if i % 2 == 0 else "assistant", f"message {i} " * 8))
+        if len(rows) >= batch:
+            store.append_many(rows)
+            rows = []
+    store.append_many(rows)
+
+
+def bench_single_writes(store: SessionStore, count: int) -> float:
+    started = time.perf_counter()
+    for i in range(count):
+        store.append_many([new_row("single", "user", f"single write {i}")])
+    return count / (time.perf_counter() - started)
+
+
+async def bench_batched_writes(store: SessionStore, count: int, concurrency: int) -> float:
+    loop = asyncio.get_running_loop()
+
+    async def flush(rows):
+        return await loop.run_in_executor(None, store.append_many, rows)
+
+    writer = BatchedWriter(flush)
+
+    async def worker(n: int):
+        for i in range(count // concurrency):
+            await writer.submit(new_row(f"batched{n}", "user", f"batched write {i}"))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    return (count // concurrency * concurrency) / (time.perf_counter() - started)
+
+
+def bench_replay(store: SessionStore, session_id: str, repeats: int = 20):
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        rows = store.read(session_id)
+        timings.append(time.perf_counter() - started)
+    return len(rows), statistics.median(timings) * 1000, max(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--totals", type=int, nargs="+", default=[10_000, 1_000_000])
+    parser.add_argument("--sessions", type=int, default=500)
+    parser.add_argument("--writes", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    for total in args.totals:
+        with tempfile.TemporaryDirectory() as tmp:
+            store = SessionStore(os.path.join(tmp, "sessions.db"))
+            started = time.perf_counter()
+            fill(store, total, args.sessions)
+            fill_time = time.perf_counter() - started
+
+            single = bench_single_writes(store, args.writes)
+            batched = asyncio.run(bench_batched_writes(store, args.writes, args.concurrency))
+            count, p50, worst = bench_replay(store, "s0")
+
+            print(f"total={total:>9} bulk load: {total / fill_time:,.0f} msg/s")
+            print(f"  one transaction per message: {single:,.0f} msg/s")
+            print(f"  group commit, {args.concurrency} writers: {batched:,.0f} msg/s")
+            print(f"  replay of {count} messages: p50={p50:.2f}ms max={worst:.2f}ms")
+            store.close()
+
+
+if __name__ == "__main__":
+    main()
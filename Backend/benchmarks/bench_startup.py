@@ -0,0 +1,193 @@
+"""
+Startup time and upstream connections of one uvicorn worker.
+
+Runs `uvicorn main:app` against a real `chroma run` server and the fake
+OpenAI server, and reports:
+
+- import: seconds for `python -c "import main"` on its own;
+- bind: spawn until the port accepts connections;
+- ready: spawn until --ready-path answers 200 (with --chroma-down, from
+  Chroma coming back);
+- open connections to Chroma and to OpenAI after startup and after
+  --requests concurrent /send-message calls.
+
+With --chroma-down, Chroma is started only after the worker has been
+given --outage seconds, to show whether the app comes up without it and
+how long it takes to become ready once Chroma is back.
+
+    python benchmarks/bench_startup.py --runs 3 --requests 32
+"""
+import argparse
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import FakeOpenAIServer
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def connections(pid: int, port: int) -> int:
+    """Established TCP connections of a process to a local port."""
+    inodes = set()
+    for fd in os.listdir(f"/proc/{pid}/fd"):
+        try:
+            target = os.readlink(f"/proc/{pid}/fd/{fd}")
+        except OSError:
+            continue
+        if target.startswith("socket:["):
+            inodes.add(target[8:-1])
+    count = 0
+    for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+        with open(table) as f:
+            next(f)
+            for line in f:
+                fields = line.split()
+                if fields[3] == "01" and fields[9] in inodes and int(fields[2].split(":")[1], 16) == port:
+                    count += 1
+    return count
+
+
+def start_chroma(port: int, path: str) -> subprocess.Popen:
+    process = subprocess.Popen(
+        ["chroma", "run", "--path", path, "--port", str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    wait_until(lambda: httpx.get(f"http://localhost:{port}/api/v2/heartbeat").status_code == 200, 30)
+    return process
+
+
+def wait_until(check, timeout: float, process: subprocess.Popen = None) -> float:
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if process is not None and process.poll() is not None:
+            return float("nan")
+        try:
+            if check():
+                return time.perf_counter() - started
+        except Exception:
+            pass
+        time.sleep(0.01)
+    return float("nan")
+
+
+def port_open(port: int) -> bool:
+    with socket.socket() as s:
+        return s.connect_ex(("127.0.0.1", port)) == 0
+
+
+def status(url: str) -> int:
+    try:
+        return httpx.get(url, timeout=2).status_code
+    except httpx.HTTPError:
+        return 0
+
+
+def load(base: str, requests: int, run: int):
+    # New questions every run, so the answer and embedding caches miss.
+    def one(i: int):
+        httpx.post(f"{base}/send-message", data={"sessionId": f"startup-{i % 8}", "message": f"Run {run} question {i}?"},
+                   timeout=60)
+
+    threads = [threading.Thread(target=one, args=(i,)) for i in range(requests)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--chroma-port", type=int, default=8000)
+    parser.add_argument("--ready-path", default="/readyz")
+    parser.add_argument("--chroma-down", action="store_true")
+    parser.add_argument("--outage", type=float, default=5.0)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    server = FakeOpenAIServer(tokens=20, first_token_delay=0.05, token_delay=0.002, embed_delay=0.01).start()
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="sk-fake",
+        OPENAI_BASE_URL=server.base_url,
+        CHROMA_PORT=str(args.chroma_port),
+        SESSION_DB_PATH=os.path.join(tmp, "sessions.db"),
+        EMBEDDING_CACHE_PATH=os.path.join(tmp, "embeddings.db"),
+        ANSWER_CACHE_PATH=os.path.join(tmp, "answers.db"),
+        MEMORY_DB_PATH=os.path.join(tmp, "memory.db"),
+    )
+    chroma = None if args.chroma_down else start_chroma(args.chroma_port, os.path.join(tmp, "chroma"))
+    base = f"http://127.0.0.1:{args.port}"
+    rows = []
+    try:
+        imports = []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            result = subprocess.run([sys.executable, "-c", "import main"], cwd=BACKEND_DIR, env=env,
+                                    capture_output=True, timeout=120)
+            imports.append(time.perf_counter() - started if result.returncode == 0 else float("nan"))
+
+        for run in range(args.runs):
+            worker = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"],
+                cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            try:
+                bind = wait_until(lambda: port_open(args.port), 120, worker)
+                row = {"bind": bind}
+                if args.chroma_down:
+                    time.sleep(max(0.0, args.outage - bind))
+                    row["health"] = status(f"{base}/healthz")
+                    row["ready_during_outage"] = status(f"{base}{args.ready_path}")
+                    row["alive"] = worker.poll() is None
+                    chroma = start_chroma(args.chroma_port, os.path.join(tmp, "chroma"))
+                    row["ready"] = wait_until(lambda: status(f"{base}{args.ready_path}") == 200, 60, worker)
+                else:
+                    row["ready"] = bind + wait_until(lambda: status(f"{base}{args.ready_path}") == 200, 120, worker)
+                if worker.poll() is None:
+                    row["idle"] = (connections(worker.pid, args.chroma_port), connections(worker.pid, server.port))
+                    load(base, args.requests, run)
+                    row["loaded"] = (connections(worker.pid, args.chroma_port), connections(worker.pid, server.port))
+                rows.append(row)
+            finally:
+                worker.terminate()
+                worker.wait()
+                if args.chroma_down and chroma is not None:
+                    chroma.terminate()
+                    chroma.wait()
+                    chroma = None
+                    shutil.rmtree(os.path.join(tmp, "chroma"), ignore_errors=True)
+    finally:
+        if chroma is not None:
+            chroma.terminate()
+            chroma.wait()
+        server.stop()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    print(f"import main: {statistics.median(imports):.2f}s (median of {len(imports)})")
+    for i, row in enumerate(rows):
+        line = f"run {i}: bind {row['bind']:.2f}s ready {row['ready']:.2f}s"
+        if "health" in row:
+            line += (f" | during outage: alive={row['alive']} healthz={row['health']} "
+                     f"ready={row['ready_during_outage']}")
+        if "idle" in row:
+            line += (f" | connections chroma/openai idle {row['idle'][0]}/{row['idle'][1]}"
+                     f" after {args.requests} requests {row['loaded'][0]}/{row['loaded'][1]}")
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
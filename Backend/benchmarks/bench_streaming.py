@@ -0,0 +1,66 @@
+"""
+Bytes on the wire and event-loop time per answer for the "delta" and "full"
+stream protocols.
+
+    python benchmarks/bench_streaming.py --tokens 600 --viewers 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from streaming import AnswerStreamer, stream_answer, STREAM_PROTOCOL_DELTA, STREAM_PROTOCOL_FULL
+
+
+async def fake_llm(tokens: int, token_delay: float):
+    for i in range(tokens):
+        if token_delay:
+            await asyncio.sleep(token_delay)
+        yield f" tok{i}"
+
+
+async def run(protocol: str, tokens: int, viewers: int, token_delay: float, flush_interval: float, flush_chars: int):
+    stats = {"frames": 0, "bytes": 0}
+
+    async def send(frame: dict):
+        # One serialization per viewer, like send_json on every socket.
+        for _ in range(viewers):
+            stats["bytes"] += len(json.dumps(frame))
+        stats["frames"] += 1
+
+    streamer = AnswerStreamer(send, protocol=protocol, flush_interval=flush_interval, flush_chars=flush_chars)
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    await stream_answer(fake_llm(tokens, token_delay), streamer)
+    stats["cpu_ms"] = (time.process_time() - cpu) * 1000
+    stats["wall_ms"] = (time.perf_counter() - wall) * 1000
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=600)
+    parser.add_argument("--viewers", type=int, default=1)
+    parser.add_argument("--token-delay", type=float, default=0.0)
+    parser.add_argument("--flush-interval", type=float, default=0.05)
+    parser.add_argument("--flush-chars", type=int, default=64)
+    args = parser.parse_args()
+
+    configs = [
+        ("full, per token (old)", STREAM_PROTOCOL_FULL, 0.0, 1),
+        ("full, coalesced", STREAM_PROTOCOL_FULL, args.flush_interval, args.flush_chars),
+        ("delta, per token", STREAM_PROTOCOL_DELTA, 0.0, 1),
+        ("delta, coalesced", STREAM_PROTOCOL_DELTA, args.flush_interval, args.flush_chars),
+    ]
+    print(f"{'mode':<24}{'frames':>8}{'bytes':>12}{'cpu ms':>10}{'wall ms':>10}")
+    for name, protocol, interval, chars in configs:
+        stats = asyncio.run(run(protocol, args.tokens, args.viewers, args.token_delay, interval, chars))
+        print(f"{name:<24}{stats['frames']:>8}{stats['bytes']:>12}{stats['cpu_ms']:>10.2f}{stats['wall_ms']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
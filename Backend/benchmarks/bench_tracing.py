@@ -0,0 +1,114 @@
+"""
+Overhead of the per-question tracing.
+
+Times, in-process and with nothing else running:
+
+- a span with no trace current (the cost on paths outside a question);
+- a span inside a trace;
+- a whole question's worth of tracing: start, the spans the answer path
+  records (including one "broadcast" span per streamed frame), finish
+  with its histograms, and the JSONL line when --log is given;
+- rendering /metrics once every stage and kind has a series;
+
+then sets the per-question cost against --question-ms, a typical time
+for a question to be answered.
+
+    python benchmarks/bench_tracing.py --frames 60 --log
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tracing import Tracer, span
+
+STAGES = ("store", "embedding", "answer_cache", "vector_query", "context", "memory", "prompt", "store")
+
+
+def per_call(fn, repeat: int) -> float:
+    """Best of five runs of `repeat` calls, in microseconds per call."""
+    best = float("inf")
+    for _ in range(5):
+        started = time.perf_counter()
+        fn(repeat)
+        best = min(best, time.perf_counter() - started)
+    return best / repeat * 1e6
+
+
+def spans_outside(repeat: int):
+    for _ in range(repeat):
+        with span("embedding"):
+            pass
+
+
+def spans_inside(tracer: Tracer):
+    def run(repeat: int):
+        trace = tracer.start("text", "bench")
+        for _ in range(repeat):
+            with span("broadcast"):
+                pass
+        tracer.finish(trace)
+    return run
+
+
+def questions(tracer: Tracer, frames: int):
+    timings = {"first_token_ms": 420.0, "cache_hit": False, "prompt_tokens": 1800}
+
+    def run(repeat: int):
+        for _ in range(repeat):
+            trace = tracer.start("text", "bench")
+            for stage in STAGES:
+                with span(stage):
+                    pass
+            trace.add("llm_first_token", 400.0)
+            trace.add("llm_stream", 2000.0)
+            trace.attrs["tokens"] = 200
+            for _ in range(frames):
+                with span("broadcast"):
+                    pass
+            tracer.finish(trace, "ok", timings)
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20000)
+    parser.add_argument("--frames", type=int, default=60, help="frames streamed per answer")
+    parser.add_argument("--question-ms", type=float, default=2500.0)
+    parser.add_argument("--log", action="store_true", help="also write the JSONL trace log")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    log_path = os.path.join(tmp, "traces.jsonl") if args.log else None
+    tracer = Tracer(log_path)
+
+    async def run():
+        # Spans read the trace from a context variable, as they do in the app.
+        outside = per_call(spans_outside, args.repeat)
+        inside = per_call(spans_inside(tracer), args.repeat)
+        question = per_call(questions(tracer, args.frames), args.repeat // 50)
+        for kind in ("text", "audio", "image"):
+            tracer.finish(tracer.start(kind), "ok", {"first_token_ms": 1.0})
+        for frame in ("first", "final"):
+            tracer.report_render("bench", frame, 12.0)
+        scrape = per_call(lambda n: [tracer.render_prometheus() for _ in range(n)], 200)
+        return outside, inside, question, scrape
+
+    outside, inside, question, scrape = asyncio.run(run())
+    print(f"span, no trace:        {outside:8.2f} us")
+    print(f"span, in a trace:      {inside:8.2f} us")
+    print(f"question ({len(STAGES) + 2} spans + {args.frames} frames{', logged' if args.log else ''}): "
+          f"{question:8.1f} us = {question / 1000 / args.question_ms:.4%} of a {args.question_ms:g} ms question")
+    print(f"/metrics render:       {scrape:8.1f} us ({len(tracer.render_prometheus().splitlines())} lines)")
+    if log_path:
+        time.sleep(0.5)
+        with open(log_path) as f:
+            print(f"trace log:             {sum(1 for _ in f)} lines written")
+
+
+if __name__ == "__main__":
+    main()
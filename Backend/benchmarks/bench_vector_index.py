@@ -0,0 +1,235 @@
+"""
+Query latency and memory of the in-process vector index against Chroma's
+HTTP client, at several collection sizes.
+
+A `chroma run` server is started on a temporary path (or --chroma-port
+points at one already running) and loaded with clustered unit vectors.
+The local index is synced from it, float32 and int8. Above --http-max
+vectors loading through HTTP takes too long, so the local index is filled
+from a generated source with the same interface instead and Chroma is
+skipped. Recall is measured against an exact float32 search.
+
+    python benchmarks/bench_vector_index.py --sizes 1000 100000 1000000 --dim 1536
+
+RSS is what loading and querying added to the resident memory of the
+Chroma server (HTTP), or what opening the synced index and querying it
+added to a fresh process (local); mapped file pages count once read.
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import percentile
+from vector_index import LocalVectorIndex
+
+
+def rss(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+class GeneratedSource:
+    """Stand-in collection serving clustered unit vectors generated block by block."""
+
+    def __init__(self, size: int, dim: int, clusters: int = 256, block: int = 5000, seed: int = 0):
+        self.size = size
+        self.dim = dim
+        self.block = block
+        self.seed = seed
+        self.centers = np.random.default_rng(seed).standard_normal((clusters, dim)).astype(np.float32)
+        self.cached = (None, None)
+
+    def vectors(self, start: int, stop: int) -> np.ndarray:
+        parts = []
+        for number in range(start // self.block, (stop - 1) // self.block + 1):
+            if self.cached[0] != number:
+                rng = np.random.default_rng((self.seed, number))
+                rows = min(self.block, self.size - number * self.block)
+                block = self.centers[rng.integers(len(self.centers), size=rows)]
+                block = block + 0.6 * rng.standard_normal((rows, self.dim)).astype(np.float32)
+                self.cached = (number, block / np.linalg.norm(block, axis=1, keepdims=True))
+            low = max(start, number * self.block) - number * self.block
+            high = min(stop, (number + 1) * self.block) - number * self.block
+            parts.append(self.cached[1][low:high])
+        return np.concatenate(parts)
+
+    def get(self, ids=None, include=None, limit=None, offset=None):
+        if ids is None:
+            offset = offset or 0
+            positions = list(range(offset, min(self.size, offset + (limit or self.size))))
+        else:
+            positions = [int(i[1:]) for i in ids]
+        include = include or []
+        result = {"ids": [f"v{p}" for p in positions]}
+        result["documents"] = [f"Chunk {p} of the synthetic knowledge base." for p in positions] if "documents" in include else None
+        result["metadatas"] = [{"type": "text", "n": p} for p in positions] if "metadatas" in include else None
+        result["embeddings"] = None
+        if "embeddings" in include and positions:
+            if positions == list(range(positions[0], positions[0] + len(positions))):
+                result["embeddings"] = self.vectors(positions[0], positions[-1] + 1)
+            else:
+                result["embeddings"] = np.concatenate([self.vectors(p, p + 1) for p in positions])
+        return result
+
+    def queries(self, count: int, seed: int = 1) -> np.ndarray:
+        rng = np.random.default_rng(seed)
+        picks = rng.integers(self.size, size=count)
+        base = np.concatenate([self.vectors(p, p + 1) for p in picks])
+        noisy = base + 0.3 * rng.standard_normal(base.shape).astype(np.float32) / np.sqrt(self.dim)
+        return noisy / np.linalg.norm(noisy, axis=1, keepdims=True)
+
+
+def start_chroma(port: int, path: str):
+    process = subprocess.Popen(
+        ["chroma", "run", "--path", path, "--port", str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    import chromadb
+
+    for _ in range(100):
+        try:
+            client = chromadb.HttpClient(host="localhost", port=port)
+            client.heartbeat()
+            return process, client
+        except Exception:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("chroma did not start")
+
+
+def load_chroma(client, source: GeneratedSource):
+    name = f"bench_{source.size}_{source.dim}"
+    try:
+        client.delete_collection(name)
+    except Exception:
+        pass
+    collection = client.create_collection(name, embedding_function=None)
+    batch = min(client.get_max_batch_size(), 5000)
+    for start in range(0, source.size, batch):
+        stop = min(source.size, start + batch)
+        page = source.get(ids=[f"v{p}" for p in range(start, stop)], include=["documents", "metadatas", "embeddings"])
+        collection.add(ids=page["ids"], documents=page["documents"], metadatas=page["metadatas"],
+                       embeddings=page["embeddings"])
+    return collection
+
+
+def time_queries(index, queries: np.ndarray, k: int):
+    latencies, found = [], []
+    index.query(query_embeddings=[queries[0].tolist()], n_results=k)
+    for query in queries:
+        started = time.perf_counter()
+        result = index.query(query_embeddings=[query.tolist()], n_results=k,
+                             include=["documents", "metadatas", "distances"])
+        latencies.append(time.perf_counter() - started)
+        found.append(result["ids"][0])
+    return latencies, found
+
+
+def sync_local(sender, target, port: int, path: str, quantize: bool):
+    if isinstance(target, str):
+        import chromadb
+
+        target = chromadb.HttpClient(host="localhost", port=port).get_collection(target)
+    started = time.perf_counter()
+    LocalVectorIndex(target, path, quantize=quantize, refresh_interval=0).refresh()
+    sender.send(time.perf_counter() - started)
+
+
+def query_local(sender, path: str, quantize: bool, queries: np.ndarray, k: int):
+    # Reopens the synced files in a fresh process, as after a restart, so
+    # its RSS growth is the index alone and not the sync's parsing.
+    baseline = rss(os.getpid())
+    index = LocalVectorIndex(None, path, quantize=quantize, space="l2", refresh_interval=0)
+    latencies, found = time_queries(index, queries, k)
+    sender.send((latencies, found, rss(os.getpid()) - baseline, index.stats()["vector_bytes"]))
+
+
+def in_child(target, *args):
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    child = multiprocessing.get_context("fork").Process(target=target, args=(sender, *args))
+    child.start()
+    result = receiver.recv()
+    child.join()
+    return result
+
+
+def recall(found, exact) -> float:
+    return float(np.mean([len(set(f) & set(e)) / len(e) for f, e in zip(found, exact)]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000, 1000000])
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--http-max", type=int, default=100000)
+    parser.add_argument("--chroma-port", type=int, default=0, help="use a running Chroma on this port")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    process = None
+    if args.chroma_port:
+        import chromadb
+
+        port = args.chroma_port
+        client = chromadb.HttpClient(host="localhost", port=port)
+    else:
+        port = 8123
+        process, client = start_chroma(port, os.path.join(tmp, "chroma"))
+    server_baseline = rss(process.pid) if process else 0
+
+    print(f"{'vectors':>8} {'backend':<13} {'load':>7} {'p50':>9} {'p99':>9} {'recall':>7} {'rss':>8} {'on disk':>8}")
+    try:
+        for size in args.sizes:
+            source = GeneratedSource(size, args.dim)
+            queries = source.queries(args.queries)
+            rows = []
+            collection = None
+            if size <= args.http_max:
+                started = time.perf_counter()
+                collection = load_chroma(client, source)
+                load = time.perf_counter() - started
+                latencies, found = time_queries(collection, queries, args.k)
+                server = rss(process.pid) - server_baseline if process else 0
+                rows.append(("chroma http", load, latencies, found, server, None))
+
+            for quantize in (False, True):
+                path = os.path.join(tmp, f"index_{size}_{quantize}")
+                load = in_child(sync_local, collection.name if collection else source, port, path, quantize)
+                latencies, found, memory, disk = in_child(query_local, path, quantize, queries, args.k)
+                rows.append((f"local {'int8' if quantize else 'float32'}", load, latencies, found, memory, disk))
+                for name in os.listdir(tmp):
+                    if name.startswith(os.path.basename(path)):
+                        os.remove(os.path.join(tmp, name))
+            if collection is not None:
+                client.delete_collection(collection.name)
+
+            exact = next(found for name, _, _, found, _, _ in rows if name == "local float32")
+            for name, load, latencies, found, memory, disk in rows:
+                print(
+                    f"{size:>8} {name:<13} {load:>6.1f}s {percentile(latencies, 50) * 1000:>7.2f}ms "
+                    f"{percentile(latencies, 99) * 1000:>7.2f}ms {recall(found, exact):>7.3f} "
+                    f"{memory / 1e6:>6.0f}MB {'' if disk is None else f'{disk / 1e6:.0f}MB':>8}"
+                )
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
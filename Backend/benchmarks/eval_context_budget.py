@@ -0,0 +1,148 @@
+"""
+Offline comparison of context budgets: prompt size, chunks kept, context
+assembly time, time to first token and answer time, plus how often the
+stored answer for the question itself made it into the context.
+
+The knowledge base is synthetic: for every question in the log an answer,
+two near-duplicate copies of it (as re-ingestion leaves behind) and a few
+related notes, and unrelated filler. Embeddings are bag-of-words, and the
+fake model's time to first token grows with prompt size (--prefill-per-1k).
+
+    python benchmarks/eval_context_budget.py --budgets 0 400 800 1600
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import FakeOpenAIServer, bag_of_words_embedding, install_fake_chroma
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "questions.jsonl")
+VOCABULARY = (
+    "spark kafka airflow partition shuffle executor cluster warehouse snowflake schema "
+    "pipeline batch streaming latency throughput join skew cache index query optimizer "
+    "replication backup terraform kubernetes docker monitoring alert sla cost storage parquet "
+    "delta lake hive presto dbt lineage quality contract incremental merge upsert window"
+).split()
+
+
+def load_questions(path: str):
+    with open(path) as f:
+        return list(dict.fromkeys(json.loads(line)["question"] for line in f if line.strip()))
+
+
+def paragraph(rng: random.Random, seed_words, words: int) -> str:
+    pool = list(seed_words) * 3 + VOCABULARY
+    return " ".join(rng.choice(pool) for _ in range(words)) + "."
+
+
+def seed_corpus(collection, questions, filler: int, rng: random.Random):
+    ids, docs, metas = [], [], []
+
+    def add(doc_id, doc, meta):
+        ids.append(doc_id)
+        docs.append(doc)
+        metas.append(meta)
+
+    for i, question in enumerate(questions):
+        words = [w for w in question.lower().strip("?.").split() if len(w) > 3]
+        answer = paragraph(rng, words, 120)
+        add(f"gold-{i}", answer, {"type": "qa", "question": question})
+        for copy in range(2):
+            add(f"dup-{i}-{copy}", answer + f" Noted again in revision {copy}.", {"type": "qa", "question": question})
+        for note in range(3):
+            add(f"note-{i}-{note}", f"Resume note: {paragraph(rng, words, 90)}", {"type": "text"})
+    for j in range(filler):
+        add(f"filler-{j}", f"Resume note: {paragraph(rng, [], 90)}", {"type": "text"})
+    collection.upsert(
+        ids=ids, documents=docs, metadatas=metas,
+        embeddings=[bag_of_words_embedding(f"{m.get('question', '')} {d}") for d, m in zip(docs, metas)],
+    )
+    return {question: docs[ids.index(f"gold-{i}")] for i, question in enumerate(questions)}
+
+
+async def evaluate(main, questions, gold, builder):
+    main.context_builder = builder
+    rows = []
+    for n, question in enumerate(questions):
+        timings = {}
+        await main.answer_question(f"eval-{id(builder)}-{n}", question, timings=timings)
+        retrieval = await main.retrieve_context(question)
+        rows.append((timings, gold[question][:80] in retrieval["context"]))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--log", default=DATA)
+    parser.add_argument("--budgets", type=int, nargs="+", default=[0, 400, 800, 1600])
+    parser.add_argument("--filler", type=int, default=300)
+    parser.add_argument("--first-token-delay", type=float, default=0.15)
+    parser.add_argument("--prefill-per-1k", type=float, default=0.03)
+    parser.add_argument("--tokens", type=int, default=60)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ.update(
+        SESSION_DB_PATH=os.path.join(tmp, "sessions.db"),
+        EMBEDDING_CACHE_PATH=os.path.join(tmp, "embeddings.db"),
+        ANSWER_CACHE_ENABLED="false",
+        MEMORY_STORE="memory",
+    )
+    server = FakeOpenAIServer(
+        tokens=args.tokens,
+        first_token_delay=args.first_token_delay,
+        token_delay=0.002,
+        prefill_per_1k=args.prefill_per_1k,
+        embed=bag_of_words_embedding,
+    ).start()
+    server.install_env()
+    install_fake_chroma()
+
+    import main as app
+    from context_builder import ContextBuilder
+
+    questions = load_questions(args.log)
+    gold = seed_corpus(app.collection(), questions, args.filler, random.Random(0))
+
+    configs = [("all 20, as before", ContextBuilder(
+        app.count_tokens, token_budget=0, dedup_threshold=1.0, rerank=False, distance_margin=0))]
+    for budget in args.budgets:
+        if budget:
+            configs.append((f"budget {budget}", ContextBuilder(app.count_tokens, token_budget=budget)))
+        else:
+            configs.append(("no budget", ContextBuilder(app.count_tokens, token_budget=0)))
+
+    print(f"{'config':<18} {'prompt tok':>10} {'context tok':>11} {'chunks':>6} {'assembly':>9} "
+          f"{'ttft p50':>9} {'answer p50':>10} {'gold kept':>9}")
+
+    async def run_all():
+        # One loop for every config: the app's AsyncOpenAI client keeps its
+        # connections on the loop that opened them.
+        for name, builder in configs:
+            rows = await evaluate(app, questions, gold, builder)
+            stats = builder.stats()
+            timings = [t for t, _ in rows]
+            print(
+                f"{name:<18} {statistics.median(t['prompt_tokens'] for t in timings):>10.0f} "
+                f"{statistics.median(t['context_tokens'] for t in timings):>11.0f} "
+                f"{stats['chunks_kept_avg']:>6.1f} {stats['assembly_ms_avg']:>7.2f}ms "
+                f"{statistics.median(t['first_token_ms'] for t in timings):>7.0f}ms "
+                f"{statistics.median(t['total_ms'] for t in timings):>8.0f}ms "
+                f"{sum(kept for _, kept in rows) / len(rows):>8.0%}"
+            )
+
+    try:
+        asyncio.run(run_all())
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
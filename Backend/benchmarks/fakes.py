@@ -0,0 +1,365 @@
+"""
+Local stand-ins for Chroma and the OpenAI API used by the benchmarks.
+
+FakeChromaClient mimics the synchronous chromadb.HttpClient, including a
+blocking per-call latency. FakeOpenAIServer is a small HTTP server, run in
+its own thread, that speaks enough of the OpenAI REST API for chat
+completions (streaming or not), embeddings, Whisper transcriptions and
+the model list.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+
+def fake_embedding(text: str, dim: int = 64):
+    """Deterministic unit vector derived from the text's hash."""
+    values = []
+    counter = 0
+    while len(values) < dim:
+        digest = hashlib.sha256(f"{counter}:{text}".encode()).digest()
+        values.extend((b - 127.5) / 127.5 for b in digest)
+        counter += 1
+    values = values[:dim]
+    norm = sum(v * v for v in values) ** 0.5 or 1.0
+    return [v / norm for v in values]
+
+
+def bag_of_words_embedding(text: str, dim: int = 256):
+    """Hashing-trick unit vector, so texts sharing words land close together."""
+    vector = [0.0] * dim
+    for word in re.findall(r"[a-z0-9]+", text.lower()):
+        vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % dim] += 1.0
+    norm = sum(v * v for v in vector) ** 0.5 or 1.0
+    return [v / norm for v in vector]
+
+
+def _matches(meta: dict, where: dict) -> bool:
+    if not where:
+        return True
+    for key, cond in where.items():
+        if key == "$and":
+            if not all(_matches(meta, c) for c in cond):
+                return False
+        elif isinstance(cond, dict):
+            op, value = next(iter(cond.items()))
+            if op == "$eq" and meta.get(key) != value:
+                return False
+            if op == "$in" and meta.get(key) not in value:
+                return False
+        elif meta.get(key) != cond:
+            return False
+    return True
+
+
+class FakeCollection:
+    def __init__(self, name: str, latency: float = 0.0, embedding_function=None):
+        self.name = name
+        self.latency = latency
+        self.embedding_function = embedding_function
+        self.records = {}
+        self.lock = threading.Lock()
+
+    def _wait(self):
+        # Blocking on purpose: the real HttpClient holds the calling thread.
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _embed(self, texts):
+        return [fake_embedding(t) for t in texts]
+
+    def count(self):
+        self._wait()
+        return len(self.records)
+
+    def add(self, ids, documents=None, metadatas=None, embeddings=None):
+        self.upsert(ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+
+    def upsert(self, ids, documents=None, metadatas=None, embeddings=None):
+        self._wait()
+        documents = documents or [None] * len(ids)
+        metadatas = metadatas or [{}] * len(ids)
+        embeddings = embeddings or self._embed([d or "" for d in documents])
+        with self.lock:
+            for i, doc, meta, emb in zip(ids, documents, metadatas, embeddings):
+                self.records[i] = (doc, dict(meta or {}), list(emb))
+
+    def delete(self, ids=None, where=None):
+        self._wait()
+        with self.lock:
+            for i in list(self.records):
+                if (ids is not None and i in ids) or (ids is None and _matches(self.records[i][1], where)):
+                    del self.records[i]
+
+    def get(self, ids=None, where=None, include=None, limit=None, offset=None):
+        self._wait()
+        with self.lock:
+            items = [
+                (i, r) for i, r in self.records.items()
+                if (ids is None or i in ids) and _matches(r[1], where)
+            ]
+        if offset:
+            items = items[offset:]
+        if limit is not None:
+            items = items[:limit]
+        return {
+            "ids": [i for i, _ in items],
+            "documents": [r[0] for _, r in items],
+            "metadatas": [r[1] for _, r in items],
+            "embeddings": [r[2] for _, r in items],
+        }
+
+    def query(self, query_texts=None, query_embeddings=None, n_results=10, where=None, include=None):
+        self._wait()
+        if query_embeddings is None:
+            query_embeddings = self._embed(query_texts)
+        with self.lock:
+            items = [(i, r) for i, r in self.records.items() if _matches(r[1], where)]
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for q in query_embeddings:
+            scored = sorted(
+                ((1 - sum(a * b for a, b in zip(q, r[2])), i, r) for i, r in items),
+                key=lambda x: x[0],
+            )[:n_results]
+            result["ids"].append([i for _, i, _ in scored])
+            result["documents"].append([r[0] for _, _, r in scored])
+            result["metadatas"].append([r[1] for _, _, r in scored])
+            result["distances"].append([d for d, _, _ in scored])
+        return result
+
+
+class FakeChromaClient:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.collections = {}
+
+    def heartbeat(self):
+        return int(time.time() * 1e9)
+
+    def get_or_create_collection(self, name, embedding_function=None, metadata=None):
+        if name not in self.collections:
+            self.collections[name] = FakeCollection(name, self.latency, embedding_function)
+        return self.collections[name]
+
+    def get_collection(self, name, embedding_function=None):
+        return self.collections[name]
+
+
+def install_fake_chroma(latency: float = 0.0) -> FakeChromaClient:
+    """Make chromadb.HttpClient return one shared in-memory stand-in."""
+    import chromadb
+
+    fake = FakeChromaClient(latency)
+    chromadb.HttpClient = lambda *args, **kwargs: fake
+    return fake
+
+
+def seed_knowledge(collection, count: int = 200):
+    ids, docs, metas = [], [], []
+    for i in range(count):
+        ids.append(f"seed-{i}")
+        if i % 2:
+            docs.append(f"Answer number {i} about partitioning, caching and pipelines.")
+            metas.append({"type": "qa", "question": f"Question number {i}?"})
+        else:
+            docs.append(f"Resume note {i}: built streaming pipelines and tuned clusters.")
+            metas.append({"type": "text"})
+    collection.upsert(ids=ids, documents=docs, metadatas=metas)
+
+
+class FakeOpenAIServer:
+    """
+    OpenAI-compatible HTTP server with configurable latencies.
+
+    first_token_delay is the wait before the first streamed token, plus
+    prefill_per_1k for every 1000 prompt tokens (about 4 characters each);
+    token_delay is the gap between tokens. transcribe_delay and embed_delay
+    model the Whisper and embedding calls, and embed maps text to vectors.
+    With upload_bandwidth (bytes/s), a chat request also waits for its body
+    to cross the uplink, as image payloads do; chat_request_bytes records
+    the size of each.
+    """
+
+    def __init__(
+        self,
+        tokens: int = 200,
+        first_token_delay: float = 0.2,
+        token_delay: float = 0.01,
+        transcribe_delay: float = 0.5,
+        embed_delay: float = 0.05,
+        transcript: str = "Tell me about Spark partitioning.",
+        prefill_per_1k: float = 0.0,
+        embed=fake_embedding,
+        upload_bandwidth: float = 0.0,
+    ):
+        self.tokens = tokens
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.transcribe_delay = transcribe_delay
+        self.embed_delay = embed_delay
+        self.transcript = transcript
+        self.prefill_per_1k = prefill_per_1k
+        self.embed = embed
+        self.upload_bandwidth = upload_bandwidth
+        self.chat_request_bytes = []
+        self.calls = {"chat": 0, "embeddings": 0, "transcriptions": 0}
+        self.embedded_inputs = 0
+        self.port = None
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._started = threading.Event()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def stop(self):
+        if not self._loop:
+            return
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result(timeout=5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+    async def _shutdown(self):
+        self._server.close()
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def install_env(self):
+        os.environ["OPENAI_API_KEY"] = "sk-fake"
+        os.environ["OPENAI_BASE_URL"] = self.base_url
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle, "127.0.0.1", 0)
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._started.set()
+        self._loop.run_forever()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, value = line.decode().split(":", 1)
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                await self._route(method, path, headers, body, writer)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method, path, headers, body, writer):
+        if path.endswith("/chat/completions"):
+            self.calls["chat"] += 1
+            self.chat_request_bytes.append(len(body))
+            if self.upload_bandwidth:
+                await asyncio.sleep(len(body) / self.upload_bandwidth)
+            payload = json.loads(body or b"{}")
+            prompt_chars = sum(
+                len(m["content"]) for m in payload.get("messages", []) if isinstance(m.get("content"), str)
+            )
+            first_token_delay = self.first_token_delay + self.prefill_per_1k * prompt_chars / 4000
+            if payload.get("stream"):
+                await self._stream_chat(writer, first_token_delay)
+            else:
+                await asyncio.sleep(first_token_delay + self.token_delay * self.tokens)
+                text = " ".join(f"word{i}" for i in range(self.tokens))
+                await self._json(writer, {
+                    "id": "chatcmpl-fake", "object": "chat.completion", "created": 0,
+                    "model": payload.get("model", "fake"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": text}}],
+                })
+        elif path.endswith("/embeddings"):
+            self.calls["embeddings"] += 1
+            payload = json.loads(body or b"{}")
+            inputs = payload.get("input", [])
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            self.embedded_inputs += len(inputs)
+            await asyncio.sleep(self.embed_delay)
+            await self._json(writer, {
+                "object": "list", "model": payload.get("model", "fake"),
+                "data": [{"object": "embedding", "index": i, "embedding": self.embed(str(t))}
+                         for i, t in enumerate(inputs)],
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            })
+        elif path.endswith("/models"):
+            await self._json(writer, {"object": "list", "data": [{"id": "gpt-4o-mini", "object": "model"}]})
+        elif path.endswith("/audio/transcriptions"):
+            self.calls["transcriptions"] += 1
+            await asyncio.sleep(self.transcribe_delay)
+            await self._json(writer, {"text": self.transcript})
+        else:
+            await self._json(writer, {"error": "not found"}, status="404 Not Found")
+
+    async def _json(self, writer, payload, status="200 OK"):
+        data = json.dumps(payload).encode()
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n\r\n".encode() + data
+        )
+        await writer.drain()
+
+    async def _stream_chat(self, writer, first_token_delay: float):
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+            b"Transfer-Encoding: chunked\r\n\r\n"
+        )
+        await asyncio.sleep(first_token_delay)
+        chunk_id = f"chatcmpl-{uuid.uuid4().hex[:8]}"
+        for i in range(self.tokens):
+            event = {
+                "id": chunk_id, "object": "chat.completion.chunk", "created": 0, "model": "fake",
+                "choices": [{"index": 0, "delta": {"content": f" word{i}"}, "finish_reason": None}],
+            }
+            self._chunk(writer, f"data: {json.dumps(event)}\n\n".encode())
+            await writer.drain()
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+        self._chunk(writer, b"data: [DONE]\n\n")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    @staticmethod
+    def _chunk(writer, data: bytes):
+        writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
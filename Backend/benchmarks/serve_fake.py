@@ -0,0 +1,39 @@
+"""
+Runs `main:app` with an in-memory Chroma, for load tests.
+
+The stand-in (fakes.FakeChromaClient) replaces chromadb.HttpClient in this
+process before the app first asks for a client, and mixed_content is
+seeded with --documents records; every Chroma call blocks for
+--chroma-latency seconds, as a request to the real server would. Point
+OPENAI_BASE_URL at a FakeOpenAIServer for the model, embeddings and
+Whisper.
+
+    OPENAI_BASE_URL=http://127.0.0.1:9000/v1 python benchmarks/serve_fake.py --port 8765
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import BACKEND_DIR, install_fake_chroma, seed_knowledge
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--documents", type=int, default=500)
+    parser.add_argument("--chroma-latency", type=float, default=0.005)
+    args = parser.parse_args()
+
+    chroma = install_fake_chroma(args.chroma_latency)
+    seed_knowledge(chroma.get_or_create_collection("mixed_content"), args.documents)
+
+    import uvicorn
+
+    os.chdir(BACKEND_DIR)
+    uvicorn.run("main:app", host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+import asyncio
+import json
+from collections import deque
+from typing import Callable, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+Deliver = Callable[[str, dict], None]
+
+
+class ReplyError(Exception):
+    """An error reply from the broker."""
+
+
+def encode(*parts) -> bytes:
+    """A Redis protocol array of bulk strings, integers as integer replies."""
+    out = [b"*%d\r\n" % len(parts)]
+    for part in parts:
+        if isinstance(part, int):
+            out.append(b":%d\r\n" % part)
+            continue
+        if isinstance(part, str):
+            part = part.encode()
+        out.append(b"$%d\r\n%s\r\n" % (len(part), part))
+    return b"".join(out)
+
+
+async def read_reply(reader: asyncio.StreamReader):
+    """
+    One Redis protocol value: bulk strings come back as bytes, arrays as
+    lists, and error replies as a ReplyError instance rather than raised,
+    so a stream of replies can carry on past one.
+    """
+    line = await reader.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("broker closed the connection")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"$":
+        size = int(rest)
+        return None if size < 0 else (await reader.readexactly(size + 2))[:-2]
+    if kind == b"*":
+        size = int(rest)
+        return None if size < 0 else [await read_reply(reader) for _ in range(size)]
+    if kind == b":":
+        return int(rest)
+    if kind == b"+":
+        return rest.decode()
+    if kind == b"-":
+        return ReplyError(rest.decode())
+    raise ConnectionError(f"unexpected reply from broker: {line[:64]!r}")
+
+
+async def open_url(url: str) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """Connect to unix:///path/to.sock or redis://host:port."""
+    parsed = urlparse(url)
+    if parsed.scheme == "unix":
+        return await asyncio.open_unix_connection(parsed.path)
+    if parsed.scheme in ("redis", "tcp"):
+        return await asyncio.open_connection(parsed.hostname or "localhost", parsed.port or 6379)
+    raise ValueError(f"Unsupported broadcast URL: {url}")
+
+
+class InProcessBroadcast:
+    """Frames go straight to this process's sockets; for a single worker."""
+
+    def __init__(self):
+        self.deliver: Optional[Deliver] = None
+        self.published = 0
+
+    async def start(self):
+        pass
+
+    async def subscribe(self, session_id: str):
+        pass
+
+    def unsubscribe(self, session_id: str):
+        pass
+
+    def has_viewers(self, session_id: str) -> bool:
+        """Whether another worker has sockets for the session; there are none."""
+        return False
+
+    async def publish(self, session_id: str, message: dict):
+        self.published += 1
+        self.deliver(session_id, message)
+
+    async def close(self):
+        pass
+
+    def metrics(self) -> dict:
+        return {"backend": "local", "published": self.published}
+
+
+class BrokerBroadcast:
+    """
+    Frames go through a pub/sub broker, one channel per session, so a frame
+    published by any worker reaches the sockets held by every other.
+
+    Speaks the Redis protocol (PUBLISH, SUBSCRIBE), so the broker is Redis
+    or broker.py. Each worker keeps two connections: one it publishes on,
+    one subscribed to the sessions it holds sockets for. The broker handles
+    commands one at a time and writes to each subscriber in that order, so
+    every viewer of a session, on any worker, sees its frames in the same
+    order.
+
+    While the broker is unreachable, frames still reach this worker's own
+    sockets (counted as local_fallback) and the connections are retried
+    with backoff; subscriptions are restored once they are back.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        channel_prefix: str = "session:",
+        subscribe_timeout: float = 2.0,
+        retry_interval: float = 0.5,
+        max_interval: float = 5.0,
+    ):
+        self.url = url
+        self.channel_prefix = channel_prefix
+        self.subscribe_timeout = subscribe_timeout
+        self.retry_interval = retry_interval
+        self.max_interval = max_interval
+        self.deliver: Optional[Deliver] = None
+
+        # Session id -> future resolved once the broker confirms the subscription.
+        self.sessions: Dict[str, asyncio.Future] = {}
+        # Sessions published to, awaiting the broker's receiver count, and
+        # those whose last frame reached no worker.
+        self.pending = deque()
+        self.unheard = set()
+        self.publisher: Optional[asyncio.StreamWriter] = None
+        self.subscriber: Optional[asyncio.StreamWriter] = None
+        self.task = None
+
+        self.published = 0
+        self.received = 0
+        self.local_fallback = 0
+        self.publish_errors = 0
+        self.connects = 0
+        self.last_error = None
+
+    def _channel(self, session_id: str) -> bytes:
+        return (self.channel_prefix + session_id).encode()
+
+    async def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        delay = self.retry_interval
+        while True:
+            writers = []
+            try:
+                pub_reader, publisher = await open_url(self.url)
+                writers.append(publisher)
+                sub_reader, subscriber = await open_url(self.url)
+                writers.append(subscriber)
+                if self.sessions:
+                    subscriber.write(encode(b"SUBSCRIBE", *(self._channel(s) for s in self.sessions)))
+                self.publisher, self.subscriber = publisher, subscriber
+                self.connects += 1
+                self.last_error = None
+                delay = self.retry_interval
+                readers = [
+                    asyncio.create_task(self._read_replies(pub_reader)),
+                    asyncio.create_task(self._read_messages(sub_reader)),
+                ]
+                try:
+                    done, _ = await asyncio.wait(readers, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        task.result()
+                finally:
+                    for task in readers:
+                        task.cancel()
+            except asyncio.CancelledError:
+                raise
+            except (OSError, asyncio.IncompleteReadError) as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+            finally:
+                self.publisher = self.subscriber = None
+                self.pending.clear()
+                for writer in writers:
+                    writer.close()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_interval)
+
+    async def _read_replies(self, reader: asyncio.StreamReader):
+        # PUBLISH answers, in order, with the number of workers subscribed.
+        while True:
+            reply = await read_reply(reader)
+            session_id = self.pending.popleft() if self.pending else None
+            if isinstance(reply, ReplyError):
+                self.publish_errors += 1
+            elif session_id is not None and reply == 0:
+                if len(self.unheard) >= 10000:
+                    self.unheard.clear()
+                self.unheard.add(session_id)
+            elif session_id is not None:
+                self.unheard.discard(session_id)
+
+    async def _read_messages(self, reader: asyncio.StreamReader):
+        prefix = len(self.channel_prefix)
+        while True:
+            reply = await read_reply(reader)
+            if not isinstance(reply, list) or len(reply) < 3:
+                continue
+            kind, channel = reply[0], reply[1].decode()[prefix:]
+            if kind == b"message":
+                self.received += 1
+                # Decoded once and shared by every socket of the session.
+                self.deliver(channel, json.loads(reply[2]))
+            elif kind == b"subscribe":
+                future = self.sessions.get(channel)
+                if future is not None and not future.done():
+                    future.set_result(None)
+
+    async def subscribe(self, session_id: str):
+        """Route the session's frames here; returns once the broker has confirmed it."""
+        future = self.sessions.get(session_id)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self.sessions[session_id] = future
+            if self.subscriber is not None:
+                self.subscriber.write(encode(b"SUBSCRIBE", self._channel(session_id)))
+        if not future.done():
+            try:
+                await asyncio.wait_for(asyncio.shield(future), self.subscribe_timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def unsubscribe(self, session_id: str):
+        future = self.sessions.pop(session_id, None)
+        if future is None:
+            return
+        if not future.done():
+            future.set_result(None)
+        if self.subscriber is not None:
+            self.subscriber.write(encode(b"UNSUBSCRIBE", self._channel(session_id)))
+
+    def has_viewers(self, session_id: str) -> bool:
+        """Whether the session's last frame reached any worker; True until the broker has said."""
+        return session_id not in self.unheard
+
+    async def publish(self, session_id: str, message: dict):
+        publisher = self.publisher
+        if publisher is not None:
+            publisher.write(encode(b"PUBLISH", self._channel(session_id),
+                                   json.dumps(message, separators=(",", ":"))))
+            self.pending.append(session_id)
+            self.published += 1
+            try:
+                # Only waits when the broker falls behind.
+                await publisher.drain()
+            except OSError:
+                pass
+            return
+        self.local_fallback += 1
+        if session_id in self.sessions:
+            self.deliver(session_id, message)
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def metrics(self) -> dict:
+        return {
+            "backend": "broker",
+            "url": self.url,
+            "connected": self.publisher is not None,
+            "connects": self.connects,
+            "subscribed_sessions": len(self.sessions),
+            "published": self.published,
+            "received": self.received,
+            "local_fallback": self.local_fallback,
+            "publish_errors": self.publish_errors,
+            "last_error": self.last_error,
+        }
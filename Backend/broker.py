@@ -0,0 +1,118 @@
+"""
+A minimal pub/sub broker speaking the subset of the Redis protocol the
+workers use (PUBLISH, SUBSCRIBE, UNSUBSCRIBE, PING), for running several
+workers on a host without Redis:
+
+    python broker.py --unix /tmp/interview-assistant-broker.sock
+    BROADCAST_BACKEND=broker uvicorn main:app --workers 4
+
+Nothing is stored: a frame published to a channel nobody subscribes to is
+dropped, as in Redis. A subscriber that stops reading is disconnected once
+--max-pending bytes are waiting for it, and its worker reconnects.
+"""
+import argparse
+import asyncio
+import os
+from typing import Dict, Set
+
+from broadcast import encode, read_reply
+
+
+def _bulk(data: bytes) -> bytes:
+    return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+class Broker:
+    def __init__(self, max_pending: int = 8 * 1024 * 1024):
+        self.max_pending = max_pending
+        self.channels: Dict[bytes, Set[asyncio.StreamWriter]] = {}
+        self.published = 0
+        self.delivered = 0
+        self.dropped_subscribers = 0
+
+    def publish(self, channel: bytes, data: bytes) -> int:
+        self.published += 1
+        subscribers = self.channels.get(channel)
+        if not subscribers:
+            return 0
+        frame = b"*3\r\n$7\r\nmessage\r\n" + _bulk(channel) + _bulk(data)
+        for writer in list(subscribers):
+            if writer.transport.get_write_buffer_size() > self.max_pending:
+                self.dropped_subscribers += 1
+                writer.transport.abort()
+                continue
+            writer.write(frame)
+            self.delivered += 1
+        return len(subscribers)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        subscriptions = set()
+        try:
+            while True:
+                command = await read_reply(reader)
+                if not isinstance(command, list) or not command:
+                    writer.write(b"-ERR expected a command array\r\n")
+                    continue
+                name = command[0].upper()
+                if name == b"PUBLISH" and len(command) == 3:
+                    writer.write(b":%d\r\n" % self.publish(command[1], command[2]))
+                    # Back-pressure a publisher whose replies pile up.
+                    await writer.drain()
+                elif name == b"SUBSCRIBE":
+                    for channel in command[1:]:
+                        subscriptions.add(channel)
+                        self.channels.setdefault(channel, set()).add(writer)
+                        writer.write(encode(b"subscribe", channel, len(subscriptions)))
+                elif name == b"UNSUBSCRIBE":
+                    for channel in command[1:] or list(subscriptions):
+                        subscriptions.discard(channel)
+                        self._unsubscribe(channel, writer)
+                        writer.write(encode(b"unsubscribe", channel, len(subscriptions)))
+                elif name == b"PING":
+                    writer.write(b"+PONG\r\n")
+                else:
+                    writer.write(b"-ERR unknown command '%s'\r\n" % name)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for channel in subscriptions:
+                self._unsubscribe(channel, writer)
+            writer.close()
+
+    def _unsubscribe(self, channel: bytes, writer: asyncio.StreamWriter):
+        subscribers = self.channels.get(channel)
+        if subscribers is not None:
+            subscribers.discard(writer)
+            if not subscribers:
+                del self.channels[channel]
+
+
+async def serve(args):
+    broker = Broker(max_pending=args.max_pending)
+    if args.unix:
+        if os.path.exists(args.unix):
+            os.remove(args.unix)
+        server = await asyncio.start_unix_server(broker.handle, args.unix)
+    else:
+        server = await asyncio.start_server(broker.handle, args.host, args.port)
+    print(f"Broker listening on {args.unix or f'{args.host}:{args.port}'}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pub/sub broker for running several workers.")
+    parser.add_argument("--unix", help="listen on this UNIX socket instead of TCP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--max-pending", type=int, default=8 * 1024 * 1024,
+                        help="bytes queued for a subscriber before it is disconnected")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+from config import (
+    EMBEDDING_MODEL,
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_MEMORY_CACHE_SIZE,
+    EMBEDDING_DISK_CACHE_SIZE,
+    EMBEDDING_BATCH_WINDOW,
+    EMBEDDING_MAX_BATCH,
+    CHROMA_HOST,
+    CHROMA_PORT,
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE,
+    HTTP_KEEPALIVE_EXPIRY,
+)
+from embeddings import EmbeddingProvider, cached_embedding_function, openai_embedder
+from executor import run_blocking
+
+
+class Lazy:
+    """
+    A client created on the first call, once, from any thread. A failed
+    creation is not remembered: the next call tries again.
+    """
+
+    def __init__(self, name: str, create: Callable[[], object]):
+        self.name = name
+        self.create = create
+        self.value = None
+        self.error = None
+        self.created_in = None
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        value = self.value
+        if value is None:
+            with self.lock:
+                if self.value is None:
+                    started = time.perf_counter()
+                    try:
+                        self.value = self.create()
+                    except Exception as e:
+                        self.error = f"{type(e).__name__}: {e}"
+                        raise
+                    self.error = None
+                    self.created_in = time.perf_counter() - started
+                value = self.value
+        return value
+
+    async def aget(self):
+        """The client, created on the blocking pool if it does not exist yet."""
+        return self.value if self.value is not None else await run_blocking(self)
+
+    @property
+    def ready(self) -> bool:
+        return self.value is not None
+
+
+def _limits():
+    import httpx
+
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def _create_openai():
+    from openai import DefaultHttpxClient, OpenAI
+
+    return OpenAI(api_key=os.environ.get("OPENAI_API_KEY"), http_client=DefaultHttpxClient(limits=_limits()))
+
+
+def _create_async_openai():
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+    return AsyncOpenAI(http_client=DefaultAsyncHttpxClient(limits=_limits()))
+
+
+def _create_chroma():
+    import chromadb
+    from chromadb.config import Settings
+
+    return chromadb.HttpClient(
+        host=CHROMA_HOST,
+        port=CHROMA_PORT,
+        settings=Settings(
+            chroma_http_keepalive_secs=HTTP_KEEPALIVE_EXPIRY,
+            chroma_http_max_connections=HTTP_MAX_CONNECTIONS,
+            chroma_http_max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        ),
+    )
+
+
+# Created on first use, from whichever thread needs them; the client
+# libraries are imported only then, so importing the app is quick and a
+# Chroma outage does not keep it from starting. The lifespan warms them in
+# the background (warm_up) and closes them on shutdown.
+openai_client = Lazy("openai", _create_openai)
+async_openai_client = Lazy("openai_async", _create_async_openai)
+chroma_client = Lazy("chroma", _create_chroma)
+
+embedding_provider = EmbeddingProvider(
+    openai_embedder(openai_client, EMBEDDING_MODEL),
+    EMBEDDING_MODEL,
+    cache_path=EMBEDDING_CACHE_PATH,
+    memory_entries=EMBEDDING_MEMORY_CACHE_SIZE,
+    disk_entries=EMBEDDING_DISK_CACHE_SIZE,
+    batch_window=EMBEDDING_BATCH_WINDOW,
+    max_batch=EMBEDDING_MAX_BATCH,
+)
+
+collection = Lazy("mixed_content", lambda: chroma_client().get_or_create_collection(
+    name="mixed_content",
+    embedding_function=cached_embedding_function(embedding_provider),
+))
+
+CLIENTS = (openai_client, async_openai_client, chroma_client, collection)
+
+_warm = {"task": None, "attempts": 0, "started": None, "ready_after": None, "connections": {}}
+
+
+async def _open_connection(name: str, call):
+    # Any answer, even an error status, leaves a warm keep-alive connection.
+    started = time.perf_counter()
+    try:
+        await call()
+        _warm["connections"][name] = {"ok": True, "ms": (time.perf_counter() - started) * 1000}
+    except Exception as e:
+        _warm["connections"][name] = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+
+
+async def warm_up(retry_interval: float = 0.5, max_interval: float = 15.0):
+    """
+    Create every client off the event loop, retrying with backoff until
+    they all exist (Chroma may still be starting), then open a first
+    connection to each upstream so the first question does not pay for it.
+    """
+    _warm["started"] = time.perf_counter()
+    delay = retry_interval
+    while True:
+        _warm["attempts"] += 1
+        for client in CLIENTS:
+            if not client.ready:
+                try:
+                    await run_blocking(client)
+                except Exception:
+                    pass
+        if all(client.ready for client in CLIENTS):
+            break
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, max_interval)
+    _warm["ready_after"] = time.perf_counter() - _warm["started"]
+    await asyncio.gather(
+        _open_connection("chroma", lambda: run_blocking(chroma_client.value.heartbeat)),
+        _open_connection("openai", lambda: run_blocking(openai_client.value.models.list)),
+        _open_connection("openai_async", lambda: async_openai_client.value.models.list()),
+    )
+
+
+def ensure_warm() -> Optional[asyncio.Task]:
+    """Start warming the clients unless they are ready or already warming."""
+    task = _warm["task"]
+    if all(client.ready for client in CLIENTS) or (task is not None and not task.done()):
+        return task
+    _warm["task"] = asyncio.create_task(warm_up())
+    return _warm["task"]
+
+
+def readiness() -> dict:
+    return {
+        "ready": all(client.ready for client in CLIENTS),
+        "clients": {
+            client.name: {
+                "ready": client.ready,
+                "created_ms": client.created_in * 1000 if client.created_in is not None else None,
+                "error": client.error,
+            }
+            for client in CLIENTS
+        },
+        "warmup_attempts": _warm["attempts"],
+        "ready_after_s": _warm["ready_after"],
+        "connections": _warm["connections"],
+    }
+
+
+async def close_clients():
+    task = _warm["task"]
+    if task is not None and not task.done():
+        task.cancel()
+    if async_openai_client.ready:
+        await async_openai_client.value.close()
+    if openai_client.ready:
+        openai_client.value.close()
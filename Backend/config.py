@@ -1,21 +1,162 @@
-import chromadb
-from chromadb.utils import embedding_functions
-from openai import OpenAI
+import os
 from dotenv import load_dotenv
-import os 
 
 load_dotenv()
 
-client_op = OpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
+# Embedding cache tiers and micro-batching window shared by every caller.
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "text-embedding-ada-002")
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", "embedding_cache.db")
+EMBEDDING_MEMORY_CACHE_SIZE = int(os.environ.get("EMBEDDING_MEMORY_CACHE_SIZE", "10000"))
+EMBEDDING_DISK_CACHE_SIZE = int(os.environ.get("EMBEDDING_DISK_CACHE_SIZE", "200000"))
+EMBEDDING_BATCH_WINDOW = float(os.environ.get("EMBEDDING_BATCH_WINDOW", "0.005"))
+EMBEDDING_MAX_BATCH = int(os.environ.get("EMBEDDING_MAX_BATCH", "256"))
 
-client = chromadb.HttpClient(host="localhost", port=8000)
+# Chroma server, and the connection pool of each upstream client (OpenAI
+# sync and async, Chroma): at most HTTP_MAX_CONNECTIONS open, of which
+# HTTP_MAX_KEEPALIVE are kept idle for HTTP_KEEPALIVE_EXPIRY seconds.
+CHROMA_HOST = os.environ.get("CHROMA_HOST", "localhost")
+CHROMA_PORT = int(os.environ.get("CHROMA_PORT", "8000"))
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "32"))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("HTTP_MAX_KEEPALIVE", "16"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "60"))
 
-embedding_function = embedding_functions.OpenAIEmbeddingFunction(
-    api_key=os.environ.get('OPENAI_API_KEY'),
-    model_name="text-embedding-ada-002"
-)
+# "delta" sends only newly generated text per frame, "full" keeps the old
+# frames that resend the whole answer so far.
+STREAM_PROTOCOL = os.environ.get("STREAM_PROTOCOL", "delta")
+STREAM_FLUSH_INTERVAL = float(os.environ.get("STREAM_FLUSH_INTERVAL", "0.05"))
+STREAM_FLUSH_CHARS = int(os.environ.get("STREAM_FLUSH_CHARS", "64"))
 
-collection = client.get_or_create_collection(
-    name="mixed_content",
-    embedding_function=embedding_function
-)
+# Per-socket outbound queue length and send timeout; a client that falls
+# further behind than this is disconnected and replays history on reconnect.
+WS_SEND_QUEUE_SIZE = int(os.environ.get("WS_SEND_QUEUE_SIZE", "256"))
+WS_SEND_TIMEOUT = float(os.environ.get("WS_SEND_TIMEOUT", "10"))
+
+# How streamed frames reach the sockets of a session. "local" delivers in
+# this process only, enough for a single worker; "broker" publishes them to
+# a pub/sub broker at BROADCAST_URL (unix:///path or redis://host:port,
+# Redis or broker.py), so several workers or hosts can serve one session.
+BROADCAST_BACKEND = os.environ.get("BROADCAST_BACKEND", "local")
+BROADCAST_URL = os.environ.get("BROADCAST_URL", "unix:///tmp/interview-assistant-broker.sock")
+
+# Size of the thread pool that runs the synchronous Chroma and Whisper
+# calls, and per-call timeouts in seconds.
+BLOCKING_POOL_SIZE = int(os.environ.get("BLOCKING_POOL_SIZE", "16"))
+DB_TIMEOUT = float(os.environ.get("DB_TIMEOUT", "10"))
+TRANSCRIBE_TIMEOUT = float(os.environ.get("TRANSCRIBE_TIMEOUT", "60"))
+
+# SQLite file holding chat history (replaces the chat_sessions collection).
+SESSION_DB_PATH = os.environ.get("SESSION_DB_PATH", "sessions.db")
+
+# Messages per history frame replayed to a viewer that connects with
+# ?after=<seq> (or ?after_id=<message id>); see websocket_endpoint.
+HISTORY_PAGE_SIZE = int(os.environ.get("HISTORY_PAGE_SIZE", "500"))
+
+# Seconds between writes of a partial answer while it streams; 0 disables.
+ANSWER_CHECKPOINT_INTERVAL = float(os.environ.get("ANSWER_CHECKPOINT_INTERVAL", "5"))
+
+# Seconds after which an answer still marked incomplete, and not streaming
+# in this process, is taken as abandoned (a crash or a failed final write)
+# and replayed as complete; at startup such rows are marked complete.
+ANSWER_STALE_AFTER = float(os.environ.get("ANSWER_STALE_AFTER", "600"))
+
+# Semantic answer cache: reuse the answer of a previous question whose
+# embedding is at least ANSWER_CACHE_THRESHOLD cosine-similar.
+# ANSWER_CACHE_REPLAY is "stream" (replayed in chunks) or "instant".
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_PATH = os.environ.get("ANSWER_CACHE_PATH", "answer_cache.db")
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.96"))
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", str(7 * 86400)))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+ANSWER_CACHE_REPLAY = os.environ.get("ANSWER_CACHE_REPLAY", "stream")
+ANSWER_CACHE_REPLAY_DELAY = float(os.environ.get("ANSWER_CACHE_REPLAY_DELAY", "0.02"))
+
+# Live audio questions over the WebSocket: how often the audio so far is
+# transcribed to start retrieval early, at most how many times per
+# question (each partial is billed for all the audio so far), and how much
+# of the final transcript's wording the partial one must cover for its
+# retrieval to be kept.
+SPECULATIVE_PARTIAL_INTERVAL = float(os.environ.get("SPECULATIVE_PARTIAL_INTERVAL", "1.5"))
+SPECULATIVE_MAX_PARTIALS = int(os.environ.get("SPECULATIVE_MAX_PARTIALS", "2"))
+SPECULATIVE_REUSE_OVERLAP = float(os.environ.get("SPECULATIVE_REUSE_OVERLAP", "0.8"))
+
+# Audio questions: uploads (and socket recordings) larger than
+# AUDIO_MAX_BYTES are rejected, and WAV is re-encoded to 16-bit mono at
+# AUDIO_RESAMPLE_RATE Hz before transcription (0 sends it unchanged).
+AUDIO_MAX_BYTES = int(os.environ.get("AUDIO_MAX_BYTES", str(50 * 1024 * 1024)))
+AUDIO_RESAMPLE_RATE = int(os.environ.get("AUDIO_RESAMPLE_RATE", "16000"))
+
+# Image questions: uploads over IMAGE_MAX_BYTES are rejected, and larger
+# images are shrunk to what the model looks at (IMAGE_MAX_SIDE, short side
+# IMAGE_MAX_SHORT_SIDE; 512 a side with IMAGE_DETAIL "low") and re-encoded
+# as JPEG at IMAGE_JPEG_QUALITY, or PNG if they have transparency. The
+# results are kept per session, up to IMAGE_CACHE_BYTES in all, so an
+# image sent again is not processed again. IMAGE_MAX_TOKENS caps the answer.
+IMAGE_MAX_BYTES = int(os.environ.get("IMAGE_MAX_BYTES", str(20 * 1024 * 1024)))
+IMAGE_MAX_SIDE = int(os.environ.get("IMAGE_MAX_SIDE", "2048"))
+IMAGE_MAX_SHORT_SIDE = int(os.environ.get("IMAGE_MAX_SHORT_SIDE", "768"))
+IMAGE_JPEG_QUALITY = int(os.environ.get("IMAGE_JPEG_QUALITY", "85"))
+IMAGE_DETAIL = os.environ.get("IMAGE_DETAIL", "auto")
+IMAGE_CACHE_BYTES = int(os.environ.get("IMAGE_CACHE_BYTES", str(64 * 1024 * 1024)))
+IMAGE_MAX_TOKENS = int(os.environ.get("IMAGE_MAX_TOKENS", "300"))
+
+# Per-session memory of previous questions and answers in the prompt.
+# MEMORY_STORE is "sqlite" (MEMORY_DB_PATH, shared by every worker on the
+# host) or "memory" (this process only; idle and least recently used
+# sessions are evicted). The window is MEMORY_TOKEN_BUDGET tokens of the
+# most recent turns; with MEMORY_SUMMARIZE, older turns are folded into a
+# rolling summary (one extra model call per MEMORY_SUMMARIZE_AFTER tokens).
+MEMORY_STORE = os.environ.get("MEMORY_STORE", "sqlite")
+MEMORY_DB_PATH = os.environ.get("MEMORY_DB_PATH", "memory.db")
+MEMORY_TOKEN_BUDGET = int(os.environ.get("MEMORY_TOKEN_BUDGET", "1500"))
+MEMORY_MAX_SESSIONS = int(os.environ.get("MEMORY_MAX_SESSIONS", "1000"))
+MEMORY_IDLE_TTL = float(os.environ.get("MEMORY_IDLE_TTL", str(6 * 3600)))
+MEMORY_SUMMARIZE = os.environ.get("MEMORY_SUMMARIZE", "false").lower() == "true"
+MEMORY_SUMMARIZE_AFTER = int(os.environ.get("MEMORY_SUMMARIZE_AFTER", "500"))
+
+# Retrieved context in the prompt. Chroma results further than
+# CONTEXT_DISTANCE_MARGIN (relative) from the best match are cut (0 keeps
+# all), near-duplicates are dropped, the rest are reranked by keyword
+# overlap when CONTEXT_RERANK is on, and chunks are added until
+# CONTEXT_TOKEN_BUDGET tokens (0 for no limit). n_results adapts between
+# CONTEXT_MIN_RESULTS and CONTEXT_MAX_RESULTS.
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "1200"))
+CONTEXT_DEDUP_THRESHOLD = float(os.environ.get("CONTEXT_DEDUP_THRESHOLD", "0.8"))
+CONTEXT_RERANK = os.environ.get("CONTEXT_RERANK", "true").lower() == "true"
+CONTEXT_DISTANCE_MARGIN = float(os.environ.get("CONTEXT_DISTANCE_MARGIN", "0.25"))
+CONTEXT_MIN_RESULTS = int(os.environ.get("CONTEXT_MIN_RESULTS", "4"))
+CONTEXT_MAX_RESULTS = int(os.environ.get("CONTEXT_MAX_RESULTS", "20"))
+
+# Where retrieval queries go. "chroma" asks the Chroma server; "local"
+# searches an in-process copy of mixed_content's embeddings, memory-mapped
+# from files under VECTOR_INDEX_PATH and refreshed from Chroma every
+# VECTOR_INDEX_REFRESH seconds (Chroma serves until the first sync).
+# The search is exact and linear in the number of vectors, so beyond
+# VECTOR_INDEX_MAX_ROWS queries go back to Chroma's HNSW index.
+# VECTOR_INDEX_QUANTIZE stores int8 vectors: a quarter of the memory, with
+# approximate distances. With several workers on a host, the first to start
+# owns the files and the others ask Chroma.
+VECTOR_INDEX = os.environ.get("VECTOR_INDEX", "chroma")
+VECTOR_INDEX_PATH = os.environ.get("VECTOR_INDEX_PATH", "vector_index")
+VECTOR_INDEX_QUANTIZE = os.environ.get("VECTOR_INDEX_QUANTIZE", "false").lower() == "true"
+VECTOR_INDEX_REFRESH = float(os.environ.get("VECTOR_INDEX_REFRESH", "60"))
+VECTOR_INDEX_MAX_ROWS = int(os.environ.get("VECTOR_INDEX_MAX_ROWS", "10000"))
+
+# Per-question traces. Stage latencies, time to first token and tokens/s
+# are always kept as Prometheus metrics on /metrics; with TRACE_LOG_PATH
+# set, each question's spans are also appended to that file as one JSON
+# line, along with the render latencies the frontend reports.
+TRACE_LOG_PATH = os.environ.get("TRACE_LOG_PATH", "")
+
+# Answers being generated. At most GENERATION_MAX_ACTIVE stream from the
+# model at once on each worker; up to GENERATION_MAX_QUEUE more questions
+# wait, in order, up to GENERATION_QUEUE_TIMEOUT seconds for a slot, and
+# past that a question is refused with 503 straight away. The answer in
+# flight is cancelled by a newer question in the same session, by a
+# {"type": "cancel"} message from one of its viewers, or once its viewers
+# have all been gone for GENERATION_ORPHAN_GRACE seconds (0 never). With
+# several workers, a newer question or a cancel message only reaches an
+# answer generated on the same worker.
+GENERATION_MAX_ACTIVE = int(os.environ.get("GENERATION_MAX_ACTIVE", "16"))
+GENERATION_MAX_QUEUE = int(os.environ.get("GENERATION_MAX_QUEUE", "32"))
+GENERATION_QUEUE_TIMEOUT = float(os.environ.get("GENERATION_QUEUE_TIMEOUT", "10"))
+GENERATION_ORPHAN_GRACE = float(os.environ.get("GENERATION_ORPHAN_GRACE", "5"))
@@ -0,0 +1,186 @@
+import math
+import re
+import threading
+import time
+from typing import Callable, List, Optional
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by can did do does for from how i if in is it me my "
+    "of on or so that the this to was we what when where which who why will with you your".split()
+)
+
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def _shingles(text: str, size: int = 3) -> set:
+    words = _words(text)
+    if len(words) < size:
+        return set(words)
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def format_result(document: str, metadata: Optional[dict]) -> str:
+    if metadata and metadata.get("type") == "qa":
+        return f"Q: {metadata.get('question', '')}\nA: {document}"
+    return f"Text: {document}"
+
+
+class ContextBuilder:
+    """
+    Turns Chroma query results into the context section of the prompt.
+
+    Results further than `distance_margin` (relative) from the best match
+    are cut, near-duplicates (3-word shingle Jaccard at or above
+    `dedup_threshold`) are dropped, and the rest are optionally reranked by
+    blending vector distance with weighted keyword overlap with the
+    question. Chunks are then added in rank order while they fit in
+    `token_budget` tokens (0 means no budget).
+
+    The number of results to ask Chroma for follows how many survived the
+    cut recently, between `min_results` and `max_results`.
+    """
+
+    def __init__(
+        self,
+        count_tokens: Callable[[str], int],
+        token_budget: int = 1200,
+        dedup_threshold: float = 0.8,
+        rerank: bool = True,
+        rerank_weight: float = 0.3,
+        distance_margin: float = 0.25,
+        min_results: int = 4,
+        max_results: int = 20,
+    ):
+        self.count_tokens = count_tokens
+        self.token_budget = token_budget
+        self.dedup_threshold = dedup_threshold
+        self.rerank = rerank
+        self.rerank_weight = rerank_weight
+        self.distance_margin = distance_margin
+        self.min_results = min_results
+        self.max_results = max_results
+        self.kept_average = float(max_results)
+
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.retrieved = 0
+        self.cut = 0
+        self.duplicates = 0
+        self.over_budget = 0
+        self.kept = 0
+        self.tokens = 0
+        self.max_tokens = 0
+        self.time = 0.0
+
+    def n_results(self) -> int:
+        """How many results to request: twice the recent number that passed the distance cut."""
+        if self.distance_margin <= 0:
+            return self.max_results
+        return max(self.min_results, min(self.max_results, math.ceil(self.kept_average * 2)))
+
+    def _cut(self, candidates: List[dict]) -> List[dict]:
+        distances = [c["distance"] for c in candidates if c["distance"] is not None]
+        if self.distance_margin <= 0 or not distances:
+            return candidates
+        limit = min(distances) * (1 + self.distance_margin)
+        kept = [
+            c for i, c in enumerate(candidates)
+            if i < self.min_results or c["distance"] is None or c["distance"] <= limit
+        ]
+        passed = sum(1 for c in candidates if c["distance"] is not None and c["distance"] <= limit)
+        with self.lock:
+            self.kept_average = 0.8 * self.kept_average + 0.2 * passed
+        return kept
+
+    def _dedup(self, candidates: List[dict]) -> List[dict]:
+        if self.dedup_threshold >= 1:
+            return candidates
+        kept = []
+        for candidate in candidates:
+            candidate["shingles"] = _shingles(candidate["text"])
+            duplicate = any(
+                len(candidate["shingles"] & other["shingles"])
+                / (len(candidate["shingles"] | other["shingles"]) or 1) >= self.dedup_threshold
+                for other in kept
+            )
+            if not duplicate:
+                kept.append(candidate)
+        return kept
+
+    def _rerank(self, question: str, candidates: List[dict]) -> List[dict]:
+        terms = {w for w in _words(question) if w not in STOPWORDS}
+        if not self.rerank or not terms or len(candidates) < 2:
+            return candidates
+        words = [set(_words(c["text"])) for c in candidates]
+        idf = {t: math.log(1 + len(candidates) / (1 + sum(t in w for w in words))) for t in terms}
+        total = sum(idf.values()) or 1.0
+        distances = [c["distance"] for c in candidates if c["distance"] is not None]
+        low, high = (min(distances), max(distances)) if distances else (0.0, 0.0)
+        for candidate, doc_words in zip(candidates, words):
+            distance = candidate["distance"]
+            vector = 1.0 if distance is None or high == low else (high - distance) / (high - low)
+            lexical = sum(idf[t] for t in terms if t in doc_words) / total
+            candidate["score"] = (1 - self.rerank_weight) * vector + self.rerank_weight * lexical
+        return sorted(candidates, key=lambda c: c["score"], reverse=True)
+
+    def build(self, question: str, results: dict) -> dict:
+        """Context text for a single-query Chroma result, with what was kept and why."""
+        started = time.perf_counter()
+        documents = results["documents"][0]
+        metadatas = (results.get("metadatas") or [[None] * len(documents)])[0]
+        distances = (results.get("distances") or [[None] * len(documents)])[0]
+        candidates = [
+            {"text": format_result(doc, meta), "distance": dist}
+            for doc, meta, dist in zip(documents, metadatas, distances)
+            if doc
+        ]
+
+        after_cut = self._cut(candidates)
+        unique = self._dedup(after_cut)
+        ranked = self._rerank(question, unique)
+
+        parts, used, skipped = [], 0, 0
+        for candidate in ranked:
+            tokens = self.count_tokens(candidate["text"])
+            if self.token_budget and used + tokens > self.token_budget:
+                skipped += 1
+                continue
+            parts.append(candidate["text"])
+            used += tokens
+
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.requests += 1
+            self.retrieved += len(candidates)
+            self.cut += len(candidates) - len(after_cut)
+            self.duplicates += len(after_cut) - len(unique)
+            self.over_budget += skipped
+            self.kept += len(parts)
+            self.tokens += used
+            self.max_tokens = max(self.max_tokens, used)
+            self.time += elapsed
+        return {
+            "context": "\n\n".join(parts),
+            "context_tokens": used,
+            "context_chunks": len(parts),
+            "retrieved_chunks": len(candidates),
+            "context_ms": elapsed * 1000,
+        }
+
+    def stats(self) -> dict:
+        requests = self.requests or 1
+        return {
+            "requests": self.requests,
+            "token_budget": self.token_budget,
+            "n_results": self.n_results(),
+            "retrieved_avg": self.retrieved / requests,
+            "cut_by_distance": self.cut,
+            "duplicates_dropped": self.duplicates,
+            "over_budget_dropped": self.over_budget,
+            "chunks_kept_avg": self.kept / requests,
+            "context_tokens_avg": self.tokens / requests,
+            "context_tokens_max": self.max_tokens,
+            "assembly_ms_avg": self.time / requests * 1000,
+        }
@@ -0,0 +1,273 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from executor import run_blocking
+from tokens import token_counter
+from tracing import window_stats
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS memory_turns (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS memory_turns_session ON memory_turns (session_id, seq);
+CREATE TABLE IF NOT EXISTS memory_summaries (
+    session_id TEXT PRIMARY KEY,
+    summary TEXT NOT NULL,
+    upto_seq INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+
+def format_turn(question: str, answer: str) -> str:
+    return f"Q: {question}\nA: {answer}"
+
+
+class InProcessMemoryStore:
+    """
+    Turns and summaries held in this process, for a single worker.
+
+    Sessions idle for more than `idle_ttl` seconds, and the least recently
+    used ones beyond `max_sessions`, are dropped.
+    """
+
+    def __init__(self, max_sessions: int = 1000, idle_ttl: float = 6 * 3600, max_turns: int = 50):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_turns = max_turns
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.evicted = 0
+
+    def _session(self, session_id: str) -> dict:
+        now = time.monotonic()
+        while self.sessions:
+            oldest_id, oldest = next(iter(self.sessions.items()))
+            if oldest_id == session_id or now - oldest["last_used"] <= self.idle_ttl:
+                break
+            del self.sessions[oldest_id]
+            self.evicted += 1
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self.sessions[session_id] = {"turns": [], "summary": "", "upto_seq": 0, "last_used": now}
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+                self.evicted += 1
+        session["last_used"] = now
+        self.sessions.move_to_end(session_id)
+        return session
+
+    def append(self, session_id: str, question: str, answer: str, tokens: int) -> int:
+        with self.lock:
+            session = self._session(session_id)
+            self.seq += 1
+            session["turns"].append({"seq": self.seq, "question": question, "answer": answer, "tokens": tokens})
+            del session["turns"][:-self.max_turns]
+            return self.seq
+
+    def recent(self, session_id: str) -> Tuple[str, int, List[dict]]:
+        """(summary, last seq it covers, turns after it), oldest turn first."""
+        with self.lock:
+            session = self._session(session_id)
+            return session["summary"], session["upto_seq"], list(session["turns"])
+
+    def set_summary(self, session_id: str, summary: str, upto_seq: int):
+        with self.lock:
+            session = self._session(session_id)
+            if upto_seq <= session["upto_seq"]:
+                return
+            session["summary"] = summary
+            session["upto_seq"] = upto_seq
+            session["turns"] = [t for t in session["turns"] if t["seq"] > upto_seq]
+
+    def stats(self) -> dict:
+        return {"store": "memory", "sessions": len(self.sessions), "evicted_sessions": self.evicted}
+
+
+class SQLiteMemoryStore:
+    """
+    Turns and summaries in a local SQLite file (WAL), so every worker
+    process on the host sees the same memory for a session.
+    """
+
+    def __init__(self, path: str, max_turns: int = 50):
+        self.path = path
+        self.max_turns = max_turns
+        self.local = threading.local()
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def append(self, session_id: str, question: str, answer: str, tokens: int) -> int:
+        conn = self._conn()
+        with conn:
+            seq = conn.execute(
+                "INSERT INTO memory_turns (session_id, question, answer, tokens, created) VALUES (?, ?, ?, ?, ?)",
+                (session_id, question, answer, tokens, time.time()),
+            ).lastrowid
+            conn.execute(
+                "DELETE FROM memory_turns WHERE session_id = ? AND seq <= ("
+                "SELECT seq FROM memory_turns WHERE session_id = ? ORDER BY seq DESC LIMIT 1 OFFSET ?)",
+                (session_id, session_id, self.max_turns),
+            )
+        return seq
+
+    def recent(self, session_id: str) -> Tuple[str, int, List[dict]]:
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT summary, upto_seq FROM memory_summaries WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        summary, upto_seq = row if row else ("", 0)
+        rows = conn.execute(
+            "SELECT seq, question, answer, tokens FROM memory_turns WHERE session_id = ? AND seq > ? ORDER BY seq",
+            (session_id, upto_seq),
+        ).fetchall()
+        turns = [{"seq": s, "question": q, "answer": a, "tokens": t} for s, q, a, t in rows]
+        return summary, upto_seq, turns
+
+    def set_summary(self, session_id: str, summary: str, upto_seq: int):
+        conn = self._conn()
+        with conn:
+            # Another worker may have summarized further already.
+            conn.execute(
+                "INSERT INTO memory_summaries (session_id, summary, upto_seq, updated) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET summary = excluded.summary, "
+                "upto_seq = excluded.upto_seq, updated = excluded.updated "
+                "WHERE excluded.upto_seq > memory_summaries.upto_seq",
+                (session_id, summary, upto_seq, time.time()),
+            )
+            conn.execute("DELETE FROM memory_turns WHERE session_id = ? AND seq <= ?", (session_id, upto_seq))
+
+    def stats(self) -> dict:
+        sessions = self._conn().execute("SELECT COUNT(DISTINCT session_id) FROM memory_turns").fetchone()[0]
+        return {"store": "sqlite", "sessions": sessions}
+
+
+class ConversationMemory:
+    """
+    Per-session memory of previous questions and answers for the prompt.
+
+    The window holds the most recent turns that fit in `token_budget`
+    tokens, newest first, after the session's summary if it has one. With
+    a `summarize` callable, turns that have fallen out of the window are
+    folded into the summary once they add up to `summarize_after` tokens;
+    until then they are left out of the prompt.
+    """
+
+    def __init__(
+        self,
+        store,
+        token_budget: int = 1500,
+        count_tokens: Optional[Callable[[str], int]] = None,
+        summarize: Optional[Callable[[str, List[dict]], Awaitable[str]]] = None,
+        summarize_after: int = 500,
+    ):
+        self.store = store
+        self.token_budget = token_budget
+        self.count_tokens = count_tokens or token_counter()
+        self.summarize = summarize
+        self.summarize_after = summarize_after
+        self.summarizing = set()
+        self.tasks = set()
+        self.summaries = 0
+        self.summary_errors = 0
+
+    def _window(self, session_id: str):
+        summary, _, turns = self.store.recent(session_id)
+        used = self.count_tokens(summary) if summary else 0
+        window = []
+        for turn in reversed(turns):
+            if used + turn["tokens"] > self.token_budget:
+                break
+            used += turn["tokens"]
+            window.append(turn)
+        window.reverse()
+        overflow = turns[:len(turns) - len(window)]
+        return summary, window, overflow, used
+
+    def _render(self, summary: str, window: List[dict]) -> str:
+        parts = [f"Summary of earlier questions: {summary}"] if summary else []
+        parts.extend(format_turn(t["question"], t["answer"]) for t in window)
+        return "\n".join(parts)
+
+    async def context(self, session_id: str) -> Tuple[str, int]:
+        """The previous Q&A text for the prompt and its size in tokens."""
+        summary, window, _, used = await run_blocking(self._window, session_id)
+        return self._render(summary, window), used
+
+    async def remember(self, session_id: str, question: str, answer: str):
+        """Store a turn; summarizing, when due, continues in the background."""
+        tokens = self.count_tokens(format_turn(question, answer))
+        await run_blocking(self.store.append, session_id, question, answer, tokens)
+        if self.summarize is not None and session_id not in self.summarizing:
+            self.summarizing.add(session_id)
+            task = asyncio.create_task(self._fold(session_id))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _fold(self, session_id: str):
+        try:
+            summary, _, overflow, _ = await run_blocking(self._window, session_id)
+            if sum(t["tokens"] for t in overflow) < self.summarize_after:
+                return
+            try:
+                folded = await self.summarize(summary, overflow)
+            except Exception:
+                # The turns stay out of the prompt until the next attempt.
+                self.summary_errors += 1
+                return
+            await run_blocking(self.store.set_summary, session_id, folded.strip(), overflow[-1]["seq"])
+            self.summaries += 1
+        finally:
+            self.summarizing.discard(session_id)
+
+    def stats(self) -> dict:
+        return {
+            **self.store.stats(),
+            "token_budget": self.token_budget,
+            "summaries": self.summaries,
+            "summary_errors": self.summary_errors,
+        }
+
+
+class PromptStats:
+    """Sizes, in tokens, of the prompts sent to the model and of their memory part."""
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self.prompt_tokens = []
+        self.memory_tokens = []
+        self.count = 0
+
+    def record(self, prompt_tokens: int, memory_tokens: int):
+        self.count += 1
+        self.prompt_tokens.append(prompt_tokens)
+        self.memory_tokens.append(memory_tokens)
+        del self.prompt_tokens[:-self.window]
+        del self.memory_tokens[:-self.window]
+
+    def stats(self) -> dict:
+        return {
+            "prompts": self.count,
+            "prompt_tokens": window_stats(self.prompt_tokens),
+            "memory_tokens": window_stats(self.memory_tokens),
+        }
@@ -1,76 +1,76 @@
-import os
-import chromadb
 from models import Message
 import uuid
 import time
-import chromadb
-from chromadb.utils import embedding_functions
-from openai import OpenAI
-from dotenv import load_dotenv
-import os
+import asyncio
+from typing import Optional
+from config import DB_TIMEOUT, TRANSCRIBE_TIMEOUT, SESSION_DB_PATH
+from clients import openai_client, chroma_client
+from executor import run_blocking
+from session_store import SessionStore, BatchedWriter, new_row, migrate_from_chroma
 
-load_dotenv()
-client_op = OpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
+async def create_session():
+    session_id = str(uuid.uuid4())
+    return session_id
 
-client = chromadb.HttpClient(host="localhost", port=8000)
+session_store = SessionStore(SESSION_DB_PATH)
 
-embedding_function = embedding_functions.OpenAIEmbeddingFunction(
-    api_key = os.environ.get('OPENAI_API_KEY'),
-    model_name="text-embedding-ada-002"
-)
+async def _append_rows(rows):
+    return await run_blocking(session_store.append_many, rows, timeout=DB_TIMEOUT)
 
-session_collection = client.get_or_create_collection(
-    name="chat_sessions"
-)
+session_writer = BatchedWriter(_append_rows)
 
-collection = client.get_or_create_collection(
-    name="mixed_content",
-    embedding_function=embedding_function
-)
+async def store_message(session_id: str, message: Message, is_audio: bool = False, is_image: bool = False,
+                        message_id: Optional[str] = None, is_complete: bool = True):
+    """
+    Store a message and return its record, including the stable id and seq.
+    Passing the id of an existing message updates its content in place;
+    is_complete=False marks an answer that is still streaming.
+    """
+    row = new_row(session_id, message.role, message.content, is_audio=is_audio, is_image=is_image,
+                  message_id=message_id, is_complete=is_complete)
+    row["seq"] = await session_writer.submit(row)
+    return row
 
-async def create_session():
-    session_id = str(uuid.uuid4())
-    return session_id
+async def get_history(session_id: str, after_seq: int = 0, limit: Optional[int] = None):
+    """Messages of a session with seq > after_seq, oldest first, as stored rows."""
+    return await run_blocking(session_store.read, session_id, after_seq, limit, timeout=DB_TIMEOUT)
 
-async def store_message(session_id: str, message: Message, is_audio: bool = False, is_image: bool = False):
-    timestamp = time.time()
-    session_collection.add(
-        documents=[message.content],
-        metadatas=[{
-            "role": message.role,
-            "session_id": session_id,
-            "timestamp": timestamp,
-            "is_audio": is_audio,
-        }],
-        ids=[f"{session_id}_{uuid.uuid4()}"]
-    )
+async def get_message_seq(session_id: str, message_id: str) -> Optional[int]:
+    return await run_blocking(session_store.seq_of, session_id, message_id, timeout=DB_TIMEOUT)
+
+def _migrate_chat_sessions():
+    if session_store.get_meta("chroma_migrated"):
+        return 0
+    chat_sessions = chroma_client().get_or_create_collection(name="chat_sessions")
+    return migrate_from_chroma(chat_sessions, session_store)
+
+async def migrate_chat_sessions():
+    """One-shot copy of the old chat_sessions Chroma collection into the session store."""
+    return await run_blocking(_migrate_chat_sessions)
+
+async def compact_sessions(grace_seconds: float = 3600):
+    """Remove empty assistant placeholders older than grace_seconds."""
+    return await run_blocking(session_store.compact, time.time() - grace_seconds)
+
+async def close_stale_answers(grace_seconds: float):
+    """Mark answers left incomplete for more than grace_seconds as complete."""
+    return await run_blocking(session_store.close_incomplete, time.time() - grace_seconds)
 
-async def get_messages(session_id: str):
-    results = session_collection.get(
-        where={"session_id": session_id}
+def _transcribe(audio, filename: str):
+    transcription = openai_client().audio.transcriptions.create(
+        model="whisper-1",
+        file=(filename, audio)
     )
-    messages = []
-    for doc, meta in zip(results["documents"], results["metadatas"]):
-        messages.append({
-            "message": Message(role=meta["role"], content=doc),
-            "timestamp": meta.get("timestamp", 0),
-            "is_audio": meta.get("is_audio", False),
-            "is_image": meta.get("is_image", False)
-        })
-    messages.sort(key=lambda x: x["timestamp"])
-    return messages
+    return transcription.text
 
-def transcribe_audio(audio_file_path):
-    """Transcribe audio using OpenAI Whisper."""
+async def transcribe_audio(audio, filename: str = "audio.webm"):
+    """
+    Transcribe a recording given as bytes or an open file using OpenAI
+    Whisper; the filename's extension tells Whisper the format.
+    """
     try:
-        with open(audio_file_path, 'rb') as audio_file:
-            transcription = client_op.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file
-            )
-        return transcription.text
+        return await run_blocking(_transcribe, audio, filename, timeout=TRANSCRIBE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise Exception(f"Error in transcription: timed out after {TRANSCRIBE_TIMEOUT}s")
     except Exception as e:
         raise Exception(f"Error in transcription: {str(e)}")
-    finally:
-        if os.path.exists(audio_file_path):
-            os.remove(audio_file_path)
\ No newline at end of file
@@ -0,0 +1,272 @@
+import asyncio
+import hashlib
+import queue
+import sqlite3
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+
+def openai_embedder(client, model: str) -> Callable[[List[str]], List[List[float]]]:
+    """
+    One embeddings API call for a whole batch of texts. `client` is an
+    OpenAI client or a function returning one, so a lazily created client
+    is only built on the first call.
+    """
+    def embed_batch(texts: List[str]) -> List[List[float]]:
+        api = client() if callable(client) else client
+        response = api.embeddings.create(model=model, input=texts)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+    return embed_batch
+
+
+class EmbeddingProvider:
+    """
+    Shared embedding front end with a two-tier cache and micro-batching.
+
+    Texts are keyed by a hash of model and content. Lookups go to a bounded
+    in-memory LRU first, then to a bounded SQLite table. Misses from all
+    callers, on any thread, are collected for up to `batch_window` seconds
+    (or `max_batch` texts) and sent to the API in a single request.
+    """
+
+    def __init__(
+        self,
+        embed_batch: Callable[[List[str]], List[List[float]]],
+        model: str,
+        cache_path: Optional[str] = None,
+        memory_entries: int = 10000,
+        disk_entries: int = 200000,
+        batch_window: float = 0.005,
+        max_batch: int = 256,
+    ):
+        self.embed_batch = embed_batch
+        self.model = model
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+
+        self.memory = OrderedDict()
+        self.memory_lock = threading.Lock()
+        self.disk = None
+        self.disk_lock = threading.Lock()
+        self.disk_writes = 0
+        if cache_path:
+            self.disk = sqlite3.connect(cache_path, check_same_thread=False)
+            self.disk.execute("PRAGMA journal_mode=WAL")
+            self.disk.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            self.disk.commit()
+
+        self.requests = queue.Queue()
+        self.batcher = threading.Thread(target=self._run_batcher, name="embedding-batcher", daemon=True)
+        self.batcher.start()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.api_calls = 0
+        self.api_texts = 0
+        self.api_time = 0.0
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\0{text}".encode()).hexdigest()
+
+    def _remember(self, key: str, vector: List[float]):
+        with self.memory_lock:
+            self.memory[key] = vector
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_entries:
+                self.memory.popitem(last=False)
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self.memory_lock:
+            for key in keys:
+                vector = self.memory.get(key)
+                if vector is not None:
+                    self.memory.move_to_end(key)
+                    found[key] = vector
+        self.memory_hits += len(found)
+
+        missing = [key for key in keys if key not in found]
+        if missing and self.disk is not None:
+            with self.disk_lock:
+                rows = self.disk.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(missing))})",
+                    missing,
+                ).fetchall()
+            for key, blob in rows:
+                vector = np.frombuffer(blob, dtype=np.float32).tolist()
+                found[key] = vector
+                self._remember(key, vector)
+            self.disk_hits += len(rows)
+        return found
+
+    def _persist(self, items: Dict[str, List[float]]):
+        if self.disk is None or not items:
+            return
+        now = time.time()
+        with self.disk_lock, self.disk:
+            self.disk.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items.items()],
+            )
+            self.disk_writes += len(items)
+            # Trim occasionally rather than on every write.
+            if self.disk_writes >= max(1, self.disk_entries // 10):
+                self.disk_writes = 0
+                self.disk.execute(
+                    "DELETE FROM embeddings WHERE key IN ("
+                    "SELECT key FROM embeddings ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.disk_entries,),
+                )
+
+    @staticmethod
+    def _claim(item, pending: list) -> int:
+        """Add a request to the batch unless its caller already gave up; returns its text count."""
+        texts, future = item
+        # A caller that timed out or was cancelled has cancelled its future,
+        # which can then take no result.
+        if not future.set_running_or_notify_cancel():
+            return 0
+        pending.append(item)
+        return len(texts)
+
+    def _run_batcher(self):
+        while True:
+            pending = []
+            try:
+                count = self._claim(self.requests.get(), pending)
+                deadline = time.monotonic() + self.batch_window
+                while count < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self.requests.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    count += self._claim(item, pending)
+                if pending:
+                    self._embed_pending(pending)
+            except Exception as e:
+                # One bad batch must not stop the thread every embedding waits on.
+                traceback.print_exc()
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _embed_pending(self, pending):
+        unique = list(dict.fromkeys(text for texts, _ in pending for text in texts))
+        vectors = {}
+        # A text may have been embedded by the previous batch while this
+        # request was waiting in the queue.
+        with self.memory_lock:
+            for text in unique:
+                vector = self.memory.get(self._key(text))
+                if vector is not None:
+                    vectors[text] = vector
+        unique = [text for text in unique if text not in vectors]
+        try:
+            fresh = {}
+            for start in range(0, len(unique), self.max_batch):
+                batch = unique[start:start + self.max_batch]
+                started = time.perf_counter()
+                embedded = self.embed_batch(batch)
+                self.api_time += time.perf_counter() - started
+                self.api_calls += 1
+                self.api_texts += len(batch)
+                for text, vector in zip(batch, embedded):
+                    vectors[text] = [float(v) for v in vector]
+                    fresh[self._key(text)] = vectors[text]
+                    self._remember(self._key(text), vectors[text])
+            self._persist(fresh)
+        except Exception as e:
+            for _, future in pending:
+                future.set_exception(e)
+            return
+        for _, future in pending:
+            future.set_result(vectors)
+
+    def _split(self, texts: List[str]):
+        keys = [self._key(text) for text in texts]
+        found = self._lookup(list(dict.fromkeys(keys)))
+        missing = list(dict.fromkeys(text for text, key in zip(texts, keys) if key not in found))
+        self.misses += len(missing)
+        return keys, found, missing
+
+    def _merge(self, texts, keys, found, vectors) -> List[List[float]]:
+        for text, key in zip(texts, keys):
+            if key not in found:
+                found[key] = vectors[text]
+        return [found[key] for key in keys]
+
+    def _submit(self, texts: List[str]) -> Future:
+        future = Future()
+        self.requests.put((texts, future))
+        return future
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        keys, found, missing = self._split(texts)
+        vectors = self._submit(missing).result() if missing else {}
+        return self._merge(texts, keys, found, vectors)
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        """Like embed, but waits on the batch without holding a thread."""
+        keys, found, missing = self._split(texts)
+        vectors = await asyncio.wrap_future(self._submit(missing)) if missing else {}
+        return self._merge(texts, keys, found, vectors)
+
+    def stats(self) -> dict:
+        return {
+            "memory_entries": len(self.memory),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "api_calls": self.api_calls,
+            "api_texts": self.api_texts,
+            "api_ms_avg": self.api_time / self.api_calls * 1000 if self.api_calls else 0.0,
+        }
+
+
+def cached_embedding_function(provider: EmbeddingProvider, api_key_env_var: str = "OPENAI_API_KEY"):
+    """
+    Chroma embedding function backed by an EmbeddingProvider.
+
+    It reports itself as "openai" with the same config shape as Chroma's
+    OpenAIEmbeddingFunction, so collections created with that function
+    accept it. Chroma is imported here, when the collection is opened,
+    rather than with this module.
+    """
+    from chromadb import Documents, EmbeddingFunction, Embeddings
+
+    class CachedEmbeddingFunction(EmbeddingFunction[Documents]):
+        def __init__(self, provider: EmbeddingProvider, api_key_env_var: str):
+            self.provider = provider
+            self.api_key_env_var = api_key_env_var
+
+        def __call__(self, input: Documents) -> Embeddings:
+            return [np.asarray(v, dtype=np.float32) for v in self.provider.embed(list(input))]
+
+        @staticmethod
+        def name() -> str:
+            return "openai"
+
+        def get_config(self) -> dict:
+            return {"api_key_env_var": self.api_key_env_var, "model_name": self.provider.model}
+
+        @staticmethod
+        def build_from_config(config: dict) -> "EmbeddingFunction[Documents]":
+            from chromadb.utils.embedding_functions import OpenAIEmbeddingFunction
+
+            return OpenAIEmbeddingFunction.build_from_config(config)
+
+    return CachedEmbeddingFunction(provider, api_key_env_var)
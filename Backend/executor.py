@@ -0,0 +1,56 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Optional
+
+from fastapi import Request
+from config import BLOCKING_POOL_SIZE
+
+# Chroma's HttpClient and the Whisper upload are synchronous. Running them
+# here keeps them off the event loop, and the bounded size caps how many
+# upstream calls run at once.
+_executor = ThreadPoolExecutor(max_workers=BLOCKING_POOL_SIZE, thread_name_prefix="blocking-io")
+
+
+async def run_blocking(func: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+    """
+    Run a synchronous call in the shared pool and await it.
+
+    On timeout or cancellation the caller gets control back right away; the
+    worker thread cannot be interrupted, so it finishes in the background
+    and its result is discarded.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+    return await asyncio.wait_for(future, timeout)
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+async def cancel_on_disconnect(request: Request, awaitable: Awaitable, poll_interval: float = 0.25,
+                               still_wanted: Optional[Callable[[], bool]] = None) -> Any:
+    """
+    Await a call, cancelling it if the HTTP client goes away first, unless
+    still_wanted() says someone else is waiting on it.
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                if still_wanted is not None and still_wanted():
+                    return await task
+                break
+    finally:
+        # Cancelled once only, so the call can still clean up.
+        if not task.done():
+            task.cancel()
+    raise ClientDisconnected("client disconnected")
+
+
+def shutdown():
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,205 @@
+import asyncio
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+
+class GenerationRejected(Exception):
+    """No generation slot: the queue is full, or the wait for a slot timed out."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class GenerationCancelled(Exception):
+    """The answer was cancelled: superseded, asked for by a viewer, or nobody was watching."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class Generation:
+    """One answer being generated for a session; `run` makes a step of it cancellable."""
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.task: Optional[asyncio.Future] = None
+        self.cancelled: Optional[str] = None
+        self.viewed = False
+        self.unwatched_since: Optional[float] = None
+        self.queue_ms = 0.0
+
+    def cancel(self, reason: str) -> bool:
+        if self.cancelled is not None:
+            return False
+        self.cancelled = reason
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+        return True
+
+    async def run(self, coro):
+        """Await coro as a task of its own; raises GenerationCancelled if cancel() stops it."""
+        if self.cancelled is not None:
+            coro.close()
+            raise GenerationCancelled(self.cancelled)
+        self.task = asyncio.ensure_future(coro)
+        try:
+            return await self.task
+        except asyncio.CancelledError:
+            if self.cancelled is None or not self.task.cancelled():
+                # The caller itself is being cancelled.
+                raise
+            raise GenerationCancelled(self.cancelled)
+        finally:
+            self.task = None
+
+
+class Generations:
+    """
+    The answers being generated by this worker: at most one per session,
+    and at most max_active at once, to stay within the model's rate limits.
+
+    A question waits for a slot in arrival order, with up to max_queue
+    waiting for at most queue_timeout seconds; beyond that it is refused
+    straight away (GenerationRejected) rather than piling up. A newer
+    question in the same session cancels the answer in flight, or its wait
+    for a slot, as do `cancel` and the session's viewers all leaving (see
+    `watched`).
+    """
+
+    def __init__(self, max_active: int = 16, max_queue: int = 32, queue_timeout: float = 10.0,
+                 orphan_grace: float = 5.0, window: int = 1000):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.orphan_grace = orphan_grace
+        self.window = window
+        self.active = 0
+        self.waiters = deque()
+        self.sessions: Dict[str, Generation] = {}
+
+        self.started = 0
+        self.queued = 0
+        self.rejected = 0
+        self.queue_timeouts = 0
+        self.cancelled = Counter()
+        self.wait_ms: List[float] = []
+
+    async def _acquire(self):
+        if self.active < self.max_active and not self.waiters:
+            self.active += 1
+            return
+        if len(self.waiters) >= self.max_queue:
+            self.rejected += 1
+            raise GenerationRejected("Too many answers are being generated; try again shortly", self.queue_timeout)
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append(future)
+        self.queued += 1
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done():
+                # The slot was handed over just as the wait ended; pass it on.
+                self._release()
+            else:
+                future.cancel()
+                self.waiters.remove(future)
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected += 1
+                self.queue_timeouts += 1
+                raise GenerationRejected("Timed out waiting to generate an answer", self.queue_timeout)
+            raise
+        finally:
+            self.wait_ms.append((time.monotonic() - started) * 1000)
+            del self.wait_ms[:-self.window]
+
+    def _release(self):
+        # The slot goes straight to the longest waiter, if any.
+        while self.waiters:
+            future = self.waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def _begin(self, session_id: str) -> Generation:
+        previous = self.sessions.get(session_id)
+        if previous is not None and previous.cancel("superseded"):
+            self.cancelled["superseded"] += 1
+        generation = self.sessions[session_id] = Generation(session_id)
+        return generation
+
+    def _end(self, generation: Generation):
+        if self.sessions.get(generation.session_id) is generation:
+            del self.sessions[generation.session_id]
+
+    @asynccontextmanager
+    async def slot(self, session_id: str):
+        """
+        Become the session's generation, cancelling the one before, and wait
+        for a slot. Raises GenerationRejected when there is none, and
+        GenerationCancelled when cancelled before one was free.
+        """
+        generation = self._begin(session_id)
+        started = time.monotonic()
+        try:
+            await generation.run(self._acquire())
+        except BaseException:
+            self._end(generation)
+            raise
+        generation.queue_ms = (time.monotonic() - started) * 1000
+        self.started += 1
+        try:
+            yield generation
+        finally:
+            self._release()
+            self._end(generation)
+
+    def cancel(self, session_id: str, reason: str = "client") -> bool:
+        """Cancel the session's answer in flight, if any."""
+        generation = self.sessions.get(session_id)
+        if generation is None or not generation.cancel(reason):
+            return False
+        self.cancelled[reason] += 1
+        return True
+
+    def watched(self, session_id: str, has_viewers: bool):
+        """
+        Called as frames go out: cancels an answer whose viewers have all
+        been gone for orphan_grace seconds. One that never had a viewer
+        (asked through the API alone) is left to finish.
+        """
+        generation = self.sessions.get(session_id)
+        if generation is None or generation.task is None or self.orphan_grace <= 0:
+            return
+        if has_viewers:
+            generation.viewed = True
+            generation.unwatched_since = None
+            return
+        if not generation.viewed:
+            return
+        now = time.monotonic()
+        if generation.unwatched_since is None:
+            generation.unwatched_since = now
+        elif now - generation.unwatched_since >= self.orphan_grace:
+            self.cancel(session_id, "no_viewers")
+
+    def metrics(self) -> dict:
+        ordered = sorted(self.wait_ms)
+        return {
+            "active": self.active,
+            "queued": len(self.waiters),
+            "max_active": self.max_active,
+            "max_queue": self.max_queue,
+            "started": self.started,
+            "waited": self.queued,
+            "rejected": self.rejected,
+            "queue_timeouts": self.queue_timeouts,
+            "cancelled": dict(self.cancelled),
+            "wait_ms_p50": ordered[len(ordered) // 2] if ordered else 0.0,
+            "wait_ms_max": ordered[-1] if ordered else 0.0,
+        }
@@ -0,0 +1,192 @@
+import base64
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from typing import Optional, Tuple
+
+from tracing import window_stats
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# Formats the vision model takes as they are.
+MIME_TYPES = {"jpeg": "image/jpeg", "png": "image/png", "webp": "image/webp", "gif": "image/gif"}
+
+PreparedImage = namedtuple("PreparedImage", "digest mime data width height source_bytes resized prepare_ms")
+
+
+class ImageUploadError(ValueError):
+    """The upload is too large or is not an image the model can read."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def sniff_image_format(header: bytes) -> Optional[str]:
+    """Image format from the first bytes of a file."""
+    if header[:3] == b"\xff\xd8\xff":
+        return "jpeg"
+    if header[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    if header[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    return None
+
+
+async def read_image_upload(file, max_bytes: int) -> bytes:
+    """An UploadFile's bytes, refused before reading if it is over max_bytes."""
+    size = file.size
+    if size is None:
+        size = file.size = file.file.seek(0, os.SEEK_END)
+        await file.seek(0)
+    if size > max_bytes:
+        raise ImageUploadError(f"Image upload is larger than {max_bytes} bytes", 413)
+    return await file.read()
+
+
+def target_size(width: int, height: int, max_side: int, max_short_side: int):
+    """The size the model works at: within max_side, short side within max_short_side; never larger."""
+    scale = min(1.0, max_side / max(width, height), max_short_side / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def prepare_image(data: bytes, max_side: int = 2048, max_short_side: int = 768, jpeg_quality: int = 85,
+                  digest: Optional[str] = None) -> PreparedImage:
+    """
+    Shrink an image to the resolution the model works at and pick its MIME
+    type from its content.
+
+    An image already within bounds, in a format the model reads, is sent
+    as it is. Anything else is decoded (JPEGs at a reduced scale straight
+    from the DCT, which is most of the saving on phone photos), turned
+    upright from its EXIF orientation, resized and re-encoded: PNG if it
+    has transparency, JPEG otherwise. If that comes out larger than an
+    original the model could have read, the original is kept.
+    """
+    started = time.perf_counter()
+    digest = digest or hashlib.sha256(data).hexdigest()
+    image_format = sniff_image_format(data[:12])
+    if Image is None:
+        if image_format is None:
+            raise ImageUploadError("Upload is not a JPEG, PNG, WebP or GIF image", 415)
+        return PreparedImage(digest, MIME_TYPES[image_format], data, None, None, len(data), False,
+                             (time.perf_counter() - started) * 1000)
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        width, height = image.size
+        target = target_size(width, height, max_side, max_short_side)
+        # The model reads only the first frame of a GIF, and ignores EXIF.
+        as_is = image_format is not None and image.getexif().get(0x0112, 1) == 1 and not getattr(image, "is_animated", False)
+        if as_is and target == (width, height):
+            return PreparedImage(digest, MIME_TYPES[image_format], data, width, height, len(data), False,
+                                 (time.perf_counter() - started) * 1000)
+
+        if image.format == "JPEG":
+            image.draft("RGB", target)
+        image = ImageOps.exif_transpose(image)
+        target = target_size(image.width, image.height, max_side, max_short_side)
+        if image.size != target:
+            image = image.resize(target, Image.LANCZOS, reducing_gap=2.0)
+    except Image.DecompressionBombError:
+        raise ImageUploadError("Image has too many pixels", 413)
+    except (OSError, SyntaxError, ValueError):
+        raise ImageUploadError("Upload is not an image that can be read", 415)
+
+    out = io.BytesIO()
+    if image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info):
+        image.save(out, "PNG", optimize=True)
+        mime = "image/png"
+    else:
+        image.convert("RGB").save(out, "JPEG", quality=jpeg_quality, optimize=True)
+        mime = "image/jpeg"
+    encoded = out.getvalue()
+    if as_is and len(encoded) >= len(data):
+        encoded, mime = data, MIME_TYPES[image_format]
+    return PreparedImage(digest, mime, encoded, image.width, image.height, len(data), True,
+                         (time.perf_counter() - started) * 1000)
+
+
+def data_url(image: PreparedImage) -> str:
+    return f"data:{image.mime};base64,{base64.b64encode(image.data).decode('ascii')}"
+
+
+class ImageCache:
+    """
+    Prepared images by (session, content hash), least recently used first
+    out once max_bytes of them are held, so a screenshot sent again in the
+    same session is not decoded and resized again.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, session_id: str, digest: str) -> Optional[PreparedImage]:
+        with self.lock:
+            image = self.entries.get((session_id, digest))
+            if image is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end((session_id, digest))
+            self.hits += 1
+            return image
+
+    def put(self, session_id: str, image: PreparedImage):
+        if len(image.data) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop((session_id, image.digest), None)
+            if old is not None:
+                self.bytes -= len(old.data)
+            self.entries[(session_id, image.digest)] = image
+            self.bytes += len(image.data)
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= len(evicted.data)
+
+    def prepare(self, session_id: str, data: bytes, **options) -> Tuple[PreparedImage, bool]:
+        """prepare_image, or the session's earlier result for the same bytes; True when it was cached."""
+        digest = hashlib.sha256(data).hexdigest()
+        image = self.get(session_id, digest)
+        if image is not None:
+            return image, True
+        image = prepare_image(data, digest=digest, **options)
+        self.put(session_id, image)
+        return image, False
+
+    def stats(self) -> dict:
+        return {"entries": len(self.entries), "bytes": self.bytes, "hits": self.hits, "misses": self.misses}
+
+
+class ImageStats:
+    """Sizes and latencies of the last `window` image questions."""
+
+    FIELDS = ("images", "duplicates", "upload_bytes", "payload_bytes", "prepare_ms", "first_token_ms", "total_ms")
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self.values = {field: [] for field in self.FIELDS}
+        self.count = 0
+
+    def record(self, timings: dict):
+        self.count += 1
+        for field, values in self.values.items():
+            if field in timings:
+                values.append(timings[field])
+                del values[:-self.window]
+
+    def stats(self) -> dict:
+        return {"questions": self.count, **{field: window_stats(values) for field, values in self.values.items()}}
@@ -0,0 +1,523 @@
+"""
+Bulk ingest into the mixed_content knowledge collection.
+
+    python ingest.py data/qa_bank.jsonl notes/ resume.txt
+    python ingest.py --chroma-path /tmp/chroma --embedder hash data/
+
+JSONL lines with "question" and "answer" become qa chunks (the answer is
+the document and the question goes in the metadata, as retrieve_context
+expects); lines with "text" or "content" become text chunks. Markdown is
+split at headings and plain text (including text extracted from PDFs,
+pages separated by form feeds) at blank lines, then packed into chunks of
+about --chunk-tokens tokens. .pdf files are read when pypdf is installed.
+
+Chunk ids are content hashes, so a rerun only embeds chunks that are new
+or changed. Progress is checkpointed per file; an interrupted run picks
+up where it stopped.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, List, Optional
+
+from tokens import token_counter
+
+TEXT_EXTENSIONS = {".md": "markdown", ".markdown": "markdown", ".txt": "text", ".jsonl": "jsonl", ".pdf": "pdf"}
+
+
+def iter_files(paths: List[str]) -> Iterator[str]:
+    """Supported files under the given paths, as absolute paths (they key the checkpoint and pruning)."""
+    for path in map(os.path.abspath, paths):
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if os.path.splitext(name)[1].lower() in TEXT_EXTENSIONS:
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def read_jsonl(path: str) -> Iterator[dict]:
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                print(f"{path}:{line_no}: skipping invalid JSON", file=sys.stderr)
+                continue
+            question = item.get("question")
+            answer = item.get("answer")
+            if question and answer:
+                yield {"type": "qa", "question": question, "text": answer}
+            elif item.get("text") or item.get("content"):
+                yield {"type": "text", "title": item.get("title"), "text": item.get("text") or item.get("content")}
+
+
+def read_paragraphs(lines: Iterator[str], markdown: bool) -> Iterator[dict]:
+    """Paragraphs (blank-line separated) with the Markdown heading they fall under."""
+    title = None
+    paragraph = []
+    for raw in lines:
+        # A form feed (page break in extracted PDF text) ends a paragraph.
+        for page, line in enumerate(raw.split("\f")):
+            if page and paragraph:
+                yield {"type": "text", "title": title, "text": " ".join(paragraph)}
+                paragraph = []
+            stripped = line.strip()
+            heading = markdown and re.match(r"#{1,6}\s+(.*)", stripped)
+            if heading or not stripped:
+                if paragraph:
+                    yield {"type": "text", "title": title, "text": " ".join(paragraph)}
+                    paragraph = []
+                if heading:
+                    title = heading.group(1).strip()
+                    # A new section starts a new chunk.
+                    yield {"type": "break"}
+                continue
+            paragraph.append(stripped)
+    if paragraph:
+        yield {"type": "text", "title": title, "text": " ".join(paragraph)}
+
+
+def read_pdf(path: str) -> Iterator[str]:
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise SystemExit(f"{path}: install pypdf to read PDFs, or ingest their extracted text")
+    for page in PdfReader(path).pages:
+        yield from (page.extract_text() or "").splitlines()
+        yield "\f"
+
+
+def read_records(path: str) -> Iterator[dict]:
+    kind = TEXT_EXTENSIONS.get(os.path.splitext(path)[1].lower(), "text")
+    if kind == "jsonl":
+        yield from read_jsonl(path)
+    elif kind == "pdf":
+        yield from read_paragraphs(read_pdf(path), markdown=False)
+    else:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            yield from read_paragraphs(f, markdown=kind == "markdown")
+
+
+def split_long(text: str, count_tokens: Callable[[str], int], limit: int) -> List[str]:
+    """Split text longer than `limit` tokens at sentence, then word, boundaries."""
+    if count_tokens(text) <= limit:
+        return [text]
+    pieces, current = [], []
+    units = re.split(r"(?<=[.!?])\s+", text)
+    if len(units) == 1:
+        units = text.split()
+    for unit in units:
+        candidate = " ".join(current + [unit])
+        if current and count_tokens(candidate) > limit:
+            pieces.append(" ".join(current))
+            current = []
+        current.append(unit)
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+
+def chunk_records(
+    records: Iterator[dict],
+    count_tokens: Callable[[str], int],
+    chunk_tokens: int = 300,
+    overlap_tokens: int = 40,
+) -> Iterator[dict]:
+    """
+    Pack text paragraphs into chunks of about chunk_tokens, carrying the
+    last paragraphs (up to overlap_tokens) into the next chunk. Q&A pairs
+    are kept whole.
+    """
+    current, size, title = [], 0, None
+
+    def emit():
+        return {"type": "text", "title": title, "text": "\n\n".join(text for text, _ in current)}
+
+    for record in records:
+        if record["type"] != "text":
+            if current:
+                yield emit()
+                current, size = [], 0
+            if record["type"] == "qa":
+                yield record
+            continue
+        if record.get("title") != title and current:
+            yield emit()
+            current, size = [], 0
+        title = record.get("title")
+        for piece in split_long(record["text"], count_tokens, chunk_tokens):
+            tokens = count_tokens(piece)
+            if current and size + tokens > chunk_tokens:
+                yield emit()
+                carried, carried_size = [], 0
+                for text, text_tokens in reversed(current):
+                    if carried_size + text_tokens > overlap_tokens:
+                        break
+                    carried.insert(0, (text, text_tokens))
+                    carried_size += text_tokens
+                current, size = carried, carried_size
+            current.append((piece, tokens))
+            size += tokens
+    if current:
+        yield emit()
+
+
+def to_document(chunk: dict, source: str) -> dict:
+    """Chroma id, document and metadata for a chunk; the id is a hash of the content."""
+    question = chunk.get("question") or ""
+    digest = hashlib.sha256(f"{chunk['type']}\0{question}\0{chunk['text']}".encode()).hexdigest()
+    metadata = {"type": chunk["type"], "source": source, "content_hash": digest}
+    if question:
+        metadata["question"] = question
+    if chunk.get("title"):
+        metadata["title"] = chunk["title"]
+    return {"id": f"c_{digest[:32]}", "document": chunk["text"], "metadata": metadata}
+
+
+def hash_embedder(dim: int = 256) -> Callable[[List[str]], List[List[float]]]:
+    """Offline stand-in for dry runs and tests: hashed bag of words, not semantic."""
+    def embed_batch(texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for text in texts:
+            vector = [0.0] * dim
+            for word in re.findall(r"[a-z0-9]+", text.lower()):
+                vector[int.from_bytes(hashlib.md5(word.encode()).digest()[:4], "little") % dim] += 1.0
+            norm = sum(v * v for v in vector) ** 0.5 or 1.0
+            vectors.append([v / norm for v in vector])
+        return vectors
+    return embed_batch
+
+
+def is_rate_limited(error: Exception) -> bool:
+    return getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError"
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Seconds the server asked to wait, from retry-after-ms or retry-after."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        try:
+            return float(headers[name]) * scale
+        except (KeyError, TypeError, ValueError):
+            continue
+    return None
+
+
+class AdaptiveLimit:
+    """
+    Gate for concurrent API calls. A rate-limit response halves the limit
+    and pauses every caller for the server's Retry-After (or a backoff);
+    the limit grows back by one after `recover_after` consecutive
+    successes.
+    """
+
+    def __init__(self, maximum: int, recover_after: int = 10):
+        self.maximum = maximum
+        self.limit = maximum
+        self.recover_after = recover_after
+        self.successes = 0
+        self.active = 0
+        self.paused_until = 0.0
+        self.condition = threading.Condition()
+
+    def __enter__(self):
+        with self.condition:
+            while True:
+                wait = self.paused_until - time.monotonic()
+                if wait <= 0 and self.active < self.limit:
+                    break
+                self.condition.wait(timeout=wait if wait > 0 else None)
+            self.active += 1
+
+    def __exit__(self, *exc):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def throttled(self, delay: float):
+        with self.condition:
+            self.limit = max(1, self.limit // 2)
+            self.successes = 0
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+    def succeeded(self):
+        with self.condition:
+            self.successes += 1
+            if self.successes >= self.recover_after and self.limit < self.maximum:
+                self.limit += 1
+                self.successes = 0
+                self.condition.notify_all()
+
+
+class Checkpoint:
+    """Per-file progress, keyed by path and invalidated when size or mtime change."""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.files = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.files = json.load(f).get("files", {})
+
+    @staticmethod
+    def _stamp(source: str) -> dict:
+        stat = os.stat(source)
+        return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+    def progress(self, source: str) -> dict:
+        entry = self.files.get(source)
+        if entry and all(entry.get(k) == v for k, v in self._stamp(source).items()):
+            return entry
+        return {"chunks_done": 0, "complete": False}
+
+    def update(self, source: str, chunks_done: int, complete: bool):
+        self.files[source] = {**self._stamp(source), "chunks_done": chunks_done, "complete": complete}
+
+    def save(self):
+        if not self.path:
+            return
+        temp = f"{self.path}.tmp"
+        with open(temp, "w") as f:
+            json.dump({"version": 1, "files": self.files}, f)
+        os.replace(temp, self.path)
+
+
+class Ingester:
+    """
+    Streams files through chunking, skips chunks whose content hash is
+    already in the collection, and embeds and upserts the rest in batches
+    on up to `concurrency` threads.
+    """
+
+    def __init__(
+        self,
+        collection,
+        embed_batch: Callable[[List[str]], List[List[float]]],
+        count_tokens: Callable[[str], int],
+        batch_size: int = 64,
+        concurrency: int = 4,
+        chunk_tokens: int = 300,
+        overlap_tokens: int = 40,
+        checkpoint: Optional[Checkpoint] = None,
+        prune: bool = False,
+        max_retries: int = 8,
+        report_every: float = 5.0,
+        out=sys.stderr,
+    ):
+        self.collection = collection
+        self.embed_batch = embed_batch
+        self.count_tokens = count_tokens
+        self.batch_size = batch_size
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.checkpoint = checkpoint or Checkpoint(None)
+        self.prune = prune
+        self.max_retries = max_retries
+        self.report_every = report_every
+        self.out = out
+        self.limit = AdaptiveLimit(concurrency)
+        self.pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="ingest")
+        self.stats = {
+            "files": 0, "files_skipped": 0, "chunks": 0, "resumed": 0, "unchanged": 0,
+            "embedded": 0, "tokens": 0, "api_calls": 0, "retries": 0, "rate_limited": 0, "pruned": 0,
+        }
+        self.stats_lock = threading.Lock()
+        self.started = time.monotonic()
+        self.last_report = self.started
+        self.total_files = 0
+
+    def _embed_and_upsert(self, batch: List[dict]):
+        texts = [item["document"] for item in batch]
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self.limit:
+                    vectors = self.embed_batch(texts)
+                break
+            except Exception as e:
+                if not is_rate_limited(e) or attempt == self.max_retries:
+                    raise
+                self.limit.throttled(retry_after(e) or min(30.0, 0.5 * 2 ** attempt))
+                with self.stats_lock:
+                    self.stats["rate_limited"] += 1
+                    self.stats["retries"] += 1
+        self.limit.succeeded()
+        self.collection.upsert(
+            ids=[item["id"] for item in batch],
+            documents=texts,
+            metadatas=[item["metadata"] for item in batch],
+            embeddings=vectors,
+        )
+        tokens = sum(self.count_tokens(text) for text in texts)
+        with self.stats_lock:
+            self.stats["api_calls"] += 1
+            self.stats["embedded"] += len(batch)
+            self.stats["tokens"] += tokens
+
+    def _submit(self, batch: List[dict], marks: List[tuple], in_flight: deque):
+        # A chunk repeated within the batch is upserted once.
+        unique = list({item["id"]: item for item in batch}.values())
+        existing = set(self.collection.get(ids=[item["id"] for item in unique], include=[])["ids"])
+        fresh = [item for item in unique if item["id"] not in existing]
+        self.stats["unchanged"] += len(batch) - len(fresh)
+        future = self.pool.submit(self._embed_and_upsert, fresh) if fresh else None
+        in_flight.append((future, marks))
+        # Batches are committed to the checkpoint in submission order; at
+        # most two per worker are queued ahead of the oldest one.
+        while in_flight and (len(in_flight) > 2 * self.limit.maximum or in_flight[0][0] is None or in_flight[0][0].done()):
+            self._commit(in_flight.popleft())
+
+    def _commit(self, entry):
+        future, marks = entry
+        if future is not None:
+            future.result()
+        for source, chunks_done, complete, seen in marks:
+            self.checkpoint.update(source, chunks_done, complete)
+            if complete:
+                self.stats["files"] += 1
+                if self.prune and seen is not None:
+                    self._prune(source, seen)
+        self.checkpoint.save()
+        self._report()
+
+    def _prune(self, source: str, seen: set):
+        stored = self.collection.get(where={"source": source}, include=[])["ids"]
+        stale = [i for i in stored if i not in seen]
+        if stale:
+            self.collection.delete(ids=stale)
+            self.stats["pruned"] += len(stale)
+
+    def _report(self, final: bool = False):
+        now = time.monotonic()
+        if not final and now - self.last_report < self.report_every:
+            return
+        self.last_report = now
+        elapsed = max(now - self.started, 1e-9)
+        s = self.stats
+        print(
+            f"{'done' if final else 'progress'}: files {s['files']}/{self.total_files} "
+            f"chunks {s['chunks']} (embedded {s['embedded']}, unchanged {s['unchanged']}, resumed {s['resumed']}) "
+            f"{s['embedded'] / elapsed:.1f} chunks/s {s['tokens'] / elapsed:.0f} tok/s "
+            f"concurrency {self.limit.limit} retries {s['retries']}"
+            + (f" pruned {s['pruned']}" if self.prune else "")
+            + f" [{elapsed:.1f}s]",
+            file=self.out,
+            flush=True,
+        )
+
+    def run(self, paths: List[str]) -> dict:
+        files = list(iter_files(paths))
+        self.total_files = len(files)
+        in_flight = deque()
+        batch, marks = [], []
+        try:
+            for source in files:
+                progress = self.checkpoint.progress(source)
+                if progress["complete"] and not self.prune:
+                    self.stats["files"] += 1
+                    self.stats["files_skipped"] += 1
+                    continue
+                seen = set() if self.prune else None
+                index = 0
+                chunks = chunk_records(read_records(source), self.count_tokens, self.chunk_tokens, self.overlap_tokens)
+                for index, chunk in enumerate(chunks, 1):
+                    item = to_document(chunk, source)
+                    self.stats["chunks"] += 1
+                    if seen is not None:
+                        seen.add(item["id"])
+                    if index <= progress["chunks_done"]:
+                        self.stats["resumed"] += 1
+                        continue
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        self._submit(batch, marks + [(source, index, False, None)], in_flight)
+                        batch, marks = [], []
+                marks.append((source, index, True, seen))
+            if batch:
+                self._submit(batch, marks, in_flight)
+            elif marks:
+                in_flight.append((None, marks))
+            while in_flight:
+                self._commit(in_flight.popleft())
+        finally:
+            self.pool.shutdown(wait=True)
+            self.checkpoint.save()
+        self._report(final=True)
+        return {**self.stats, "seconds": time.monotonic() - self.started}
+
+
+def open_collection(args):
+    import chromadb
+
+    if args.chroma_path:
+        client = chromadb.PersistentClient(path=args.chroma_path)
+    else:
+        client = chromadb.HttpClient(host=args.chroma_host, port=args.chroma_port)
+    embedding_function = None
+    if args.embedder == "openai":
+        from chromadb.utils.embedding_functions import OpenAIEmbeddingFunction
+
+        # Same embedding function config the app opens the collection with.
+        embedding_function = OpenAIEmbeddingFunction(model_name=args.model)
+    return client.get_or_create_collection(args.collection, embedding_function=embedding_function)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest JSONL, Markdown, text and PDF sources into Chroma.")
+    parser.add_argument("paths", nargs="+", help="files or directories")
+    parser.add_argument("--collection", default="mixed_content")
+    parser.add_argument("--chroma-host", default=os.environ.get("CHROMA_HOST", "localhost"))
+    parser.add_argument("--chroma-port", type=int, default=int(os.environ.get("CHROMA_PORT", "8000")))
+    parser.add_argument("--chroma-path", help="use a local persistent Chroma at this path instead of the server")
+    parser.add_argument("--embedder", choices=["openai", "hash"], default="openai",
+                        help="'hash' embeds offline, for dry runs and tests")
+    parser.add_argument("--model", default=os.environ.get("EMBEDDING_MODEL", "text-embedding-ada-002"))
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--chunk-tokens", type=int, default=300)
+    parser.add_argument("--overlap-tokens", type=int, default=40)
+    parser.add_argument("--checkpoint", default=".ingest_checkpoint.json", help="'' disables checkpointing")
+    parser.add_argument("--prune", action="store_true", help="delete chunks of ingested files that are no longer in them")
+    parser.add_argument("--report-every", type=float, default=5.0)
+    args = parser.parse_args()
+
+    if args.embedder == "openai":
+        from dotenv import load_dotenv
+        from openai import OpenAI
+        from embeddings import openai_embedder
+
+        load_dotenv()
+        # Rate limits are handled here, with backoff and lower concurrency.
+        embed_batch = openai_embedder(OpenAI(max_retries=0), args.model)
+    else:
+        embed_batch = hash_embedder()
+
+    ingester = Ingester(
+        open_collection(args),
+        embed_batch,
+        token_counter(),
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        chunk_tokens=args.chunk_tokens,
+        overlap_tokens=args.overlap_tokens,
+        checkpoint=Checkpoint(args.checkpoint or None),
+        prune=args.prune,
+        report_every=args.report_every,
+    )
+    stats = ingester.run(args.paths)
+    print(json.dumps(stats))
+
+
+if __name__ == "__main__":
+    main()
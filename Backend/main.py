@@ -1,25 +1,131 @@
 import os
-import base64
-from fastapi import HTTPException, FastAPI, UploadFile, Form, File, WebSocket, WebSocketDisconnect
+import asyncio
+import json
+import time
+from fastapi import HTTPException, FastAPI, Request, UploadFile, Form, File, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from models import Message
-from database import create_session, store_message, get_messages, transcribe_audio
+from database import (
+    create_session,
+    store_message,
+    get_history,
+    get_message_seq,
+    transcribe_audio,
+    migrate_chat_sessions,
+    compact_sessions,
+    close_stale_answers,
+)
 import uvicorn
+from contextlib import aclosing, asynccontextmanager
 from websocket_manager import ConnectionManager
-from tempfile import NamedTemporaryFile
-from openai import AsyncOpenAI
-from config import collection
+from broadcast import BrokerBroadcast
+from config import (
+    STREAM_PROTOCOL,
+    STREAM_FLUSH_INTERVAL,
+    STREAM_FLUSH_CHARS,
+    WS_SEND_QUEUE_SIZE,
+    WS_SEND_TIMEOUT,
+    BROADCAST_BACKEND,
+    BROADCAST_URL,
+    DB_TIMEOUT,
+    HISTORY_PAGE_SIZE,
+    ANSWER_CHECKPOINT_INTERVAL,
+    ANSWER_STALE_AFTER,
+    ANSWER_CACHE_ENABLED,
+    ANSWER_CACHE_PATH,
+    ANSWER_CACHE_THRESHOLD,
+    ANSWER_CACHE_TTL,
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_REPLAY,
+    ANSWER_CACHE_REPLAY_DELAY,
+    SPECULATIVE_PARTIAL_INTERVAL,
+    SPECULATIVE_MAX_PARTIALS,
+    SPECULATIVE_REUSE_OVERLAP,
+    AUDIO_MAX_BYTES,
+    AUDIO_RESAMPLE_RATE,
+    IMAGE_MAX_BYTES,
+    IMAGE_MAX_SIDE,
+    IMAGE_MAX_SHORT_SIDE,
+    IMAGE_JPEG_QUALITY,
+    IMAGE_DETAIL,
+    IMAGE_CACHE_BYTES,
+    IMAGE_MAX_TOKENS,
+    MEMORY_STORE,
+    MEMORY_DB_PATH,
+    MEMORY_TOKEN_BUDGET,
+    MEMORY_MAX_SESSIONS,
+    MEMORY_IDLE_TTL,
+    MEMORY_SUMMARIZE,
+    MEMORY_SUMMARIZE_AFTER,
+    CONTEXT_TOKEN_BUDGET,
+    CONTEXT_DEDUP_THRESHOLD,
+    CONTEXT_RERANK,
+    CONTEXT_DISTANCE_MARGIN,
+    CONTEXT_MIN_RESULTS,
+    CONTEXT_MAX_RESULTS,
+    VECTOR_INDEX,
+    VECTOR_INDEX_PATH,
+    VECTOR_INDEX_QUANTIZE,
+    VECTOR_INDEX_REFRESH,
+    VECTOR_INDEX_MAX_ROWS,
+    TRACE_LOG_PATH,
+    GENERATION_MAX_ACTIVE,
+    GENERATION_MAX_QUEUE,
+    GENERATION_QUEUE_TIMEOUT,
+    GENERATION_ORPHAN_GRACE,
+)
+from executor import run_blocking, cancel_on_disconnect, ClientDisconnected, shutdown as shutdown_blocking_pool
+from clients import async_openai_client, collection, embedding_provider, ensure_warm, readiness, close_clients
+from streaming import AnswerStreamer, stream_answer, replay_chunks
+from answer_cache import AnswerCache
+from audio_pipeline import SpeculativeAudioQuestion
+from conversation_memory import (
+    ConversationMemory,
+    InProcessMemoryStore,
+    SQLiteMemoryStore,
+    PromptStats,
+    format_turn,
+)
+from context_builder import ContextBuilder
+from vector_index import IndexInUse, LocalVectorIndex
+from tokens import token_counter
+from audio_upload import AudioUploadError, HEADER_BYTES, check_audio_header, check_audio_upload, downsample_wav
+from image_upload import ImageCache, ImageStats, ImageUploadError, data_url, read_image_upload
+from tracing import Tracer, current_trace, span
+from upload_limit import FORM_OVERHEAD_BYTES, UploadLimit
+from generation import Generation, GenerationCancelled, GenerationRejected, Generations
 import traceback
-from collections import deque
-from typing import List, Optional
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
 
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
-app = FastAPI()
-
-global_qa_queue = deque(maxlen=7) 
-
-client_op = AsyncOpenAI()  
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Serve right away; the clients warm up, and old history is migrated,
+    # in the background.
+    startup = asyncio.create_task(warm_up_and_migrate())
+    await manager.start()
+    yield
+    startup.cancel()
+    await manager.close()
+    if vector_index is not None:
+        vector_index.close()
+    await close_clients()
+    shutdown_blocking_pool()
+
+app = FastAPI(lifespan=lifespan)
+
+MAX_IMAGES = 5
+
+# Added before CORSMiddleware so it runs inside it and a 413 still gets CORS headers.
+app.add_middleware(
+    UploadLimit,
+    limits={
+        "/ask-audio": AUDIO_MAX_BYTES + FORM_OVERHEAD_BYTES,
+        "/send-message": MAX_IMAGES * IMAGE_MAX_BYTES + FORM_OVERHEAD_BYTES,
+    },
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -29,31 +135,233 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-manager = ConnectionManager()
+answer_cache = AnswerCache(
+    ANSWER_CACHE_PATH,
+    threshold=ANSWER_CACHE_THRESHOLD,
+    ttl=ANSWER_CACHE_TTL,
+    max_entries=ANSWER_CACHE_MAX_ENTRIES,
+) if ANSWER_CACHE_ENABLED else None
+
+tracer = Tracer(TRACE_LOG_PATH or None)
+
+manager = ConnectionManager(
+    max_queue=WS_SEND_QUEUE_SIZE,
+    send_timeout=WS_SEND_TIMEOUT,
+    backend=BrokerBroadcast(BROADCAST_URL) if BROADCAST_BACKEND == "broker" else None,
+    on_send=tracer.observe_send,
+)
+tracer.gauge("assistant_ws_connections", "Open WebSockets on this worker.",
+             lambda: sum(len(c) for c in manager.active_connections.values()))
+tracer.gauge("assistant_ws_sessions", "Sessions with a WebSocket open on this worker.",
+             lambda: len(manager.active_connections))
+tracer.gauge("assistant_ws_evicted_total", "WebSockets dropped for falling too far behind.", lambda: manager.evicted,
+             kind="counter")
+
+generations = Generations(
+    max_active=GENERATION_MAX_ACTIVE,
+    max_queue=GENERATION_MAX_QUEUE,
+    queue_timeout=GENERATION_QUEUE_TIMEOUT,
+    orphan_grace=GENERATION_ORPHAN_GRACE,
+)
+tracer.gauge("assistant_generations_active", "Answers streaming from the model on this worker.",
+             lambda: generations.active)
+tracer.gauge("assistant_generations_queued", "Questions waiting for a generation slot.", lambda: len(generations.waiters))
+tracer.gauge("assistant_generations_rejected_total", "Questions refused for want of a generation slot.",
+             lambda: generations.rejected, kind="counter")
+tracer.gauge("assistant_generations_cancelled_total", "Answers cancelled before they were complete, by reason.",
+             lambda: generations.cancelled, kind="counter", label="reason")
+
+async def summarize_turns(summary: str, turns: List[dict]) -> str:
+    """Folds turns that no longer fit the memory window into the running summary."""
+    transcript = "\n".join(format_turn(t["question"], t["answer"]) for t in turns)
+    client_op = await async_openai_client.aget()
+    response = await client_op.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[{
+            "role": "user",
+            "content": (
+                "Summarize this interview so far in at most 150 words. Keep the topics asked about "
+                "and the concrete facts, tools and numbers the candidate gave, so later answers stay "
+                f"consistent with them.\n\nSummary so far:\n{summary or '(none)'}\n\nNew turns:\n{transcript}"
+            ),
+        }],
+        max_tokens=300,
+        temperature=0.2,
+    )
+    return response.choices[0].message.content or summary
+
+memory_store = (
+    SQLiteMemoryStore(MEMORY_DB_PATH)
+    if MEMORY_STORE == "sqlite"
+    else InProcessMemoryStore(max_sessions=MEMORY_MAX_SESSIONS, idle_ttl=MEMORY_IDLE_TTL)
+)
+count_tokens = token_counter()
+conversation_memory = ConversationMemory(
+    memory_store,
+    token_budget=MEMORY_TOKEN_BUDGET,
+    count_tokens=count_tokens,
+    summarize=summarize_turns if MEMORY_SUMMARIZE else None,
+    summarize_after=MEMORY_SUMMARIZE_AFTER,
+)
+prompt_stats = PromptStats()
+context_builder = ContextBuilder(
+    count_tokens,
+    token_budget=CONTEXT_TOKEN_BUDGET,
+    dedup_threshold=CONTEXT_DEDUP_THRESHOLD,
+    rerank=CONTEXT_RERANK,
+    distance_margin=CONTEXT_DISTANCE_MARGIN,
+    min_results=CONTEXT_MIN_RESULTS,
+    max_results=CONTEXT_MAX_RESULTS,
+)
+try:
+    vector_index = LocalVectorIndex(
+        collection,
+        VECTOR_INDEX_PATH,
+        quantize=VECTOR_INDEX_QUANTIZE,
+        refresh_interval=VECTOR_INDEX_REFRESH,
+    ) if VECTOR_INDEX == "local" else None
+except IndexInUse:
+    # Another worker on this host owns the index files.
+    vector_index = None
+
+# Answers streaming on this worker, by message id, until their final text
+# is stored, so a viewer that joins mid-answer is replayed the text sent so
+# far (see history_frame).
+live_answers: Dict[str, AnswerStreamer] = {}
+
+def new_answer_streamer(session_id: str, message_id: str, timings: Optional[dict] = None,
+                        started_at: Optional[float] = None, extra: Optional[dict] = None,
+                        history_seq: Optional[int] = None) -> AnswerStreamer:
+    async def send(frame: dict):
+        if frame.get("is_complete"):
+            # The viewer's replay cursor; only complete messages move it.
+            frame["history_seq"] = history_seq
+        with span("broadcast"):
+            await manager.broadcast(session_id, frame)
+        if not frame.get("is_complete"):
+            generations.watched(session_id, manager.has_viewers(session_id))
+
+    async def checkpoint(text: str):
+        await store_message(session_id, Message(role="assistant", content=text), message_id=message_id,
+                            is_complete=False)
+
+    streamer = live_answers[message_id] = AnswerStreamer(
+        send,
+        protocol=STREAM_PROTOCOL,
+        flush_interval=STREAM_FLUSH_INTERVAL,
+        flush_chars=STREAM_FLUSH_CHARS,
+        message_id=message_id,
+        extra=extra,
+        on_checkpoint=checkpoint,
+        checkpoint_interval=ANSWER_CHECKPOINT_INTERVAL,
+        timings=timings,
+        started_at=started_at,
+    )
+    return streamer
+
+def query_knowledge(**kwargs) -> dict:
+    local = vector_index is not None and vector_index.ready and vector_index.count() <= VECTOR_INDEX_MAX_ROWS
+    return (vector_index if local else collection()).query(**kwargs)
 
-async def query_question_streaming(question: str):
+async def retrieve_context(question: str, speculative: Optional[dict] = None, use_cache: bool = True) -> dict:
     """
-    Streams response chunks from the LLM
+    Embeds the question, checks the answer cache and fetches similar
+    content from Chroma (or its local index), trimmed to the context budget.
+    The context of a retrieval made for a near-identical question (a partial
+    transcript) can be passed in as `speculative` and is kept; only the
+    knowledge is reused, never the partial's embedding or cached answer.
+    use_cache=False skips the answer cache.
     """
-    try:
-        results = collection.query(
-            query_texts=[question],
-            n_results=20
+    # One embedding serves both the cache lookup and the Chroma query.
+    with span("embedding"):
+        embedding = (await asyncio.wait_for(embedding_provider.aembed([question]), DB_TIMEOUT))[0]
+    if answer_cache and use_cache:
+        with span("answer_cache"):
+            cached = await run_blocking(answer_cache.lookup, embedding, timeout=DB_TIMEOUT)
+        if cached is not None:
+            return {"embedding": embedding, "cached_answer": cached, "context": None}
+    if speculative is not None and speculative.get("context") is not None:
+        return {**speculative, "embedding": embedding, "cached_answer": None}
+
+    with span("vector_query"):
+        results = await run_blocking(
+            query_knowledge,
+            timeout=DB_TIMEOUT,
+            query_embeddings=[embedding],
+            n_results=context_builder.n_results(),
+            include=["documents", "metadatas", "distances"],
         )
-        
-        context_parts = []
-        for i in range(len(results['documents'][0])):
-            if results['metadatas'][0][i]['type'] == 'qa':
-                context_parts.append(
-                    f"Q: {results['metadatas'][0][i]['question']}\nA: {results['documents'][0][i]}"
-                )
-            else:
-                context_parts.append(f"Text: {results['documents'][0][i]}")
-
-        context = "\n\n".join(context_parts)
-
-        previous_qa_context = "\n".join([f"Q: {q}\nA: {a}" for q, a in global_qa_queue])
-        
+    with span("context"):
+        built = await run_blocking(context_builder.build, question, results, timeout=DB_TIMEOUT)
+    return {"embedding": embedding, "cached_answer": None, **built}
+
+async def traced_stream(stream, requested: float):
+    """
+    The text of a model's streamed chunks. The current trace gets the wait
+    for the first token ("llm_first_token", from `requested`, when the
+    request was sent), the rest of the stream ("llm_stream") and the number
+    of tokens.
+    """
+    trace = current_trace()
+    first = None
+    tokens = 0
+    try:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                if first is None:
+                    first = time.monotonic()
+                tokens += 1
+                yield chunk.choices[0].delta.content
+    finally:
+        # Stops the model generating for an answer that was cancelled.
+        await stream.close()
+        if trace is not None and first is not None:
+            trace.add("llm_first_token", (first - requested) * 1000, (requested - trace.started) * 1000)
+            trace.add("llm_stream", (time.monotonic() - first) * 1000, (first - trace.started) * 1000)
+            trace.attrs["tokens"] = trace.attrs.get("tokens", 0) + tokens
+
+async def query_question_streaming(
+    question: str,
+    session_id: Optional[str] = None,
+    retrieval: Optional[dict] = None,
+    timings: Optional[dict] = None,
+):
+    """
+    Streams response chunks from the LLM, or replays the cached answer of a
+    near-identical earlier question. A retrieval prepared ahead of time
+    (e.g. while audio was still being transcribed) skips that step. The
+    session's earlier questions and answers go into the prompt; an answer
+    built on them is neither served from nor stored in the answer cache,
+    which is shared by all sessions.
+    """
+    try:
+        with span("memory"):
+            previous_qa_context, memory_tokens = (
+                await conversation_memory.context(session_id) if session_id else ("", 0)
+            )
+        use_cache = not previous_qa_context
+
+        if retrieval is not None and retrieval["cached_answer"] is not None and not use_cache:
+            # Prepared without the session's memory in view.
+            retrieval = None
+        if retrieval is None:
+            started = time.monotonic()
+            retrieval = await retrieve_context(question, use_cache=use_cache)
+            if timings is not None:
+                timings["retrieval_ms"] = (time.monotonic() - started) * 1000
+        if timings is not None:
+            timings["cache_hit"] = retrieval["cached_answer"] is not None
+        if retrieval["cached_answer"] is not None:
+            async for chunk in replay_chunks(retrieval["cached_answer"], ANSWER_CACHE_REPLAY, delay=ANSWER_CACHE_REPLAY_DELAY):
+                yield chunk
+            return
+
+        context = retrieval["context"]
+        embedding = retrieval["embedding"]
+        if timings is not None:
+            for key in ("context_tokens", "context_chunks", "retrieved_chunks", "context_ms"):
+                timings[key] = retrieval[key]
+
         prompt = f"""
 You are Vishwajeet, a very experienced Data Engineer with 5 years of professional experience, particularly skilled Extensive Data Engineering. When responding to interview questions, answer exactly as a knowledgeable, authentic human candidate would. Follow these guidelines carefully:
 
@@ -160,6 +468,14 @@ Current Question: {question}
 
 Now craft Vishwajeet's authentic response:"""
 
+        with span("prompt"):
+            prompt_tokens = await run_blocking(count_tokens, prompt)
+        prompt_stats.record(prompt_tokens, memory_tokens)
+        if timings is not None:
+            timings["prompt_tokens"] = prompt_tokens
+
+        client_op = await async_openai_client.aget()
+        requested = time.monotonic()
         stream = await client_op.chat.completions.create(
             model="gpt-4o-mini",
             messages=[{"role": "user", "content": prompt}],
@@ -170,218 +486,537 @@ Now craft Vishwajeet's authentic response:"""
             frequency_penalty=0.2
         )
         
-        async for chunk in stream:
-            if chunk.choices[0].delta.content:
-                yield chunk.choices[0].delta.content
+        generated = []
+        async with aclosing(traced_stream(stream, requested)) as texts:
+            async for text in texts:
+                generated.append(text)
+                yield text
+
+        if answer_cache and use_cache and generated:
+            await run_blocking(answer_cache.store, question, embedding, "".join(generated), timeout=DB_TIMEOUT)
                 
     except Exception as e:
         traceback.print_exc()
         yield f"Error: {str(e)}"
 
+async def answer_with(
+    session_id: str,
+    question: str,
+    kind: str,
+    prepare: Callable[[dict], Awaitable[AsyncIterator[str]]],
+    is_audio: bool = False,
+    is_image: bool = False,
+    timings: Optional[dict] = None,
+    started_at: Optional[float] = None,
+    on_answered: Optional[Callable[[dict], None]] = None,
+) -> str:
+    """
+    Stores and broadcasts the question, then streams the answer to every
+    viewer of the session and stores it. Stage timings end up in the final
+    frame, and every frame carries the request id of the question's trace.
+
+    `prepare` is awaited with the timings before the answer waits for a
+    generation slot and returns the answer's chunks. on_answered, if given,
+    gets the timings once the answer is stored.
+
+    The answer takes one of the generation slots and is cancelled when the
+    session moves on (see Generations); a cancelled answer is stored as far
+    as it got but kept out of the conversation memory. Raises
+    GenerationRejected when no slot is free.
+    """
+    started_at = started_at or time.monotonic()
+    timings = timings if timings is not None else {}
+    trace = current_trace() or tracer.start(kind, session_id, started_at)
+    outcome = "error"
+    flags = {"is_image": True} if is_image else {}
+    try:
+        chunks = await prepare(timings)
+
+        async with generations.slot(session_id) as generation:
+            timings["queue_ms"] = generation.queue_ms
+            trace.add("queue", generation.queue_ms)
+            with span("store"):
+                user_message = Message(role="user", content=question)
+                user_record = await store_message(session_id, user_message, is_audio=is_audio, is_image=is_image)
+            await manager.broadcast(
+                session_id,
+                {
+                    "role": user_message.role,
+                    "content": user_message.content,
+                    "is_audio": is_audio,
+                    **flags,
+                    "is_complete": True,
+                    "request_id": trace.request_id,
+                    "message_id": user_record["id"],
+                    "history_seq": user_record["seq"],
+                }
+            )
+
+            with span("store"):
+                assistant_msg = Message(role="assistant", content="")
+                assistant_record = await store_message(session_id, assistant_msg, is_image=is_image,
+                                                       is_complete=False)
+
+            streamer = new_answer_streamer(session_id, assistant_record["id"], timings=timings, started_at=started_at,
+                                           extra={**flags, "request_id": trace.request_id},
+                                           history_seq=assistant_record["seq"])
+            try:
+                final_text, cancelled = await run_generation(generation, chunks, streamer)
+            finally:
+                await store_answer(session_id, assistant_record["id"], streamer.text)
+            if on_answered is not None:
+                on_answered(timings)
+
+            if cancelled:
+                outcome = "cancelled"
+                return final_text
+            await conversation_memory.remember(session_id, question, final_text)
+            outcome = "error" if final_text.startswith(("Error:", "ERROR:")) else "ok"
+            return final_text
+    except GenerationCancelled:
+        # Superseded while waiting for a slot; nothing was stored.
+        outcome = "cancelled"
+        return ""
+    except GenerationRejected:
+        outcome = "rejected"
+        raise
+    except asyncio.CancelledError:
+        # The request was abandoned (see send_message).
+        outcome = "cancelled"
+        raise
+    finally:
+        tracer.finish(trace, outcome, timings)
+
+async def answer_question(
+    session_id: str,
+    question: str,
+    is_audio: bool = False,
+    retrieval: Optional[dict] = None,
+    timings: Optional[dict] = None,
+    started_at: Optional[float] = None,
+) -> str:
+    """Answers a typed or transcribed question from the knowledge base; see answer_with."""
+    async def prepare(timings: dict):
+        return query_question_streaming(question, session_id, retrieval, timings)
+
+    return await answer_with(session_id, question, "audio" if is_audio else "text", prepare, is_audio=is_audio,
+                             timings=timings, started_at=started_at)
+
+async def store_answer(session_id: str, message_id: str, text: str):
+    """Store an answer's final text, complete, after which it is replayed from the store."""
+    try:
+        with span("store"):
+            await store_message(session_id, Message(role="assistant", content=text), message_id=message_id)
+    finally:
+        live_answers.pop(message_id, None)
+
+async def run_generation(generation: Generation, chunks, streamer: AnswerStreamer) -> Tuple[str, Optional[str]]:
+    """
+    Streams an answer as the generation's cancellable step. Returns the
+    answer and, if it was cut short, why; it then ends with what was sent.
+    If the caller itself is cancelled, viewers still get the closing frame.
+    """
+    try:
+        return await generation.run(stream_answer(chunks, streamer)), None
+    except asyncio.CancelledError:
+        if not streamer.finished:
+            await streamer.finish(cancelled="disconnected")
+        raise
+    except GenerationCancelled as e:
+        if streamer.finished:
+            # Cancelled just as it completed.
+            return streamer.text, None
+        return await streamer.finish(cancelled=e.reason), e.reason
+
+image_cache = ImageCache(IMAGE_CACHE_BYTES)
+image_stats = ImageStats()
+
+async def prepare_images(session_id: str, files: List[UploadFile], timings: dict) -> list:
+    """
+    Read the uploads and shrink them on the blocking pool, all at once. An
+    image attached twice is sent once, and one this session already sent
+    comes from the cache.
+    """
+    started = time.monotonic()
+    with span("upload"):
+        uploads = [await read_image_upload(file, IMAGE_MAX_BYTES) for file in files]
+    unique = list(dict.fromkeys(uploads))
+    options = {
+        "max_side": 512 if IMAGE_DETAIL == "low" else IMAGE_MAX_SIDE,
+        "max_short_side": 512 if IMAGE_DETAIL == "low" else IMAGE_MAX_SHORT_SIDE,
+        "jpeg_quality": IMAGE_JPEG_QUALITY,
+    }
+    with span("prepare_images"):
+        prepared = await asyncio.gather(*(run_blocking(image_cache.prepare, session_id, data, **options) for data in unique))
+        images = [image for image, _ in prepared]
+        urls = await run_blocking(lambda: [data_url(image) for image in images])
+    timings.update(
+        images=len(images),
+        duplicates=len(uploads) - len(unique),
+        reused=sum(1 for _, cached in prepared if cached),
+        resized=sum(1 for image in images if image.resized),
+        upload_bytes=sum(len(data) for data in uploads),
+        payload_bytes=sum(len(url) for url in urls),
+        prepare_ms=(time.monotonic() - started) * 1000,
+    )
+    return urls
+
+async def query_image_streaming(question: str, urls: List[str]):
+    """Streams the model's answer about the attached images."""
+    try:
+        client_op = await async_openai_client.aget()
+        requested = time.monotonic()
+        stream = await client_op.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[{
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": question},
+                    *({"type": "image_url", "image_url": {"url": url, "detail": IMAGE_DETAIL}} for url in urls),
+                ],
+            }],
+            max_tokens=IMAGE_MAX_TOKENS,
+            stream=True,
+        )
+        async with aclosing(traced_stream(stream, requested)) as texts:
+            async for text in texts:
+                yield text
+    except Exception as e:
+        traceback.print_exc()
+        yield f"Error: {str(e)}"
+
+async def answer_image_question(session_id: str, question: str, files: List[UploadFile]) -> str:
+    """
+    Like answer_question, for a question about attached images: the final
+    frame also carries the upload and payload sizes. The images are
+    prepared before the answer waits for a generation slot.
+    """
+    async def prepare(timings: dict):
+        urls = await prepare_images(session_id, files, timings)
+        return query_image_streaming(question, urls)
+
+    return await answer_with(session_id, question, "image", prepare, is_image=True, on_answered=image_stats.record)
+
+AUDIO_EXTENSIONS = {
+    "audio/webm": "webm",
+    "audio/ogg": "ogg",
+    "audio/mp4": "mp4",
+    "audio/mpeg": "mp3",
+    "audio/wav": "wav",
+}
+
+background_tasks = set()
+
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+def new_audio_question(mime: Optional[str]) -> SpeculativeAudioQuestion:
+    extension = AUDIO_EXTENSIONS.get((mime or "audio/webm").split(";")[0].strip(), "webm")
+
+    async def transcribe(audio: bytes) -> str:
+        # Only the final transcript runs inside a question's trace.
+        with span("transcribe"):
+            return await transcribe_audio(audio, f"audio.{extension}")
+
+    return SpeculativeAudioQuestion(
+        transcribe,
+        retrieve_context,
+        partial_interval=SPECULATIVE_PARTIAL_INTERVAL,
+        max_partials=SPECULATIVE_MAX_PARTIALS,
+        reuse_overlap=SPECULATIVE_REUSE_OVERLAP,
+    )
+
+async def answer_audio_question(session_id: str, websocket: WebSocket, audio_question: SpeculativeAudioQuestion):
+    ended = time.monotonic()
+    trace = tracer.start("audio", session_id, ended)
+    try:
+        question, retrieval, timings = await audio_question.finish()
+    except Exception as e:
+        traceback.print_exc()
+        tracer.finish(trace, "error")
+        await manager.send_personal(websocket, session_id, {"type": "error", "error": str(e)})
+        return
+    try:
+        await answer_question(session_id, question, is_audio=True, retrieval=retrieval, timings=timings, started_at=ended)
+    except GenerationRejected as e:
+        await manager.send_personal(websocket, session_id, {"type": "error", "error": str(e)})
+
+async def migrate_history():
+    try:
+        migrated = await migrate_chat_sessions()
+        if migrated:
+            print(f"Migrated {migrated} messages from chat_sessions")
+        closed = await close_stale_answers(ANSWER_STALE_AFTER)
+        if closed:
+            print(f"Closed {closed} answers left incomplete")
+        removed = await compact_sessions()
+        if removed:
+            print(f"Removed {removed} empty assistant messages")
+    except Exception:
+        traceback.print_exc()
+
+async def warm_up_and_migrate():
+    warming = ensure_warm()
+    if warming is not None:
+        await warming
+    await migrate_history()
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Ready once every upstream client exists; until then, keeps warming them."""
+    ensure_warm()
+    status = readiness()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
 @app.post("/start-session")
 async def start_session():
     session_id = await create_session()
     print("New session started:", session_id)
     return {"sessionId": session_id}
 
+def history_frame(row: dict) -> Optional[dict]:
+    """
+    A stored message as replayed to a viewer. An answer still streaming
+    goes out incomplete and without history_seq, so the viewer's cursor
+    stays before it, unless it is older than ANSWER_STALE_AFTER and so
+    abandoned; None for an empty answer left complete by old code.
+    """
+    streamer = live_answers.get(row["id"])
+    if streamer is not None:
+        # Streaming here: the text sent so far, which the answer's next
+        # frames continue from, or the final text not stored yet.
+        frame = streamer.snapshot()
+        if frame["is_complete"]:
+            frame["history_seq"] = row["seq"]
+        return frame
+    frame = {
+        "role": row["role"],
+        "content": row["content"],
+        "message_id": row["id"],
+        "is_audio": bool(row["is_audio"]),
+        "is_image": bool(row["is_image"]),
+        "is_complete": bool(row["is_complete"]),
+    }
+    if not frame["is_complete"]:
+        if row["timestamp"] >= time.time() - ANSWER_STALE_AFTER:
+            # Streaming on another worker: the last checkpoint, which its
+            # final frame replaces.
+            return frame
+        # Abandoned by a crash or a failed final write: no final frame
+        # will come, so the checkpoint is all there is.
+        frame["is_complete"] = True
+    if row["role"] == "assistant" and not row["content"]:
+        return None
+    frame["history_seq"] = row["seq"]
+    return frame
+
+async def history_cursor(session_id: str, params) -> Optional[int]:
+    """
+    The seq a connecting viewer has seen up to: ?after=<history_seq>, or
+    ?after_id=<message id> of the last message it has. None when it gave
+    neither, as older clients do; 0 when the id is not in the session.
+    """
+    if params.get("after_id"):
+        return await get_message_seq(session_id, params["after_id"]) or 0
+    try:
+        return max(0, int(params["after"]))
+    except (KeyError, ValueError):
+        return None
+
+async def replay_history(connection, session_id: str, after: Optional[int]) -> int:
+    """
+    Queue the messages stored after `after` ahead of the connection's live
+    frames, and return how many went out. They go in pages of
+    HISTORY_PAGE_SIZE, each as one {"type": "history", "messages": [...],
+    "done": bool} frame, the next page read while the last is sent; the
+    final page (possibly empty) has done set. A viewer that gave no cursor
+    gets the whole history one message per frame, as before.
+    """
+    paged = after is not None
+    after = after or 0
+    replayed = 0
+    while True:
+        rows = await get_history(session_id, after, HISTORY_PAGE_SIZE)
+        frames = [frame for frame in map(history_frame, rows) if frame is not None]
+        done = len(rows) < HISTORY_PAGE_SIZE
+        if paged:
+            queued = connection.enqueue({"type": "history", "messages": frames, "done": done}, bounded=False)
+        else:
+            queued = all([connection.enqueue(frame, bounded=False) for frame in frames])
+        replayed += len(frames)
+        if done or not queued:
+            return replayed
+        after = rows[-1]["seq"]
+
 @app.websocket("/ws/{session_id}")
 async def websocket_endpoint(websocket: WebSocket, session_id: str):
-    await manager.connect(websocket, session_id)
+    connection = await manager.connect(websocket, session_id, replay=True)
+    audio_question = None
     try:
-        messages = await get_messages(session_id)
-        for message_entry in messages:
-            message_data = message_entry["message"].dict()
-            message_data["is_audio"] = message_entry.get("is_audio", False)
-            message_data["is_complete"] = True
-            await websocket.send_json(message_data)
-
+        after = await history_cursor(session_id, websocket.query_params)
+        manager.replayed(connection, await replay_history(connection, session_id, after))
+
+        # Besides keeping the socket open, the loop accepts a question
+        # recorded live: {"type": "audio_start", "mime": ...}, binary audio
+        # chunks, then {"type": "audio_end"}; {"type": "cancel"} to stop the
+        # answer being generated; and the frontend's reports of how long
+        # answers took to render.
         while True:
-            data = await websocket.receive_text()
-            pass
+            data = await websocket.receive()
+            if data["type"] == "websocket.disconnect":
+                break
+            if data.get("bytes") is not None:
+                if audio_question is not None:
+                    chunk = data["bytes"]
+                    try:
+                        if audio_question.size == 0:
+                            check_audio_header(chunk[:HEADER_BYTES])
+                        if audio_question.size + len(chunk) > AUDIO_MAX_BYTES:
+                            raise AudioUploadError(f"Audio recording is larger than {AUDIO_MAX_BYTES} bytes", 413)
+                    except AudioUploadError as e:
+                        audio_question.cancel()
+                        audio_question = None
+                        await manager.send_personal(websocket, session_id, {"type": "error", "error": str(e)})
+                        continue
+                    audio_question.feed(chunk)
+                continue
+            try:
+                control = json.loads(data.get("text") or "")
+            except ValueError:
+                continue
+            if not isinstance(control, dict):
+                continue
+            if control.get("type") == "audio_start":
+                if audio_question is not None:
+                    audio_question.cancel()
+                audio_question = new_audio_question(control.get("mime"))
+            elif control.get("type") == "audio_end" and audio_question is not None:
+                run_in_background(answer_audio_question(session_id, websocket, audio_question))
+                audio_question = None
+            elif control.get("type") == "cancel":
+                generations.cancel(session_id, "client")
+            elif control.get("type") == "render":
+                # {"type": "render", "request_id", "frame": "first" | "final", "render_ms"}
+                try:
+                    tracer.report_render(str(control.get("request_id")), control.get("frame"),
+                                         float(control.get("render_ms")))
+                except (TypeError, ValueError):
+                    pass
 
     except WebSocketDisconnect:
+        pass
+    finally:
+        if audio_question is not None:
+            audio_question.cancel()
         manager.disconnect(websocket, session_id)
 
-@app.post("/send-message")
-async def send_message(sessionId: str = Form(...), message: str = Form(...), files: Optional[List[UploadFile]] = File(None) ):
-    if files:
-        if len(files) > 5:
-            raise HTTPException(status_code=400, detail="Maximum 5 images allowed")
-        
-        image_payloads = []
-        for file in files:
-            image_bytes = await file.read()
-            base64_image = base64.b64encode(image_bytes).decode("utf-8")
-            image_payloads.append({
-                "type": "image_url", 
-                "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
-            })
-        
-        messages_payload = [
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": message},
-                    *image_payloads
-                ]
-            }
-        ]
-        
-        user_message = Message(role="user", content=message)
-        await store_message(sessionId, user_message, is_image=True)
-        await manager.broadcast(
-            sessionId,
-            {
-                "role": user_message.role,
-                "content": user_message.content,
-                "is_audio": False,
-                "is_image": True,
-                "is_complete": True
-            }
-        )
-        
-        try:
-            response = await client_op.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages_payload,
-                max_tokens=300
-            )
-            final_text = response.choices[0].message.content
-        except Exception as e:
-            final_text = f"ERROR: {str(e)}"
-        
-        assistant_msg = Message(role="assistant", content=final_text)
-        await store_message(sessionId, assistant_msg, is_image=True)
-        await manager.broadcast(
-            sessionId,
-            {
-                "role": "assistant",
-                "content": final_text,
-                "is_audio": False,
-                "is_image": True,
-                "is_complete": True
-            }
-        )
-        
-        global_qa_queue.append((message, final_text))
-        return final_text
-    
-    else:
-        user_message = Message(role="user", content=message)
-        await store_message(sessionId, user_message)
-        await manager.broadcast(
-            sessionId,
-            {
-                "role": user_message.role,
-                "content": user_message.content,
-                "is_audio": False,
-                "is_complete": True
-            }
-        )
+@app.get("/metrics")
+async def metrics():
+    """Stage latencies, time to first token and tokens/s, in the Prometheus text format."""
+    return PlainTextResponse(tracer.render_prometheus(), media_type="text/plain; version=0.0.4")
 
-        assistant_msg = Message(role="assistant", content="")
-        await store_message(sessionId, assistant_msg)
-        
-        accumulated_text = []
-        try:
-            async for partial_chunk in query_question_streaming(message):
-                accumulated_text.append(partial_chunk)
-                await manager.broadcast(
-                    sessionId,
-                    {
-                        "role": "assistant",
-                        "content": "".join(accumulated_text),
-                        "is_audio": False,
-                        "is_complete": False
-                    }
-                )
-        except Exception as e:
-            error_text = f"ERROR: {str(e)}"
-            accumulated_text = [error_text]
-
-        final_text = "".join(accumulated_text)
-        assistant_msg.content = final_text
-        await store_message(sessionId, assistant_msg)
-        await manager.broadcast(
-            sessionId,
-            {
-                "role": "assistant",
-                "content": final_text,
-                "is_audio": False,
-                "is_complete": True
-            }
-        )
+@app.get("/generation/metrics")
+async def generation_metrics():
+    return generations.metrics()
 
-        global_qa_queue.append((message, final_text)) 
+@app.get("/connections/metrics")
+async def connection_metrics():
+    return manager.metrics()
 
-        return final_text
+@app.get("/cache/metrics")
+async def cache_metrics():
+    return answer_cache.stats() if answer_cache else {"enabled": False}
 
+@app.get("/embeddings/metrics")
+async def embedding_metrics():
+    return embedding_provider.stats()
 
-@app.post("/ask-audio")
-async def ask_audio(sessionId: str = Form(...), file: UploadFile = Form(...)):
-    with NamedTemporaryFile(delete=False, suffix=".wav") as temp_audio:
-        audio_bytes = await file.read()
-        temp_audio.write(audio_bytes)
-        temp_audio_path = temp_audio.name
+@app.get("/memory/metrics")
+async def memory_metrics():
+    return {**await run_blocking(conversation_memory.stats), **prompt_stats.stats()}
+
+@app.get("/context/metrics")
+async def context_metrics():
+    return context_builder.stats()
 
+@app.get("/images/metrics")
+async def image_metrics():
+    return {**image_stats.stats(), "cache": image_cache.stats()}
+
+@app.get("/index/metrics")
+async def index_metrics():
+    return vector_index.stats() if vector_index is not None else {"backend": "chroma"}
+
+@app.post("/send-message")
+async def send_message(request: Request, sessionId: str = Form(...), message: str = Form(...), files: Optional[List[UploadFile]] = File(None) ):
+    if files:
+        if len(files) > MAX_IMAGES:
+            raise HTTPException(status_code=400, detail=f"Maximum {MAX_IMAGES} images allowed")
+        try:
+            return await cancel_on_disconnect(request, answer_image_question(sessionId, message, files),
+                                              still_wanted=lambda: manager.has_viewers(sessionId))
+        except ClientDisconnected:
+            return {"error": "client disconnected"}
+        except ImageUploadError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        except GenerationRejected as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": f"{e.retry_after:.0f}"})
+        finally:
+            for file in files:
+                await file.close()
     try:
-        question = transcribe_audio(temp_audio_path)
-    except Exception as e:
-        if os.path.exists(temp_audio_path):
-            os.remove(temp_audio_path)
-        return {"error": str(e)}
-
-    user_message = Message(role="user", content=question)
-    await store_message(sessionId, user_message, is_audio=True)
-    await manager.broadcast(
-        sessionId,
-        {
-            "role": user_message.role,
-            "content": question,
-            "is_audio": True,
-            "is_complete": True
-        }
-    )
+        return await cancel_on_disconnect(request, answer_question(sessionId, message),
+                                          still_wanted=lambda: manager.has_viewers(sessionId))
+    except ClientDisconnected:
+        return {"error": "client disconnected"}
+    except GenerationRejected as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": f"{e.retry_after:.0f}"})
 
-    assistant_msg = Message(role="assistant", content="")
-    await store_message(sessionId, assistant_msg)
 
-    accumulated_text = []
+@app.post("/ask-audio")
+async def ask_audio(request: Request, sessionId: str = Form(...), file: UploadFile = Form(...)):
+    timings = {}
+    started = time.monotonic()
+    trace = tracer.start("audio", sessionId, started)
     try:
-        async for partial_chunk in query_question_streaming(question):
-            accumulated_text.append(partial_chunk)
-            await manager.broadcast(
-                sessionId,
-                {
-                    "role": "assistant",
-                    "content": "".join(accumulated_text),
-                    "is_audio": False,
-                    "is_complete": False
-                }
-            )
-    except Exception as e:
-        error_text = f"ERROR: {str(e)}"
-        accumulated_text = [error_text]
-    finally:
-        if os.path.exists(temp_audio_path):
-            os.remove(temp_audio_path)
-
-    final_text = "".join(accumulated_text)
-    assistant_msg.content = final_text
-    await store_message(sessionId, assistant_msg)
-    await manager.broadcast(
-        sessionId,
-        {
-            "role": "assistant",
-            "content": final_text,
-            "is_audio": False,
-            "is_complete": True
-        }
-    )
+        try:
+            audio_format = await check_audio_upload(file, AUDIO_MAX_BYTES)
+        except AudioUploadError as e:
+            tracer.finish(trace, "rejected")
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        timings["audio_bytes"] = file.size
 
-    global_qa_queue.append((question, final_text))
+        try:
+            # Starlette has already spooled the upload (in memory, or on disk
+            # past 1 MB); hand that buffer to the client instead of copying it.
+            audio = file.file
+            if audio_format == "wav" and AUDIO_RESAMPLE_RATE:
+                with span("resample"):
+                    audio = await run_blocking(downsample_wav, await file.read(), AUDIO_RESAMPLE_RATE)
+                timings["upload_bytes"] = len(audio)
+            with span("transcribe"):
+                question = await cancel_on_disconnect(request, transcribe_audio(audio, f"audio.{audio_format}"))
+        except ClientDisconnected:
+            tracer.finish(trace, "cancelled", timings)
+            return {"error": "client disconnected"}
+        except Exception as e:
+            tracer.finish(trace, "error", timings)
+            return {"error": str(e)}
+    finally:
+        await file.close()
+    timings["transcribe_ms"] = (time.monotonic() - started) * 1000
 
-    return final_text
+    try:
+        return await answer_question(sessionId, question, is_audio=True, timings=timings, started_at=started)
+    except GenerationRejected as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": f"{e.retry_after:.0f}"})
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
@@ -0,0 +1,247 @@
+import asyncio
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Awaitable, Callable, List, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    session_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    is_audio INTEGER NOT NULL DEFAULT 0,
+    is_image INTEGER NOT NULL DEFAULT 0,
+    is_complete INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS messages_session_seq ON messages (session_id, seq);
+CREATE TABLE IF NOT EXISTS store_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+COLUMNS = "seq, id, session_id, role, content, timestamp, is_audio, is_image, is_complete"
+
+
+def new_row(session_id: str, role: str, content: str, is_audio: bool = False, is_image: bool = False,
+            timestamp: Optional[float] = None, message_id: Optional[str] = None, is_complete: bool = True) -> dict:
+    return {
+        "id": message_id or f"{session_id}_{uuid.uuid4()}",
+        "session_id": session_id,
+        "role": role,
+        "content": content,
+        "timestamp": timestamp if timestamp is not None else time.time(),
+        "is_audio": bool(is_audio),
+        "is_image": bool(is_image),
+        "is_complete": bool(is_complete),
+    }
+
+
+class SessionStore:
+    """
+    Append-only chat history in SQLite (WAL mode).
+
+    Rows get a monotonically increasing seq, and the (session_id, seq) index
+    serves ordered and paged reads for a session without sorting.
+    is_complete is 0 while an answer is still being streamed into its row.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(messages)")}
+        if "is_complete" not in columns:
+            # Stores created before the column was added.
+            conn.execute("ALTER TABLE messages ADD COLUMN is_complete INTEGER NOT NULL DEFAULT 1")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def append_many(self, rows: List[dict], skip_existing: bool = False) -> List[int]:
+        """
+        Write rows in one transaction and return their seq numbers.
+
+        A row whose id already exists updates that message's content in
+        place and keeps its seq, so a streamed answer stays one record.
+        """
+        if not rows:
+            return []
+        conn = self._conn()
+        seqs = []
+        on_conflict = ("DO NOTHING" if skip_existing
+                       else "DO UPDATE SET content = excluded.content, is_complete = excluded.is_complete")
+        with self._write_lock, conn:
+            for row in rows:
+                cursor = conn.execute(
+                    "INSERT INTO messages (id, session_id, role, content, timestamp, is_audio, is_image, is_complete) "
+                    f"VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(id) {on_conflict} RETURNING seq",
+                    (row["id"], row["session_id"], row["role"], row["content"], row["timestamp"],
+                     int(row["is_audio"]), int(row["is_image"]), int(row.get("is_complete", True))),
+                )
+                returned = cursor.fetchone()
+                seqs.append(returned[0] if returned else None)
+        return seqs
+
+    def read(self, session_id: str, after_seq: int = 0, limit: Optional[int] = None) -> List[dict]:
+        """Messages of a session with seq > after_seq, oldest first."""
+        query = f"SELECT {COLUMNS} FROM messages WHERE session_id = ? AND seq > ? ORDER BY seq"
+        params = [session_id, after_seq]
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        return [dict(row) for row in self._conn().execute(query, params)]
+
+    def seq_of(self, session_id: str, message_id: str) -> Optional[int]:
+        """The seq of a message of the session, or None if there is no such message."""
+        row = self._conn().execute(
+            "SELECT seq FROM messages WHERE id = ? AND session_id = ?", (message_id, session_id)
+        ).fetchone()
+        return row[0] if row else None
+
+    def read_tail(self, session_id: str, limit: int) -> List[dict]:
+        """The last `limit` messages of a session, oldest first."""
+        rows = self._conn().execute(
+            f"SELECT {COLUMNS} FROM messages WHERE session_id = ? ORDER BY seq DESC LIMIT ?",
+            (session_id, limit),
+        ).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def count(self, session_id: Optional[str] = None) -> int:
+        if session_id is None:
+            return self._conn().execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)
+        ).fetchone()[0]
+
+    def compact(self, older_than: float) -> int:
+        """
+        Delete empty assistant records left behind by the old
+        store-placeholder-then-store-again flow. Only rows older than
+        `older_than` are touched, so answers still streaming are kept.
+        """
+        conn = self._conn()
+        with self._write_lock, conn:
+            cursor = conn.execute(
+                "DELETE FROM messages WHERE role = 'assistant' AND content = '' AND timestamp < ?",
+                (older_than,),
+            )
+        return cursor.rowcount
+
+    def close_incomplete(self, older_than: float) -> int:
+        """
+        Mark answers older than `older_than` that are still incomplete as
+        complete, keeping their last checkpoint. They were abandoned by a
+        crash or a failed final write, so no final frame will ever come.
+        """
+        conn = self._conn()
+        with self._write_lock, conn:
+            cursor = conn.execute(
+                "UPDATE messages SET is_complete = 1 WHERE is_complete = 0 AND timestamp < ?",
+                (older_than,),
+            )
+        return cursor.rowcount
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self._conn().execute("SELECT value FROM store_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        conn = self._conn()
+        with self._write_lock, conn:
+            conn.execute(
+                "INSERT INTO store_meta (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value),
+            )
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class BatchedWriter:
+    """
+    Group commit for concurrent appends.
+
+    Rows submitted while a flush is running are written together in the
+    next transaction. Each caller still waits until its own row is committed.
+    """
+
+    def __init__(self, flush: Callable[[List[dict]], Awaitable[List[int]]], max_batch: int = 500):
+        self.flush = flush
+        self.max_batch = max_batch
+        self.pending = []
+        self.flushing = None
+
+    async def submit(self, row: dict) -> int:
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((row, future))
+        if self.flushing is None or self.flushing.done():
+            self.flushing = asyncio.create_task(self._drain())
+        return await future
+
+    async def _drain(self):
+        while self.pending:
+            batch = self.pending[:self.max_batch]
+            del self.pending[:self.max_batch]
+            try:
+                seqs = await self.flush([row for row, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), seq in zip(batch, seqs):
+                if not future.done():
+                    future.set_result(seq)
+
+
+def migrate_from_chroma(collection, store: SessionStore, page_size: int = 1000) -> int:
+    """
+    Copy the chat_sessions Chroma collection into the store, once.
+
+    Records are inserted in timestamp order so seq reflects the original
+    conversation order. Returns the number of migrated messages.
+    """
+    if store.get_meta("chroma_migrated"):
+        return 0
+    records = []
+    offset = 0
+    while True:
+        page = collection.get(limit=page_size, offset=offset, include=["documents", "metadatas"])
+        if not page["ids"]:
+            break
+        for record_id, doc, meta in zip(page["ids"], page["documents"], page["metadatas"]):
+            meta = meta or {}
+            records.append(new_row(
+                meta.get("session_id", ""),
+                meta.get("role", "assistant"),
+                doc or "",
+                is_audio=meta.get("is_audio", False),
+                is_image=meta.get("is_image", False),
+                timestamp=meta.get("timestamp", 0),
+                message_id=record_id,
+            ))
+        offset += len(page["ids"])
+    records.sort(key=lambda r: r["timestamp"])
+    for start in range(0, len(records), page_size):
+        store.append_many(records[start:start + page_size], skip_existing=True)
+    store.set_meta("chroma_migrated", str(time.time()))
+    return len(records)
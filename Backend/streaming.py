@@ -0,0 +1,193 @@
+import asyncio
+import time
+import uuid
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+STREAM_PROTOCOL_DELTA = "delta"
+STREAM_PROTOCOL_FULL = "full"
+
+
+class AnswerStreamer:
+    """
+    Turns a stream of LLM chunks into broadcast frames.
+
+    In "delta" mode each frame only carries the text generated since the
+    previous frame, tagged with a message id and a sequence number. In
+    "full" mode frames carry the whole answer so far, as older clients expect.
+    Chunks are coalesced until flush_interval seconds have passed or
+    flush_chars characters are buffered, so a fast model does not cost one
+    send per token.
+
+    If on_checkpoint is given it is called with the answer so far at most
+    every checkpoint_interval seconds, so a crash mid-stream keeps what was
+    generated without a write per token.
+
+    When a timings dict is given, first_token_ms and total_ms (measured from
+    started_at) are added to it and the dict is sent with the final frame.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[dict], Awaitable[None]],
+        protocol: str = STREAM_PROTOCOL_DELTA,
+        flush_interval: float = 0.05,
+        flush_chars: int = 64,
+        message_id: Optional[str] = None,
+        extra: Optional[dict] = None,
+        on_checkpoint: Optional[Callable[[str], Awaitable[None]]] = None,
+        checkpoint_interval: float = 0.0,
+        timings: Optional[dict] = None,
+        started_at: Optional[float] = None,
+    ):
+        if protocol not in (STREAM_PROTOCOL_DELTA, STREAM_PROTOCOL_FULL):
+            raise ValueError(f"Unknown stream protocol: {protocol}")
+        self.send = send
+        self.protocol = protocol
+        self.flush_interval = flush_interval
+        self.flush_chars = flush_chars
+        self.message_id = message_id or str(uuid.uuid4())
+        self.extra = extra or {}
+        self.seq = 0
+        self.parts = []
+        self.pending = []
+        self.pending_chars = 0
+        self.last_flush = None
+        self.on_checkpoint = on_checkpoint
+        self.checkpoint_interval = checkpoint_interval
+        self.last_checkpoint = time.monotonic()
+        self.checkpointing = None
+        self.timings = timings
+        self.started_at = started_at if started_at is not None else time.monotonic()
+        self.finished = False
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    def _frame(self, **fields) -> dict:
+        frame = {
+            "role": "assistant",
+            "message_id": self.message_id,
+            "seq": self.seq,
+            "is_audio": False,
+        }
+        frame.update(self.extra)
+        frame.update(fields)
+        self.seq += 1
+        return frame
+
+    def snapshot(self) -> dict:
+        """
+        The answer as far as it has been sent, as one full-text frame that
+        the stream's later frames continue from (replayed to a viewer that
+        joins mid-answer); once finished, the complete answer.
+        """
+        sent = self.parts[:len(self.parts) - len(self.pending)]
+        frame = {
+            "role": "assistant",
+            "message_id": self.message_id,
+            "seq": self.seq - 1,
+            "is_audio": False,
+        }
+        frame.update(self.extra)
+        frame.update(content="".join(sent), is_complete=self.finished)
+        return frame
+
+    async def push(self, chunk: str):
+        if not chunk:
+            return
+        self.parts.append(chunk)
+        self.pending.append(chunk)
+        self.pending_chars += len(chunk)
+
+        now = time.monotonic()
+        if self.timings is not None and "first_token_ms" not in self.timings:
+            self.timings["first_token_ms"] = (now - self.started_at) * 1000
+        # The first chunk goes out immediately so time-to-first-token is not
+        # delayed by the coalescing window.
+        if (
+            self.last_flush is None
+            or self.pending_chars >= self.flush_chars
+            or now - self.last_flush >= self.flush_interval
+        ):
+            await self.flush(now)
+
+        if (
+            self.on_checkpoint
+            and self.checkpoint_interval > 0
+            and now - self.last_checkpoint >= self.checkpoint_interval
+            and (self.checkpointing is None or self.checkpointing.done())
+        ):
+            # Written in the background so storage latency never delays the stream.
+            self.last_checkpoint = now
+            self.checkpointing = asyncio.create_task(self.on_checkpoint(self.text))
+
+    async def flush(self, now: Optional[float] = None):
+        if not self.pending:
+            return
+        delta = "".join(self.pending)
+        self.pending = []
+        self.pending_chars = 0
+        self.last_flush = now if now is not None else time.monotonic()
+
+        if self.protocol == STREAM_PROTOCOL_DELTA:
+            await self.send(self._frame(delta=delta, is_complete=False))
+        else:
+            await self.send(self._frame(content=self.text, is_complete=False))
+
+    async def finish(self, final_text: Optional[str] = None, cancelled: Optional[str] = None) -> str:
+        """
+        Send the closing frame with the full answer and return it. An answer
+        cut short says why in the frame's "cancelled" field.
+        """
+        if self.checkpointing is not None:
+            # The caller stores the final text next; a late checkpoint must
+            # not overwrite it.
+            await asyncio.gather(self.checkpointing, return_exceptions=True)
+            self.checkpointing = None
+        if final_text is None:
+            await self.flush()
+            final_text = self.text
+        else:
+            self.pending = []
+            self.pending_chars = 0
+            self.parts = [final_text]
+        self.finished = True
+        fields = {"cancelled": cancelled} if cancelled else {}
+        if self.timings is not None:
+            self.timings["total_ms"] = (time.monotonic() - self.started_at) * 1000
+            fields["timings"] = self.timings
+        await self.send(self._frame(content=final_text, is_complete=True, **fields))
+        return final_text
+
+
+async def stream_answer(
+    chunks: AsyncIterator[str],
+    streamer: AnswerStreamer,
+) -> str:
+    """
+    Pump chunks through a streamer and return the final answer text. If
+    this is cancelled, chunks is closed right away, so whatever produces
+    them (the model's stream) stops too, and the caller finishes the
+    streamer.
+    """
+    try:
+        async for chunk in chunks:
+            await streamer.push(chunk)
+    except Exception as e:
+        return await streamer.finish(f"ERROR: {str(e)}")
+    finally:
+        if hasattr(chunks, "aclose"):
+            await chunks.aclose()
+    return await streamer.finish()
+
+
+async def replay_chunks(text: str, mode: str = "stream", chunk_chars: int = 24, delay: float = 0.02):
+    """Yield a stored answer either at once or in small timed chunks like a live model."""
+    if mode == "instant":
+        yield text
+        return
+    for start in range(0, len(text), chunk_chars):
+        yield text[start:start + chunk_chars]
+        if delay:
+            await asyncio.sleep(delay)
@@ -0,0 +1,70 @@
+import io
+import wave
+
+import numpy as np
+
+from audio_upload import downsample_wav, sniff_audio_format
+
+
+def wav_bytes(samples: np.ndarray, rate: int, width: int = 2) -> bytes:
+    """A PCM WAV of float samples in [-1, 1], shaped (frames, channels)."""
+    samples = samples.reshape(len(samples), -1)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as out:
+        out.setnchannels(samples.shape[1])
+        out.setsampwidth(width)
+        out.setframerate(rate)
+        if width == 1:
+            out.writeframes((samples * 127 + 128).astype(np.uint8).tobytes())
+        else:
+            out.writeframes((samples * 32767).astype("<i2").tobytes())
+    return buffer.getvalue()
+
+
+def read_wav(audio: bytes):
+    with wave.open(io.BytesIO(audio)) as f:
+        frames = np.frombuffer(f.readframes(f.getnframes()), dtype="<i2").astype(np.float32) / 32767
+        return f.getnchannels(), f.getsampwidth(), f.getframerate(), frames
+
+
+def tone(rate: int, seconds: float, hz: float = 440.0) -> np.ndarray:
+    return 0.5 * np.sin(2 * np.pi * hz * np.arange(int(rate * seconds)) / rate)
+
+
+def test_stereo_48k_becomes_16k_mono_with_the_same_signal():
+    left = tone(48000, 1.0)
+    audio = wav_bytes(np.stack([left, left], axis=1), 48000)
+    channels, width, rate, samples = read_wav(downsample_wav(audio, 16000))
+    assert (channels, width, rate) == (1, 2, 16000)
+    # Each output sample is the average of three input samples.
+    np.testing.assert_allclose(samples, left.reshape(-1, 3).mean(axis=1), atol=0.001)
+
+
+def test_rates_that_do_not_divide_evenly_are_interpolated():
+    audio = wav_bytes(tone(44100, 0.5), 44100)
+    _, _, rate, samples = read_wav(downsample_wav(audio, 16000, block_seconds=0.1))
+    assert rate == 16000
+    assert abs(len(samples) - 8000) <= 1
+    np.testing.assert_allclose(samples, tone(16000, 0.5)[:len(samples)], atol=0.02)
+
+
+def test_8_bit_input_is_widened():
+    audio = wav_bytes(tone(32000, 0.25), 32000, width=1)
+    _, width, rate, samples = read_wav(downsample_wav(audio, 16000))
+    assert (width, rate) == (2, 16000)
+    np.testing.assert_allclose(samples, tone(16000, 0.25), atol=0.03)
+
+
+def test_small_or_unreadable_recordings_are_returned_as_they_are():
+    small = wav_bytes(tone(16000, 0.1), 16000)
+    assert downsample_wav(small, 16000) is small
+    not_wav = b"RIFF\x00\x00\x00\x00WAVEjunk"
+    assert downsample_wav(not_wav, 16000) is not_wav
+
+
+def test_formats_are_told_apart_by_their_first_bytes():
+    assert sniff_audio_format(wav_bytes(tone(8000, 0.01), 8000)[:12]) == "wav"
+    assert sniff_audio_format(b"\x1a\x45\xdf\xa3" + b"\0" * 8) == "webm"
+    assert sniff_audio_format(b"OggS" + b"\0" * 8) == "ogg"
+    assert sniff_audio_format(b"\0\0\0\x20ftypisom") == "mp4"
+    assert sniff_audio_format(b"hello world!") is None
@@ -0,0 +1,79 @@
+from context_builder import ContextBuilder
+
+
+def word_count(text):
+    return len(text.split())
+
+
+def results(*documents, distances=None, metadatas=None):
+    return {
+        "documents": [list(documents)],
+        "metadatas": [metadatas or [None] * len(documents)],
+        "distances": [distances or [0.1 * (i + 1) for i in range(len(documents))]],
+    }
+
+
+def builder(**kwargs):
+    options = dict(token_budget=0, dedup_threshold=1.0, rerank=False, distance_margin=0, min_results=1)
+    options.update(kwargs)
+    return ContextBuilder(word_count, **options)
+
+
+def test_chunks_are_added_in_rank_order_while_they_fit_the_budget():
+    # "Text: " counts as one word, so each chunk is 1 + its own words.
+    built = builder(token_budget=8).build("q", results("one two three", "four five six", "seven"))
+    assert built["context"] == "Text: one two three\n\nText: four five six"
+    assert built["context_tokens"] == 8
+    assert built["context_chunks"] == 2
+    assert built["retrieved_chunks"] == 3
+
+
+def test_a_chunk_over_budget_is_skipped_for_a_smaller_one_after_it():
+    context_builder = builder(token_budget=6)
+    built = context_builder.build("q", results("a b c", "d e f g h i", "j"))
+    assert built["context"] == "Text: a b c\n\nText: j"
+    assert built["context_tokens"] == 6
+    assert context_builder.stats()["over_budget_dropped"] == 1
+
+
+def test_no_budget_keeps_everything():
+    built = builder(token_budget=0).build("q", results(*["word " * 50] * 3))
+    assert built["context_chunks"] == 3
+
+
+def test_near_duplicates_are_dropped():
+    text = "the quick brown fox jumps over the lazy dog near the river bank"
+    context_builder = builder(dedup_threshold=0.8)
+    built = context_builder.build("q", results(text, text + " today", "something else entirely"))
+    assert built["context_chunks"] == 2
+    assert context_builder.stats()["duplicates_dropped"] == 1
+
+
+def test_results_far_from_the_best_match_are_cut():
+    context_builder = builder(distance_margin=0.25)
+    built = context_builder.build("q", results("near", "close", "far", distances=[0.4, 0.45, 0.9]))
+    assert built["context"] == "Text: near\n\nText: close"
+    assert context_builder.stats()["cut_by_distance"] == 1
+
+
+def test_rerank_favours_chunks_sharing_the_question_terms():
+    context_builder = builder(rerank=True, rerank_weight=0.9)
+    built = context_builder.build(
+        "how do you partition kafka topics",
+        results("spark caching basics", "kafka topics partition keys", distances=[0.30, 0.32]),
+    )
+    assert built["context"].startswith("Text: kafka topics partition keys")
+
+
+def test_qa_chunks_are_formatted_with_their_question():
+    built = builder().build("q", results("An answer", metadatas=[{"type": "qa", "question": "A question?"}]))
+    assert built["context"] == "Q: A question?\nA: An answer"
+
+
+def test_n_results_follows_how_many_passed_the_cut():
+    context_builder = builder(distance_margin=0.25, min_results=2, max_results=20)
+    assert context_builder.n_results() == 20
+    for _ in range(30):
+        context_builder.build("q", results("a", "b", "c", "d", distances=[0.1, 0.11, 0.5, 0.6]))
+    # Twice the two that pass, rounded up from a moving average.
+    assert 4 <= context_builder.n_results() <= 5
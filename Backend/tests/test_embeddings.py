@@ -0,0 +1,77 @@
+import asyncio
+import threading
+
+import pytest
+
+from embeddings import EmbeddingProvider
+from fakes import fake_embedding
+
+
+class BlockingEmbedder:
+    """Fake embedder whose calls wait until `release` is set."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        self.release.wait(5)
+        return [fake_embedding(text) for text in texts]
+
+
+def provider_with(embedder) -> EmbeddingProvider:
+    return EmbeddingProvider(embedder, "fake", batch_window=0.001)
+
+
+def test_waiter_cancelled_while_queued_is_skipped():
+    embedder = BlockingEmbedder()
+    provider = provider_with(embedder)
+
+    async def run():
+        busy = asyncio.ensure_future(provider.aembed(["first"]))
+        await asyncio.sleep(0.05)
+        # Queued behind the batch in flight, then given up on.
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(provider.aembed(["abandoned"]), 0.05)
+        embedder.release.set()
+        assert await asyncio.wait_for(busy, 5) == [fake_embedding("first")]
+        assert await asyncio.wait_for(provider.aembed(["second"]), 5) == [fake_embedding("second")]
+
+    asyncio.run(run())
+    assert provider.batcher.is_alive()
+    assert ["abandoned"] not in embedder.calls
+
+
+def test_waiter_cancelled_mid_batch_does_not_stop_the_batcher():
+    embedder = BlockingEmbedder()
+    provider = provider_with(embedder)
+
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(provider.aembed(["abandoned"]), 0.05)
+        embedder.release.set()
+        assert await asyncio.wait_for(provider.aembed(["second"]), 5) == [fake_embedding("second")]
+
+    asyncio.run(run())
+    assert provider.batcher.is_alive()
+
+
+def test_api_error_reaches_every_waiter_and_the_batcher_carries_on():
+    failures = []
+
+    def embed_batch(texts):
+        if not failures:
+            failures.append(texts)
+            raise RuntimeError("rate limited")
+        return [fake_embedding(text) for text in texts]
+
+    provider = provider_with(embed_batch)
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await provider.aembed(["first"])
+        assert await provider.aembed(["first"]) == [fake_embedding("first")]
+
+    asyncio.run(run())
+    assert provider.batcher.is_alive()
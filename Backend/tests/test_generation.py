@@ -0,0 +1,135 @@
+import asyncio
+
+import pytest
+
+from generation import GenerationCancelled, GenerationRejected, Generations
+
+
+async def answer(generations, session_id, log, hold=None):
+    """Take a slot and run one step, until `hold` is set; logs how it went."""
+    try:
+        async with generations.slot(session_id) as generation:
+            log.append(("started", session_id))
+            await generation.run((hold or asyncio.Event()).wait())
+            log.append(("done", session_id))
+    except GenerationCancelled as e:
+        log.append(("cancelled", session_id, e.reason))
+
+
+def test_a_newer_question_supersedes_the_answer_in_flight():
+    async def run():
+        generations = Generations()
+        log = []
+        first = asyncio.create_task(answer(generations, "s", log))
+        await asyncio.sleep(0.01)
+        hold = asyncio.Event()
+        second = asyncio.create_task(answer(generations, "s", log, hold))
+        await asyncio.sleep(0.01)
+        hold.set()
+        await asyncio.gather(first, second)
+        return generations, log
+
+    generations, log = asyncio.run(run())
+    assert ("cancelled", "s", "superseded") in log
+    assert log[-1] == ("done", "s")
+    assert generations.cancelled["superseded"] == 1
+    assert generations.active == 0 and not generations.sessions
+
+
+def test_waiting_questions_get_slots_in_arrival_order():
+    async def run():
+        generations = Generations(max_active=1)
+        log = []
+        holds = {session_id: asyncio.Event() for session_id in "abc"}
+        tasks = []
+        for session_id in "abc":
+            tasks.append(asyncio.create_task(answer(generations, session_id, log, holds[session_id])))
+            await asyncio.sleep(0.01)
+        assert generations.metrics()["queued"] == 2
+        for session_id in "abc":
+            holds[session_id].set()
+            await asyncio.sleep(0.01)
+        await asyncio.gather(*tasks)
+        return generations, log
+
+    generations, log = asyncio.run(run())
+    assert [entry[1] for entry in log if entry[0] == "started"] == ["a", "b", "c"]
+    assert generations.started == 3
+    assert generations.queued == 2
+    assert generations.active == 0
+
+
+def test_a_full_queue_rejects_straight_away():
+    async def run():
+        generations = Generations(max_active=1, max_queue=1)
+        log = []
+        hold = asyncio.Event()
+        tasks = [asyncio.create_task(answer(generations, session_id, log, hold)) for session_id in "ab"]
+        await asyncio.sleep(0.01)
+        with pytest.raises(GenerationRejected):
+            async with generations.slot("c"):
+                pass
+        hold.set()
+        await asyncio.gather(*tasks)
+        return generations
+
+    generations = asyncio.run(run())
+    assert generations.rejected == 1
+    assert "c" not in generations.sessions
+
+
+def test_a_wait_that_times_out_is_rejected():
+    async def run():
+        generations = Generations(max_active=1, queue_timeout=0.05)
+        hold = asyncio.Event()
+        task = asyncio.create_task(answer(generations, "a", [], hold))
+        await asyncio.sleep(0.01)
+        with pytest.raises(GenerationRejected):
+            async with generations.slot("b"):
+                pass
+        hold.set()
+        await task
+        return generations
+
+    generations = asyncio.run(run())
+    assert generations.queue_timeouts == 1
+    assert not generations.waiters
+
+
+def test_cancel_stops_the_answer_and_frees_its_slot():
+    async def run():
+        generations = Generations(max_active=1)
+        log = []
+        task = asyncio.create_task(answer(generations, "s", log))
+        await asyncio.sleep(0.01)
+        assert generations.cancel("s")
+        await task
+        assert not generations.cancel("s")
+        return generations, log
+
+    generations, log = asyncio.run(run())
+    assert log == [("started", "s"), ("cancelled", "s", "client")]
+    assert generations.cancelled["client"] == 1
+    assert generations.active == 0
+
+
+def test_cancelling_a_waiting_question_leaves_the_queue():
+    async def run():
+        generations = Generations(max_active=1)
+        log = []
+        hold = asyncio.Event()
+        first = asyncio.create_task(answer(generations, "a", log, hold))
+        await asyncio.sleep(0.01)
+        waiting = asyncio.create_task(answer(generations, "b", log))
+        await asyncio.sleep(0.01)
+        generations.cancel("b")
+        await waiting
+        hold.set()
+        await first
+        return generations, log
+
+    generations, log = asyncio.run(run())
+    assert ("cancelled", "b", "client") in log
+    assert ("started", "b") not in log
+    assert not generations.waiters
+    assert generations.active == 0
@@ -0,0 +1,97 @@
+import io
+import json
+
+import pytest
+
+from fakes import FakeCollection
+from ingest import Checkpoint, Ingester, chunk_records, hash_embedder, read_paragraphs, split_long, to_document
+
+
+def word_count(text):
+    return len(text.split())
+
+
+def paragraph(words, title=None):
+    return {"type": "text", "title": title, "text": " ".join(words)}
+
+
+def test_paragraphs_are_packed_with_overlap():
+    records = [paragraph([f"p{i}w{j}" for j in range(4)]) for i in range(5)]
+    chunks = list(chunk_records(iter(records), word_count, chunk_tokens=10, overlap_tokens=4))
+    assert [chunk["text"].count("\n\n") + 1 for chunk in chunks] == [2, 2, 2, 2]
+    # The last paragraph of a chunk starts the next one.
+    assert chunks[1]["text"].startswith(records[1]["text"])
+    assert all(word_count(chunk["text"]) <= 10 for chunk in chunks)
+
+
+def test_headings_and_qa_pairs_start_new_chunks():
+    text = "# Spark\nshuffles are costly\n\n## Kafka\npartitions order messages\n"
+    records = list(read_paragraphs(io.StringIO(text), markdown=True))
+    records.append({"type": "qa", "question": "Why?", "text": "Because."})
+    chunks = list(chunk_records(iter(records), word_count, chunk_tokens=100))
+    assert [(chunk["type"], chunk.get("title"), chunk["text"]) for chunk in chunks] == [
+        ("text", "Spark", "shuffles are costly"),
+        ("text", "Kafka", "partitions order messages"),
+        ("qa", None, "Because."),
+    ]
+
+
+def test_long_text_is_split_at_sentences():
+    text = "One two three. Four five six. Seven eight nine."
+    assert split_long(text, word_count, 6) == ["One two three. Four five six.", "Seven eight nine."]
+    assert split_long("a b c d e", word_count, 2) == ["a b", "c d", "e"]
+
+
+def test_chunk_ids_are_content_hashes():
+    chunk = {"type": "qa", "question": "Q?", "text": "A."}
+    assert to_document(chunk, "a.jsonl")["id"] == to_document(dict(chunk), "b.jsonl")["id"]
+    assert to_document(chunk, "a.jsonl")["id"] != to_document({**chunk, "text": "B."}, "a.jsonl")["id"]
+
+
+def write_bank(path, count):
+    with open(path, "w") as f:
+        for i in range(count):
+            f.write(json.dumps({"question": f"Question {i}?", "answer": f"Answer number {i}."}) + "\n")
+
+
+def ingester(collection, checkpoint, embed_batch=None):
+    return Ingester(collection, embed_batch or hash_embedder(), word_count, batch_size=4, concurrency=1,
+                    checkpoint=checkpoint, out=io.StringIO())
+
+
+def test_an_interrupted_run_resumes_from_its_checkpoint(tmp_path):
+    bank = str(tmp_path / "bank.jsonl")
+    write_bank(bank, 10)
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    collection = FakeCollection("knowledge")
+    embed = hash_embedder()
+    calls = []
+
+    def failing(texts):
+        calls.append(texts)
+        if len(calls) == 2:
+            raise RuntimeError("connection reset")
+        return embed(texts)
+
+    with pytest.raises(RuntimeError):
+        ingester(collection, Checkpoint(checkpoint_path), failing).run([bank])
+    # Only the first batch was committed to the checkpoint; later ones may
+    # have reached the collection anyway.
+    assert Checkpoint(checkpoint_path).progress(bank)["chunks_done"] == 4
+
+    stats = ingester(collection, Checkpoint(checkpoint_path)).run([bank])
+    assert stats["resumed"] == 4
+    assert stats["embedded"] + stats["unchanged"] == 6
+    assert len(collection.records) == 10
+
+    again = ingester(collection, Checkpoint(checkpoint_path)).run([bank])
+    assert again["files_skipped"] == 1 and again["embedded"] == 0
+
+
+def test_chunks_already_stored_are_not_embedded_again(tmp_path):
+    bank = str(tmp_path / "bank.jsonl")
+    write_bank(bank, 6)
+    collection = FakeCollection("knowledge")
+    ingester(collection, Checkpoint(None)).run([bank])
+    stats = ingester(collection, Checkpoint(None)).run([bank])
+    assert stats["unchanged"] == 6 and stats["embedded"] == 0
@@ -0,0 +1,81 @@
+import sqlite3
+
+from session_store import SessionStore, new_row
+
+
+def store(tmp_path):
+    return SessionStore(str(tmp_path / "sessions.db"))
+
+
+def test_close_incomplete_finishes_only_old_abandoned_answers(tmp_path):
+    sessions = store(tmp_path)
+    sessions.append_many([
+        new_row("s", "assistant", "checkpoint", timestamp=100.0, message_id="old", is_complete=False),
+        new_row("s", "assistant", "still streaming", timestamp=200.0, message_id="new", is_complete=False),
+        new_row("s", "assistant", "done", timestamp=100.0, message_id="done"),
+    ])
+    assert sessions.close_incomplete(older_than=150.0) == 1
+    rows = {row["id"]: row for row in sessions.read("s")}
+    assert rows["old"]["is_complete"] == 1
+    assert rows["old"]["content"] == "checkpoint"
+    assert rows["new"]["is_complete"] == 0
+    assert sessions.close_incomplete(older_than=150.0) == 0
+
+
+def test_writing_an_existing_id_updates_the_message_in_place(tmp_path):
+    sessions = store(tmp_path)
+    [question, placeholder] = sessions.append_many([
+        new_row("s", "user", "q", message_id="q"),
+        new_row("s", "assistant", "", message_id="a", is_complete=False),
+    ])
+    assert sessions.append_many([new_row("s", "assistant", "partial", message_id="a", is_complete=False)]) == [placeholder]
+    assert sessions.append_many([new_row("s", "assistant", "final", message_id="a")]) == [placeholder]
+    rows = sessions.read("s")
+    assert [(row["seq"], row["content"], row["is_complete"]) for row in rows] == [
+        (question, "q", 1), (placeholder, "final", 1),
+    ]
+    assert sessions.seq_of("s", "a") == placeholder
+    assert sessions.seq_of("other", "a") is None
+
+
+def test_skip_existing_keeps_the_stored_message(tmp_path):
+    sessions = store(tmp_path)
+    sessions.append_many([new_row("s", "user", "first", message_id="m")])
+    assert sessions.append_many([new_row("s", "user", "second", message_id="m")], skip_existing=True) == [None]
+    assert sessions.read("s")[0]["content"] == "first"
+
+
+def test_read_pages_after_a_seq(tmp_path):
+    sessions = store(tmp_path)
+    seqs = sessions.append_many([new_row("s", "user", str(i)) for i in range(5)])
+    sessions.append_many([new_row("other", "user", "x")])
+    assert [row["content"] for row in sessions.read("s", after_seq=seqs[1], limit=2)] == ["2", "3"]
+    assert [row["content"] for row in sessions.read_tail("s", 2)] == ["3", "4"]
+    assert sessions.count("s") == 5 and sessions.count() == 6
+
+
+def test_compact_deletes_only_old_empty_answers(tmp_path):
+    sessions = store(tmp_path)
+    sessions.append_many([
+        new_row("s", "assistant", "", timestamp=100.0, message_id="old-empty"),
+        new_row("s", "assistant", "", timestamp=200.0, message_id="new-empty", is_complete=False),
+        new_row("s", "assistant", "kept", timestamp=100.0, message_id="answer"),
+        new_row("s", "user", "", timestamp=100.0, message_id="question"),
+    ])
+    assert sessions.compact(older_than=150.0) == 1
+    assert [row["id"] for row in sessions.read("s")] == ["new-empty", "answer", "question"]
+
+
+def test_stores_from_before_is_complete_are_migrated(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE messages (seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT NOT NULL UNIQUE, "
+        "session_id TEXT NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL, timestamp REAL NOT NULL, "
+        "is_audio INTEGER NOT NULL DEFAULT 0, is_image INTEGER NOT NULL DEFAULT 0)"
+    )
+    conn.execute("INSERT INTO messages (id, session_id, role, content, timestamp) VALUES ('m', 's', 'user', 'q', 1)")
+    conn.commit()
+    conn.close()
+    sessions = SessionStore(path)
+    assert sessions.read("s")[0]["is_complete"] == 1
@@ -0,0 +1,114 @@
+import asyncio
+
+from streaming import STREAM_PROTOCOL_FULL, AnswerStreamer, stream_answer
+
+
+class Recorder:
+    def __init__(self):
+        self.frames = []
+
+    async def __call__(self, frame):
+        self.frames.append(frame)
+
+
+def streamer_for(send, **kwargs):
+    # Only the first chunk and whole batches of 5 characters go out at once.
+    return AnswerStreamer(send, flush_interval=60, flush_chars=5, message_id="m", **kwargs)
+
+
+def test_deltas_are_numbered_and_end_with_the_complete_text():
+    async def run():
+        send = Recorder()
+        streamer = streamer_for(send)
+        for chunk in ["Hel", "lo", " wor", "ld", "!"]:
+            await streamer.push(chunk)
+        await streamer.finish()
+        return send.frames
+
+    frames = asyncio.run(run())
+    assert [frame["seq"] for frame in frames] == list(range(len(frames)))
+    assert "".join(frame["delta"] for frame in frames[:-1]) == "Hello world!"
+    assert frames[-1]["content"] == "Hello world!"
+    assert frames[-1]["is_complete"] and not any(frame["is_complete"] for frame in frames[:-1])
+
+
+def test_snapshot_plus_later_deltas_rebuild_the_answer():
+    async def run():
+        send = Recorder()
+        streamer = streamer_for(send)
+        await streamer.push("Hel")
+        await streamer.push("lo")
+        await streamer.push(" w")
+        # "lo w" is still buffered: the snapshot only has what was sent.
+        snapshot = streamer.snapshot()
+        sent = len(send.frames)
+        await streamer.push("orld")
+        await streamer.finish()
+        return snapshot, send.frames[sent:], streamer.snapshot()
+
+    snapshot, later, final = asyncio.run(run())
+    assert snapshot["content"] == "Hel"
+    assert not snapshot["is_complete"]
+    text = snapshot["content"]
+    for frame in later:
+        if "delta" in frame and frame["seq"] > snapshot["seq"]:
+            text += frame["delta"]
+    assert text == "Hello world"
+    assert later[-1]["content"] == text
+    assert final["is_complete"] and final["content"] == "Hello world"
+
+
+def test_snapshot_before_anything_was_sent_continues_from_the_first_frame():
+    async def run():
+        send = Recorder()
+        streamer = streamer_for(send)
+        snapshot = streamer.snapshot()
+        await streamer.push("Hi")
+        return snapshot, send.frames
+
+    snapshot, frames = asyncio.run(run())
+    assert snapshot["content"] == "" and snapshot["seq"] == -1
+    assert frames[0]["seq"] > snapshot["seq"]
+
+
+def test_full_protocol_frames_carry_the_text_so_far():
+    async def run():
+        send = Recorder()
+        streamer = streamer_for(send, protocol=STREAM_PROTOCOL_FULL)
+        await streamer.push("Hel")
+        await streamer.push("lo there")
+        await streamer.finish()
+        return send.frames
+
+    frames = asyncio.run(run())
+    assert [frame["content"] for frame in frames] == ["Hel", "Hello there", "Hello there"]
+    assert "delta" not in frames[0]
+
+
+def test_a_failing_model_stream_ends_with_its_error():
+    async def chunks():
+        yield "Hel"
+        raise RuntimeError("rate limited")
+
+    async def run():
+        send = Recorder()
+        text = await stream_answer(chunks(), streamer_for(send))
+        return text, send.frames
+
+    text, frames = asyncio.run(run())
+    assert text == "ERROR: rate limited"
+    assert frames[-1]["content"] == text and frames[-1]["is_complete"]
+
+
+def test_cancelled_answer_says_why_in_its_last_frame():
+    async def run():
+        send = Recorder()
+        streamer = streamer_for(send)
+        await streamer.push("Hel")
+        await streamer.push("l")
+        text = await streamer.finish(cancelled="superseded")
+        return text, send.frames[-1]
+
+    text, frame = asyncio.run(run())
+    assert text == "Hell"
+    assert frame["cancelled"] == "superseded" and frame["content"] == "Hell"
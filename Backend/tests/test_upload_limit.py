@@ -0,0 +1,70 @@
+import asyncio
+
+from fastapi import FastAPI, File, UploadFile
+from fastapi.testclient import TestClient
+
+from upload_limit import UploadLimit
+
+
+def client(limit=1000):
+    app = FastAPI()
+    app.state.calls = 0
+
+    @app.post("/upload")
+    async def upload(file: UploadFile = File(...)):
+        app.state.calls += 1
+        return {"size": len(await file.read())}
+
+    @app.post("/other")
+    async def other(file: UploadFile = File(...)):
+        return {"size": len(await file.read())}
+
+    app.add_middleware(UploadLimit, limits={"/upload": limit})
+    return app, TestClient(app)
+
+
+def test_an_upload_within_the_limit_goes_through():
+    app, test_client = client()
+    response = test_client.post("/upload", files={"file": ("a.bin", b"x" * 500)})
+    assert response.status_code == 200 and response.json() == {"size": 500}
+
+
+def test_a_declared_length_over_the_limit_is_refused_unread():
+    app, test_client = client()
+    response = test_client.post("/upload", files={"file": ("a.bin", b"x" * 5000)})
+    assert response.status_code == 413
+    assert "1000 bytes" in response.json()["detail"]
+    assert app.state.calls == 0
+
+
+def test_a_body_without_a_length_is_cut_off_at_the_limit():
+    app, _ = client()
+    header = (b'--b\r\nContent-Disposition: form-data; name="file"; filename="a.bin"\r\n'
+              b"Content-Type: application/octet-stream\r\n\r\n")
+    received = []
+    sent = []
+
+    async def receive():
+        received.append(1)
+        body = header if len(received) == 1 else b"x" * 100
+        return {"type": "http.request", "body": body, "more_body": len(received) < 50}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http", "method": "POST", "path": "/upload", "query_string": b"", "root_path": "",
+        "headers": [(b"content-type", b"multipart/form-data; boundary=b")],
+    }
+    asyncio.run(app(scope, receive, send))
+    assert sent[0]["status"] == 413
+    assert len(sent) == 2
+    # The header and nine chunks, and no more once past 1000 bytes.
+    assert len(received) == 10
+    assert app.state.calls == 0
+
+
+def test_other_paths_are_not_limited():
+    app, test_client = client()
+    response = test_client.post("/other", files={"file": ("a.bin", b"x" * 5000)})
+    assert response.status_code == 200
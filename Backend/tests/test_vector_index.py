@@ -0,0 +1,93 @@
+import pytest
+
+from fakes import FakeCollection
+from vector_index import IndexInUse, LocalVectorIndex
+
+
+def collection_of(count, name="knowledge"):
+    collection = FakeCollection(name)
+    collection.upsert(ids=[f"d{i}" for i in range(count)], documents=[f"document {i}" for i in range(count)],
+                      metadatas=[{"n": i} for i in range(count)])
+    return collection
+
+
+def open_index(source, tmp_path, **kwargs):
+    # FakeCollection.query ranks by 1 - dot product.
+    return LocalVectorIndex(source, str(tmp_path / "index"), space="ip", refresh_interval=0, **kwargs)
+
+
+def top_ids(index, collection, text, n=3):
+    embedding = collection._embed([text])[0]
+    return index.query([embedding], n_results=n)["ids"][0], collection.query(query_embeddings=[embedding], n_results=n)["ids"][0]
+
+
+def test_refresh_copies_the_collection_and_answers_like_it(tmp_path):
+    collection = collection_of(50)
+    index = open_index(collection, tmp_path, page_size=7)
+    assert not index.ready
+    assert index.refresh()["added"] == 50
+    assert index.ready and index.count() == 50
+    local, remote = top_ids(index, collection, "document 7")
+    assert local == remote
+    result = index.query([collection._embed(["document 7"])[0]], n_results=1)
+    assert result["ids"] == [["d7"]]
+    assert result["documents"] == [["document 7"]]
+    assert result["metadatas"] == [[{"n": 7}]]
+
+
+def test_refresh_adds_new_ids_and_drops_deleted_ones(tmp_path):
+    collection = collection_of(20)
+    index = open_index(collection, tmp_path)
+    index.refresh()
+    collection.delete(ids=["d3"])
+    collection.upsert(ids=["new"], documents=["a new document"])
+    changed = index.refresh()
+    assert (changed["added"], changed["removed"]) == (1, 1)
+    assert index.count() == 20
+    local, remote = top_ids(index, collection, "document 3", n=20)
+    assert "d3" not in local
+    assert local == remote
+    assert index.refresh()["added"] == 0
+
+
+def test_many_deletions_compact_the_files(tmp_path):
+    collection = collection_of(40)
+    index = open_index(collection, tmp_path)
+    index.refresh()
+    collection.delete(ids=[f"d{i}" for i in range(15)])
+    index.refresh()
+    stats = index.stats()
+    assert stats["compactions"] == 1
+    assert stats["rows"] == 25 and stats["dead_rows"] == 0
+    local, remote = top_ids(index, collection, "document 20", n=5)
+    assert local == remote
+
+
+def test_an_index_on_disk_opens_without_the_collection(tmp_path):
+    collection = collection_of(10)
+    index = open_index(collection, tmp_path)
+    index.refresh()
+    index.lock_file.close()
+
+    def unreachable():
+        raise AssertionError("the collection is not needed to open the index")
+
+    reopened = open_index(unreachable, tmp_path)
+    assert reopened.ready and reopened.count() == 10
+    assert reopened.query([collection._embed(["document 4"])[0]], n_results=1)["ids"] == [["d4"]]
+
+
+def test_quantized_index_finds_the_same_best_match(tmp_path):
+    collection = collection_of(30)
+    index = open_index(collection, tmp_path, quantize=True)
+    index.refresh()
+    for i in (0, 11, 29):
+        assert index.query([collection._embed([f"document {i}"])[0]], n_results=1)["ids"] == [[f"d{i}"]]
+    assert index.stats()["vector_bytes"] == 30 * 64
+
+
+def test_a_second_opener_is_refused(tmp_path):
+    index = open_index(collection_of(1), tmp_path)
+    with pytest.raises(IndexInUse):
+        open_index(collection_of(1), tmp_path)
+    index.lock_file.close()
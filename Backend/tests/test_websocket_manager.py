@@ -0,0 +1,124 @@
+import asyncio
+
+from websocket_manager import Connection, ConnectionManager
+
+
+class FakeWebSocket:
+    """Records what is sent; sends wait on `gate` and raise `fail` when set."""
+
+    def __init__(self):
+        self.sent = []
+        self.gate = asyncio.Event()
+        self.gate.set()
+        self.fail = None
+        self.closed_with = None
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, message):
+        await self.gate.wait()
+        if self.fail is not None:
+            raise self.fail
+        self.sent.append(message)
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+
+def delta(seq, text, message_id="m1"):
+    return {"role": "assistant", "message_id": message_id, "seq": seq, "delta": text, "is_complete": False}
+
+
+def full(seq, text, message_id="m1"):
+    return {"role": "assistant", "message_id": message_id, "seq": seq, "content": text, "is_complete": False}
+
+
+def connection(max_queue=4):
+    return Connection(FakeWebSocket(), "s", max_queue=max_queue, send_timeout=1.0)
+
+
+def test_deltas_of_one_message_coalesce_into_the_unsent_tail():
+    conn = connection()
+    first = delta(0, "Hel")
+    assert conn.enqueue(first)
+    assert conn.enqueue(delta(1, "lo"))
+    assert list(conn.queue) == [delta(1, "Hello")]
+    assert conn.coalesced == 1
+    # The queued frame may be shared with other connections.
+    assert first["delta"] == "Hel"
+
+
+def test_frames_of_another_message_or_complete_frames_do_not_coalesce():
+    conn = connection()
+    conn.enqueue(delta(0, "a"))
+    conn.enqueue(delta(0, "b", message_id="m2"))
+    conn.enqueue({"role": "user", "content": "q", "is_complete": True})
+    conn.enqueue(delta(1, "c", message_id="m2"))
+    assert len(conn.queue) == 4
+    assert conn.coalesced == 0
+
+
+def test_full_text_frame_supersedes_the_queued_one():
+    conn = connection()
+    conn.enqueue(full(0, "Hel"))
+    conn.enqueue(full(1, "Hello"))
+    assert list(conn.queue) == [full(1, "Hello")]
+
+
+def test_full_queue_drops_intermediate_full_text_frames_but_refuses_others():
+    conn = connection(max_queue=2)
+    conn.enqueue({"role": "user", "content": "q1", "is_complete": True})
+    conn.enqueue({"role": "user", "content": "q2", "is_complete": True})
+    assert conn.enqueue(full(0, "partial", message_id="m3"))
+    assert conn.dropped == 1
+    assert not conn.enqueue(delta(0, "x", message_id="m4"))
+    assert not conn.enqueue({"role": "user", "content": "q3", "is_complete": True})
+    # Replay and personal frames are not bounded.
+    assert conn.enqueue({"role": "user", "content": "q4", "is_complete": True}, bounded=False)
+    assert len(conn.queue) == 3
+
+
+def test_frames_held_during_replay_follow_it_in_order():
+    conn = connection(max_queue=2)
+    conn.hold()
+    assert conn.deliver(delta(0, "live"))
+    conn.enqueue({"type": "history", "messages": [], "done": True}, bounded=False)
+    assert list(conn.queue) == [{"type": "history", "messages": [], "done": True}]
+    conn.release()
+    assert list(conn.queue)[1] == delta(0, "live")
+    assert conn.held is None
+
+
+def test_slow_client_is_evicted_and_closed():
+    async def run():
+        manager = ConnectionManager(max_queue=2, send_timeout=5.0)
+        fast, slow = FakeWebSocket(), FakeWebSocket()
+        slow.gate.clear()
+        await manager.connect(fast, "s")
+        await manager.connect(slow, "s")
+        for i in range(4):
+            await manager.broadcast("s", {"role": "user", "content": f"q{i}", "is_complete": True})
+            await asyncio.sleep(0.005)
+        return manager, fast, slow
+
+    manager, fast, slow = asyncio.run(run())
+    assert [m["content"] for m in fast.sent] == ["q0", "q1", "q2", "q3"]
+    assert manager.evicted == 1
+    assert slow.closed_with == 1013
+    assert [c.websocket for c in manager.active_connections["s"]] == [fast]
+
+
+def test_failed_send_drops_and_closes_the_socket():
+    async def run():
+        manager = ConnectionManager()
+        websocket = FakeWebSocket()
+        websocket.fail = RuntimeError("connection reset")
+        await manager.connect(websocket, "s")
+        await manager.broadcast("s", {"role": "user", "content": "q", "is_complete": True})
+        await asyncio.sleep(0.01)
+        return manager, websocket
+
+    manager, websocket = asyncio.run(run())
+    assert "s" not in manager.active_connections
+    assert websocket.closed_with == 1013
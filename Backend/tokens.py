@@ -0,0 +1,18 @@
+from typing import Callable
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+def token_counter(model: str = "gpt-4o-mini") -> Callable[[str], int]:
+    """tiktoken's count for the model when it is installed, else about 4 characters a token."""
+    if tiktoken is not None:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+            return lambda text: len(encoding.encode(text, disallowed_special=()))
+        except Exception:
+            # Unknown model, or the BPE file could not be downloaded.
+            pass
+    return lambda text: (len(text) + 3) // 4
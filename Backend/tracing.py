@@ -0,0 +1,275 @@
+import bisect
+import json
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Upper bounds, in seconds, of the latency histograms.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+RATE_BUCKETS = (5, 10, 20, 40, 60, 80, 120, 160, 240, 320)
+
+_current: ContextVar[Optional["Trace"]] = ContextVar("trace", default=None)
+
+
+class Trace:
+    """
+    The stages of one question, each with its start and duration in ms from
+    when the question arrived. A stage run several times (broadcasting each
+    frame, say) is one span with a count.
+
+    The trace being built is held in a context variable, so code deep in the
+    call (embedding, the Chroma query) adds its spans with `span(...)`
+    without the trace being passed down. Outside a trace that is a no-op.
+    """
+
+    __slots__ = ("request_id", "kind", "session_id", "started", "wall", "spans", "attrs")
+
+    def __init__(self, kind: str, session_id: Optional[str] = None, started: Optional[float] = None):
+        self.request_id = uuid.uuid4().hex[:16]
+        self.kind = kind
+        self.session_id = session_id
+        self.started = started if started is not None else time.monotonic()
+        self.wall = time.time() - (time.monotonic() - self.started)
+        # name -> [start ms, duration ms, count]
+        self.spans: Dict[str, list] = {}
+        self.attrs = {}
+
+    def add(self, name: str, duration_ms: float, start_ms: Optional[float] = None):
+        if start_ms is None:
+            start_ms = (time.monotonic() - self.started) * 1000 - duration_ms
+        span = self.spans.get(name)
+        if span is None:
+            self.spans[name] = [start_ms, duration_ms, 1]
+        else:
+            span[1] += duration_ms
+            span[2] += 1
+
+    @contextmanager
+    def span(self, name: str):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            ended = time.monotonic()
+            self.add(name, (ended - started) * 1000, (started - self.started) * 1000)
+
+    def elapsed_ms(self) -> float:
+        return (time.monotonic() - self.started) * 1000
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str):
+    """Time a stage of the current trace, if there is one."""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    with trace.span(name):
+        yield
+
+
+def window_stats(values: List[float]) -> dict:
+    """Average, median, p95 and maximum of a window of recent values."""
+    if not values:
+        return {"avg": 0.0, "p50": 0, "p95": 0, "max": 0}
+    ordered = sorted(values)
+    return {
+        "avg": sum(ordered) / len(ordered),
+        "p50": ordered[len(ordered) // 2],
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "max": ordered[-1],
+    }
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metric:
+    """A Prometheus counter or histogram family, one series per label set."""
+
+    def __init__(self, name: str, help: str, kind: str, labels: Tuple[str, ...], buckets=None):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labels = labels
+        self.buckets = buckets
+        self.series: Dict[tuple, object] = {}
+
+    def observe(self, value: float, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = Histogram(self.buckets)
+        series.observe(value)
+
+    def inc(self, *labels, amount: float = 1):
+        self.series[labels] = self.series.get(labels, 0) + amount
+
+    def _labels(self, values, extra: str = "") -> str:
+        pairs = [f'{name}="{value}"' for name, value in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, series in self.series.items():
+            if self.kind == "counter":
+                lines.append(f"{self.name}{self._labels(values)} {series}")
+                continue
+            cumulative = 0
+            for bound, count in zip(self.buckets, series.counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{self._labels(values, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{self._labels(values, le)} {series.count}")
+            lines.append(f"{self.name}_sum{self._labels(values)} {series.sum}")
+            lines.append(f"{self.name}_count{self._labels(values)} {series.count}")
+        return lines
+
+
+class Tracer:
+    """
+    Starts and finishes traces, keeps their Prometheus metrics, and writes
+    each finished trace as one JSON line to `log_path` when it is set. The
+    file is written by a background thread, so the event loop only pays for
+    a queue put.
+    """
+
+    def __init__(self, log_path: Optional[str] = None):
+        self.requests = Metric("assistant_requests_total", "Questions answered, by kind and outcome.",
+                               "counter", ("kind", "outcome"))
+        self.stages = Metric("assistant_stage_seconds", "Time spent in each stage of a question.",
+                             "histogram", ("stage",), LATENCY_BUCKETS)
+        self.first_token = Metric("assistant_time_to_first_token_seconds",
+                                  "From the question arriving to the first answer text being broadcast.",
+                                  "histogram", ("kind", "cached"), LATENCY_BUCKETS)
+        self.total = Metric("assistant_request_seconds", "From the question arriving to the final frame.",
+                            "histogram", ("kind",), LATENCY_BUCKETS)
+        self.token_rate = Metric("assistant_tokens_per_second", "Streaming rate of the model after its first token.",
+                                 "histogram", ("kind",), RATE_BUCKETS)
+        self.render = Metric("assistant_render_seconds",
+                             "Reported by the frontend: from a frame arriving to it being painted.",
+                             "histogram", ("frame",), LATENCY_BUCKETS)
+        self.ws_send = Metric("assistant_ws_send_seconds", "Time to write one frame to a WebSocket.",
+                              "histogram", (), LATENCY_BUCKETS)
+        self.metrics = [self.requests, self.stages, self.first_token, self.total, self.token_rate, self.render,
+                        self.ws_send]
+        self.gauges: List[tuple] = []
+
+        self.log_path = log_path
+        self.log_queue = None
+        if log_path:
+            self.log_queue = queue.SimpleQueue()
+            threading.Thread(target=self._write_log, name="trace-log", daemon=True).start()
+
+    def gauge(self, name: str, help: str, read: Callable, kind: str = "gauge", label: Optional[str] = None):
+        """
+        A value read when /metrics is scraped, kept elsewhere; with `label`,
+        `read` returns {label value: value}.
+        """
+        self.gauges.append((name, help, read, kind, label))
+
+    def start(self, kind: str, session_id: Optional[str] = None, started: Optional[float] = None) -> Trace:
+        """A new trace, current for the rest of the calling task."""
+        trace = Trace(kind, session_id, started)
+        _current.set(trace)
+        return trace
+
+    def finish(self, trace: Trace, outcome: str = "ok", timings: Optional[dict] = None) -> dict:
+        """
+        Record a finished trace: metrics, and a line in the trace log.
+        Tokens/s is measured over the "llm_stream" span, from the model's
+        first token to its last, for the "tokens" counted in trace.attrs.
+        """
+        total_ms = trace.elapsed_ms()
+        timings = timings or {}
+        cached = bool(timings.get("cache_hit"))
+        self.requests.inc(trace.kind, outcome)
+        self.total.observe(total_ms / 1000, trace.kind)
+        for name, (_, duration, _) in trace.spans.items():
+            self.stages.observe(duration / 1000, name)
+        first_token_ms = timings.get("first_token_ms")
+        if first_token_ms is not None:
+            self.first_token.observe(first_token_ms / 1000, trace.kind, "true" if cached else "false")
+        tokens = trace.attrs.get("tokens", 0)
+        stream = trace.spans.get("llm_stream")
+        tokens_per_s = None
+        if tokens > 1 and stream is not None and stream[1] > 0:
+            tokens_per_s = (tokens - 1) / (stream[1] / 1000)
+            self.token_rate.observe(tokens_per_s, trace.kind)
+        record = {
+            "request_id": trace.request_id,
+            "kind": trace.kind,
+            "session_id": trace.session_id,
+            "time": trace.wall,
+            "outcome": outcome,
+            "total_ms": total_ms,
+            "first_token_ms": first_token_ms,
+            "tokens_per_s": tokens_per_s,
+            "spans": [
+                {"name": name, "start_ms": start, "ms": duration, "count": count}
+                for name, (start, duration, count) in trace.spans.items()
+            ],
+            "attrs": {**trace.attrs, **timings},
+        }
+        if self.log_queue is not None:
+            self.log_queue.put(record)
+        if _current.get() is trace:
+            _current.set(None)
+        return record
+
+    def report_render(self, request_id: str, frame: str, render_ms: float):
+        """A frontend's report of how long a frame took to paint."""
+        if frame not in ("first", "final"):
+            return
+        self.render.observe(render_ms / 1000, frame)
+        if self.log_queue is not None:
+            self.log_queue.put({"request_id": request_id, "render": frame, "render_ms": render_ms, "time": time.time()})
+
+    def observe_send(self, seconds: float):
+        self.ws_send.observe(seconds)
+
+    def _write_log(self):
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            while True:
+                records = [self.log_queue.get()]
+                try:
+                    while len(records) < 1000:
+                        records.append(self.log_queue.get_nowait())
+                except queue.Empty:
+                    pass
+                f.write("".join(json.dumps(record, default=str) + "\n" for record in records))
+                f.flush()
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for name, help, read, kind, label in self.gauges:
+            lines.extend((f"# HELP {name} {help}", f"# TYPE {name} {kind}"))
+            if label is None:
+                lines.append(f"{name} {read()}")
+            else:
+                lines.extend(f'{name}{{{label}="{key}"}} {value}' for key, value in read().items())
+        return "\n".join(lines) + "\n"
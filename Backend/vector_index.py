@@ -0,0 +1,472 @@
+import fcntl
+import glob
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from typing import List, Optional
+
+import numpy as np
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+ROWS_TABLE = """
+CREATE TABLE IF NOT EXISTS {table} (
+    row INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    document TEXT,
+    metadata TEXT,
+    norm REAL NOT NULL,
+    scale REAL NOT NULL
+)
+"""
+
+QUANTIZED_BLOCK_ROWS = 128
+
+# What queries read; published whole so a refresh never changes it under them.
+Snapshot = namedtuple("Snapshot", "table vectors rows norms scales live live_count")
+
+
+def _as_list(values) -> list:
+    return [] if values is None else list(values)
+
+
+def collection_space(collection) -> str:
+    """The collection's distance function: configuration (Chroma 1.x) or hnsw:space metadata."""
+    configuration = getattr(collection, "configuration", None) or {}
+    metadata = getattr(collection, "metadata", None) or {}
+    return (configuration.get("hnsw") or {}).get("space") or metadata.get("hnsw:space", "l2")
+
+
+class IndexInUse(Exception):
+    """The index files are open in another process."""
+
+
+class LocalVectorIndex:
+    """
+    In-process copy of a Chroma collection's embeddings, searched with NumPy.
+
+    Vectors live in a memory-mapped file, as float32 or, with `quantize`,
+    as int8 with a per-row scale (a quarter of the size, approximate
+    distances). A query is a blockwise matrix product over the file and a
+    partial sort; ids, documents and metadata are kept next to it in SQLite
+    and only read for the top results. `query` answers like Chroma's
+    `collection.query`, with distances in the collection's space (l2,
+    cosine or ip).
+
+    `refresh` pulls what changed in the source collection: ids it has not
+    seen are fetched and appended, ids gone from the collection are
+    dropped, and the files are rewritten once a quarter of the rows are
+    dead. Ids are taken to be immutable, as ingest.py's content-hash ids
+    are; `refresh(full=True)` fetches everything again. With a
+    `refresh_interval`, a background thread refreshes on that period.
+
+    `source` is the collection or a function returning it; it is first
+    used by `refresh`, so an index on disk opens without Chroma.
+
+    Only one process may open an index: another gets IndexInUse.
+    """
+
+    def __init__(
+        self,
+        source,
+        path: str,
+        quantize: bool = False,
+        space: Optional[str] = None,
+        refresh_interval: float = 60.0,
+        block_rows: int = 8192,
+        page_size: int = 5000,
+    ):
+        self.source = source
+        self.path = path
+        self.quantize = quantize
+        self.dtype = np.int8 if quantize else np.float32
+        self.space = space
+        self.refresh_interval = refresh_interval
+        self.block_rows = block_rows
+        self.page_size = page_size
+
+        # Held until the process exits; refreshes rewrite the files in place.
+        self.lock_file = open(f"{path}.lock", "a")
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.lock_file.close()
+            raise IndexInUse(f"{path} is open in another process")
+
+        self.local = threading.local()
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        conn.commit()
+
+        self.lock = threading.Lock()
+        self.ready = False
+        self.refreshes = 0
+        self.refresh_time = 0.0
+        self.refresh_errors = 0
+        self.last_error = None
+        self.added = 0
+        self.removed = 0
+        self.compactions = 0
+        self.queries = 0
+        self.query_time = 0.0
+
+        with self.lock:
+            self._open()
+            self._drop_stale()
+        self.ready = self.snapshot.live_count > 0
+
+        self.stopped = threading.Event()
+        self.refresher = None
+        if refresh_interval > 0:
+            self.refresher = threading.Thread(target=self._run_refresher, name="vector-index-refresh", daemon=True)
+            self.refresher.start()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"{self.path}.db", timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def _vector_path(self, generation: int) -> str:
+        return f"{self.path}.{generation}.{'i8' if self.quantize else 'f32'}"
+
+    def _set_meta(self, conn: sqlite3.Connection, **values):
+        conn.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            [(key, str(value)) for key, value in values.items()],
+        )
+
+    # Writer side; everything below runs under self.lock.
+
+    def _open(self):
+        conn = self._conn()
+        meta = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+        if self.space is None:
+            self.space = meta.get("space") or None
+        if (
+            not meta
+            or meta.get("dtype") != np.dtype(self.dtype).name
+            or (self.space is not None and meta.get("space") != self.space)
+        ):
+            # New, or built with other settings: start over.
+            self._reset(int(meta.get("generation", -1)) + 1)
+            return
+        self.generation = int(meta["generation"])
+        self.table = f"rows_{self.generation}"
+        self.dim = int(meta["dim"])
+        self.rows = int(meta["rows"])
+        # Vectors appended after the last committed batch are dropped.
+        path = self._vector_path(self.generation)
+        row_bytes = self.dim * np.dtype(self.dtype).itemsize
+        if not os.path.exists(path) or (row_bytes and os.path.getsize(path) < self.rows * row_bytes):
+            self._reset(self.generation + 1)
+            return
+        with open(path, "r+b") as f:
+            f.truncate(self.rows * row_bytes)
+
+        self.norms = np.zeros(self.rows, dtype=np.float32)
+        self.scales = np.ones(self.rows, dtype=np.float32)
+        self.live = np.zeros(self.rows, dtype=bool)
+        stored = conn.execute(f"SELECT row, norm, scale FROM {self.table}").fetchall()
+        if stored:
+            rows, norms, scales = (np.asarray(column) for column in zip(*stored))
+            self.norms[rows] = norms
+            self.scales[rows] = scales
+            self.live[rows] = True
+        self._publish()
+
+    def _reset(self, generation: int, publish: bool = True):
+        conn = self._conn()
+        self.generation = generation
+        self.table = f"rows_{generation}"
+        self.dim = 0
+        self.rows = 0
+        self.norms = np.zeros(0, dtype=np.float32)
+        self.scales = np.ones(0, dtype=np.float32)
+        self.live = np.zeros(0, dtype=bool)
+        open(self._vector_path(generation), "wb").close()
+        with conn:
+            conn.execute(f"DROP TABLE IF EXISTS {self.table}")
+            conn.execute(ROWS_TABLE.format(table=self.table))
+            self._set_meta(
+                conn, generation=generation, dim=0, rows=0, dtype=np.dtype(self.dtype).name, space=self.space or ""
+            )
+        if publish:
+            self._publish()
+
+    def _publish(self):
+        vectors = None
+        if self.rows:
+            vectors = np.memmap(self._vector_path(self.generation), dtype=self.dtype, mode="r",
+                                shape=(self.rows, self.dim))
+        self.snapshot = Snapshot(
+            self.table, vectors, self.rows, self.norms, self.scales, self.live, int(self.live.sum())
+        )
+
+    def _drop_stale(self):
+        # Generations other than the current one and the one queries may
+        # still be reading (replaced at the previous refresh).
+        keep = {self.table, self.snapshot.table}
+        conn = self._conn()
+        tables = [t for (t,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'rows_%'")]
+        with conn:
+            for table in tables:
+                if table not in keep:
+                    conn.execute(f"DROP TABLE {table}")
+        for path in glob.glob(f"{glob.escape(self.path)}.*.*"):
+            generation = path[len(self.path) + 1:].split(".")[0]
+            if generation.isdigit() and f"rows_{generation}" not in keep and not path.endswith(".db"):
+                os.remove(path)
+
+    def _append(self, ids: List[str], embeddings, documents: list, metadatas: list):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim != 2 or not len(vectors):
+            return
+        if self.dim and vectors.shape[1] != self.dim:
+            raise ValueError(f"embedding dimension {vectors.shape[1]} does not match the index ({self.dim})")
+        norms = np.linalg.norm(vectors, axis=1).astype(np.float32)
+        if self.quantize:
+            scales = (np.abs(vectors).max(axis=1) / 127).astype(np.float32)
+            scales[scales == 0] = 1.0
+            stored = np.round(vectors / scales[:, None]).astype(np.int8)
+        else:
+            scales = np.ones(len(vectors), dtype=np.float32)
+            stored = vectors
+        with open(self._vector_path(self.generation), "ab") as f:
+            f.write(stored.tobytes())
+
+        first = self.rows
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                f"INSERT INTO {self.table} (row, id, document, metadata, norm, scale) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (first + i, doc_id, doc, json.dumps(meta) if meta is not None else None, float(n), float(s))
+                    for i, (doc_id, doc, meta, n, s) in enumerate(zip(ids, documents, metadatas, norms, scales))
+                ],
+            )
+            self._set_meta(conn, dim=vectors.shape[1], rows=first + len(vectors))
+        self.dim = vectors.shape[1]
+        self.rows = first + len(vectors)
+        self.norms = np.concatenate([self.norms, norms])
+        self.scales = np.concatenate([self.scales, scales])
+        self.live = np.concatenate([self.live, np.ones(len(vectors), dtype=bool)])
+        self.added += len(vectors)
+
+    def _remove(self, ids: List[str]):
+        conn = self._conn()
+        rows = []
+        with conn:
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                marks = ",".join("?" * len(batch))
+                rows += [r for (r,) in conn.execute(f"SELECT row FROM {self.table} WHERE id IN ({marks})", batch)]
+                conn.execute(f"DELETE FROM {self.table} WHERE id IN ({marks})", batch)
+        live = self.live.copy()
+        live[rows] = False
+        self.live = live
+        self.removed += len(rows)
+
+    def _compact(self):
+        """Rewrite the live rows, in order, as a new generation."""
+        old_table, old_path, old_live = self.table, self._vector_path(self.generation), self.live
+        old_vectors = np.memmap(old_path, dtype=self.dtype, mode="r", shape=(self.rows, self.dim))
+        generation = self.generation + 1
+        table = f"rows_{generation}"
+        keep = np.flatnonzero(old_live)
+        with open(self._vector_path(generation), "wb") as f:
+            for start in range(0, len(keep), self.block_rows):
+                f.write(np.ascontiguousarray(old_vectors[keep[start:start + self.block_rows]]).tobytes())
+        conn = self._conn()
+        with conn:
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.execute(ROWS_TABLE.format(table=table))
+            conn.execute(
+                f"INSERT INTO {table} (row, id, document, metadata, norm, scale) "
+                f"SELECT ROW_NUMBER() OVER (ORDER BY row) - 1, id, document, metadata, norm, scale FROM {old_table}"
+            )
+            self._set_meta(conn, generation=generation, rows=len(keep))
+        self.generation = generation
+        self.table = table
+        self.rows = len(keep)
+        self.norms = self.norms[keep]
+        self.scales = self.scales[keep]
+        self.live = np.ones(len(keep), dtype=bool)
+        self.compactions += 1
+
+    def _source(self):
+        return self.source() if callable(self.source) else self.source
+
+    def _source_ids(self) -> List[str]:
+        ids, offset = [], 0
+        while True:
+            page = _as_list(self._source().get(include=[], limit=self.page_size, offset=offset)["ids"])
+            ids.extend(page)
+            if len(page) < self.page_size:
+                return ids
+            offset += len(page)
+
+    def _fetch(self, ids: List[str]):
+        for start in range(0, len(ids), self.page_size):
+            batch = self._source().get(
+                ids=ids[start:start + self.page_size], include=["embeddings", "documents", "metadatas"]
+            )
+            fetched = _as_list(batch["ids"])
+            if fetched:
+                self._append(
+                    fetched,
+                    batch["embeddings"],
+                    _as_list(batch.get("documents")) or [None] * len(fetched),
+                    _as_list(batch.get("metadatas")) or [None] * len(fetched),
+                )
+
+    def refresh(self, full: bool = False) -> dict:
+        """Bring the index up to date with the source collection; returns what changed."""
+        with self.lock:
+            started = time.perf_counter()
+            added, removed = self.added, self.removed
+            if self.space is None:
+                self.space = collection_space(self._source())
+                with self._conn() as conn:
+                    self._set_meta(conn, space=self.space)
+            self._drop_stale()
+            source_ids = self._source_ids()
+            if full:
+                # Queries keep the old generation until this one is complete.
+                self._reset(self.generation + 1, publish=False)
+            known = {doc_id for (doc_id,) in self._conn().execute(f"SELECT id FROM {self.table}")}
+            present = set(source_ids)
+            gone = [doc_id for doc_id in known if doc_id not in present]
+            if gone:
+                # Listing pages can shift under concurrent writes; only drop
+                # what the collection confirms is gone.
+                still = set()
+                for start in range(0, len(gone), self.page_size):
+                    still.update(_as_list(self._source().get(ids=gone[start:start + self.page_size], include=[])["ids"]))
+                self._remove([doc_id for doc_id in gone if doc_id not in still])
+            self._fetch([doc_id for doc_id in dict.fromkeys(source_ids) if doc_id not in known])
+            if self.rows and self.rows - int(self.live.sum()) > self.rows // 4:
+                self._compact()
+            self._publish()
+            self.ready = True
+            elapsed = time.perf_counter() - started
+            self.refreshes += 1
+            self.refresh_time += elapsed
+            return {"added": self.added - added, "removed": self.removed - removed, "refresh_ms": elapsed * 1000}
+
+    def _run_refresher(self):
+        delay = 0.0
+        while not self.stopped.wait(delay):
+            try:
+                self.refresh()
+                self.last_error = None
+            except Exception as e:
+                # Chroma unreachable or mid-write: keep serving what we have.
+                self.refresh_errors += 1
+                self.last_error = str(e)
+            delay = self.refresh_interval
+
+    def close(self):
+        self.stopped.set()
+
+    # Reader side.
+
+    def _distances(self, snapshot: Snapshot, queries: np.ndarray) -> np.ndarray:
+        dots = np.empty((len(queries), snapshot.rows), dtype=np.float32)
+        if self.quantize:
+            # Widened a few rows at a time into one cache-sized buffer: as
+            # fast as a float32 scan, reading a quarter of the bytes.
+            buffer = np.empty((QUANTIZED_BLOCK_ROWS, snapshot.vectors.shape[1]), dtype=np.float32)
+            for start in range(0, snapshot.rows, QUANTIZED_BLOCK_ROWS):
+                block = snapshot.vectors[start:start + QUANTIZED_BLOCK_ROWS]
+                widened = buffer[:len(block)]
+                widened[...] = block
+                np.matmul(queries, widened.T, out=dots[:, start:start + len(block)])
+        else:
+            for start in range(0, snapshot.rows, self.block_rows):
+                block = snapshot.vectors[start:start + self.block_rows]
+                np.matmul(queries, block.T, out=dots[:, start:start + len(block)])
+        if self.quantize:
+            dots *= snapshot.scales
+        query_norms = np.linalg.norm(queries, axis=1)[:, None]
+        if self.space == "ip":
+            distances = 1 - dots
+        elif self.space == "cosine":
+            denominators = snapshot.norms * query_norms
+            distances = 1 - dots / np.where(denominators == 0, 1, denominators)
+        else:
+            distances = np.maximum(snapshot.norms ** 2 + query_norms ** 2 - 2 * dots, 0)
+        distances[:, ~snapshot.live] = np.inf
+        return distances
+
+    def _rows(self, table: str, rows: List[int]) -> dict:
+        marks = ",".join("?" * len(rows))
+        return {
+            row: (doc_id, document, json.loads(metadata) if metadata is not None else None)
+            for row, doc_id, document, metadata in self._conn().execute(
+                f"SELECT row, id, document, metadata FROM {table} WHERE row IN ({marks})", rows
+            )
+        }
+
+    def query(self, query_embeddings, n_results: int = 10, include=("documents", "metadatas", "distances")) -> dict:
+        started = time.perf_counter()
+        snapshot = self.snapshot
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1)
+        result = {key: [] for key in ("ids", "documents", "metadatas", "distances")}
+        k = min(n_results, snapshot.live_count)
+        distances = self._distances(snapshot, queries) if k else None
+        for i in range(len(queries)):
+            top = []
+            if k:
+                top = np.argpartition(distances[i], k - 1)[:k] if k < snapshot.rows else np.arange(snapshot.rows)
+                top = top[np.argsort(distances[i][top], kind="stable")][:k]
+            found = self._rows(snapshot.table, [int(r) for r in top]) if len(top) else {}
+            top = [int(r) for r in top if int(r) in found]
+            result["ids"].append([found[r][0] for r in top])
+            result["documents"].append([found[r][1] for r in top])
+            result["metadatas"].append([found[r][2] for r in top])
+            result["distances"].append([float(distances[i][r]) for r in top])
+        for key in ("documents", "metadatas", "distances"):
+            if key not in include:
+                result[key] = None
+        result["embeddings"] = None
+        result["included"] = list(include)
+        self.queries += 1
+        self.query_time += time.perf_counter() - started
+        return result
+
+    def count(self) -> int:
+        return self.snapshot.live_count
+
+    def stats(self) -> dict:
+        snapshot = self.snapshot
+        return {
+            "backend": "local",
+            "ready": self.ready,
+            "rows": snapshot.live_count,
+            "dead_rows": snapshot.rows - snapshot.live_count,
+            "dim": self.dim,
+            "dtype": np.dtype(self.dtype).name,
+            "space": self.space,
+            "vector_bytes": snapshot.rows * self.dim * np.dtype(self.dtype).itemsize,
+            "refreshes": self.refreshes,
+            "refresh_ms_avg": self.refresh_time / self.refreshes * 1000 if self.refreshes else 0.0,
+            "refresh_errors": self.refresh_errors,
+            "last_error": self.last_error,
+            "added": self.added,
+            "removed": self.removed,
+            "compactions": self.compactions,
+            "queries": self.queries,
+            "query_ms_avg": self.query_time / self.queries * 1000 if self.queries else 0.0,
+        }
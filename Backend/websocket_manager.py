@@ -1,21 +1,245 @@
-from typing import Dict, List
+import asyncio
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
 from fastapi import WebSocket
+from broadcast import InProcessBroadcast
+
+
+class Connection:
+    """
+    One WebSocket with its own outbound queue and writer task, so a slow
+    client only ever delays itself.
+    """
+
+    def __init__(self, websocket: WebSocket, session_id: str, max_queue: int, send_timeout: float,
+                 on_send: Optional[Callable[[float], None]] = None):
+        self.websocket = websocket
+        self.session_id = session_id
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self.on_send = on_send
+        self.queue = deque()
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.writer = None
+        # Live frames that arrive while history is being replayed; see hold().
+        self.held: Optional[deque] = None
+
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.send_time_total = 0.0
+        self.send_time_max = 0.0
+        self.send_time_last = 0.0
+
+    def _coalesce(self, message: dict) -> bool:
+        """Merge an intermediate frame into the still-unsent tail frame of the same message."""
+        if message.get("is_complete", True) or not self.queue:
+            return False
+        tail = self.queue[-1]
+        if tail.get("is_complete", True) or tail.get("message_id") != message.get("message_id"):
+            return False
+        if "delta" in message:
+            if "delta" not in tail:
+                return False
+            # Frames are shared between connections, so build a new dict
+            # instead of mutating the queued one.
+            merged = dict(message)
+            merged["delta"] = tail["delta"] + message["delta"]
+            self.queue[-1] = merged
+        else:
+            # Full-text frames supersede each other.
+            self.queue[-1] = message
+        self.coalesced += 1
+        return True
+
+    def enqueue(self, message: dict, bounded: bool = True) -> bool:
+        """Queue a frame; returns False when the client is too far behind to keep."""
+        if self.closed:
+            return False
+        if self._coalesce(message):
+            return True
+        if bounded and len(self.queue) >= self.max_queue:
+            if not message.get("is_complete", True) and "delta" not in message:
+                # A later full-text frame will carry this text anyway.
+                self.dropped += 1
+                return True
+            return False
+        self.queue.append(message)
+        self.max_depth = max(self.max_depth, len(self.queue))
+        self.ready.set()
+        return True
+
+    def hold(self):
+        """Keep live frames back until release(), so history replayed first stays ahead of them."""
+        self.held = deque()
+
+    def deliver(self, message: dict) -> bool:
+        """Queue a live frame, or hold it during replay; False when the client is too far behind."""
+        if self.held is None:
+            return self.enqueue(message)
+        if self.closed or len(self.held) >= self.max_queue:
+            return False
+        self.held.append(message)
+        return True
+
+    def release(self):
+        """Queue the frames held during replay, in the order they arrived."""
+        held, self.held = self.held, None
+        for message in held or ():
+            # Already bounded on the way into the hold.
+            self.enqueue(message, bounded=False)
+
+    async def run(self, on_dead):
+        try:
+            while True:
+                await self.ready.wait()
+                while self.queue:
+                    message = self.queue.popleft()
+                    started = time.perf_counter()
+                    await asyncio.wait_for(self.websocket.send_json(message), self.send_timeout)
+                    elapsed = time.perf_counter() - started
+                    self.sent += 1
+                    self.send_time_last = elapsed
+                    self.send_time_total += elapsed
+                    self.send_time_max = max(self.send_time_max, elapsed)
+                    if self.on_send is not None:
+                        self.on_send(elapsed)
+                self.ready.clear()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            on_dead(self)
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": len(self.queue),
+            "held": len(self.held) if self.held is not None else 0,
+            "max_queue_depth": self.max_depth,
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "send_ms_avg": (self.send_time_total / self.sent * 1000) if self.sent else 0.0,
+            "send_ms_max": self.send_time_max * 1000,
+            "send_ms_last": self.send_time_last * 1000,
+        }
+
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, List[WebSocket]] = {}
+    """
+    The sockets of this process, by session. `broadcast` hands a frame to
+    the backend, which delivers it to the process holding the session's
+    sockets: this one (InProcessBroadcast) or any worker subscribed
+    through a broker (BrokerBroadcast). on_send, if given, is called with
+    the seconds each frame took to write to its socket.
+    """
+
+    def __init__(self, max_queue: int = 256, send_timeout: float = 10.0, backend=None,
+                 on_send: Optional[Callable[[float], None]] = None):
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self.on_send = on_send
+        self.active_connections: Dict[str, List[Connection]] = {}
+        self.evicted = 0
+        self.replays = 0
+        self.replayed_messages = 0
+        self.backend = backend if backend is not None else InProcessBroadcast()
+        self.backend.deliver = self.deliver
 
-    async def connect(self, websocket: WebSocket, session_id: str):
+    async def start(self):
+        await self.backend.start()
+
+    async def close(self):
+        await self.backend.close()
+
+    async def connect(self, websocket: WebSocket, session_id: str, replay: bool = False) -> Connection:
+        """
+        Accept and register a socket. With replay, its live frames are held
+        back until `replayed` so the history queued before them comes first.
+        """
         await websocket.accept()
-        if session_id not in self.active_connections:
-            self.active_connections[session_id] = []
-        self.active_connections[session_id].append(websocket)
+        connection = Connection(websocket, session_id, self.max_queue, self.send_timeout, self.on_send)
+        if replay:
+            connection.hold()
+        connection.writer = asyncio.create_task(connection.run(self._on_dead))
+        self.active_connections.setdefault(session_id, []).append(connection)
+        await self.backend.subscribe(session_id)
+        return connection
+
+    def _remove(self, connection: Connection):
+        connection.closed = True
+        connections = self.active_connections.get(connection.session_id)
+        if connections and connection in connections:
+            connections.remove(connection)
+            if not connections:
+                del self.active_connections[connection.session_id]
+                self.backend.unsubscribe(connection.session_id)
+
+    def _on_dead(self, connection: Connection):
+        # A send failed or timed out, possibly half-written: close the
+        # socket so the client notices and reconnects.
+        self._remove(connection)
+        asyncio.create_task(self._close(connection.websocket))
+
+    def _evict(self, connection: Connection):
+        """Drop a client that fell too far behind; it will replay history on reconnect."""
+        self.evicted += 1
+        self._remove(connection)
+        if connection.writer:
+            connection.writer.cancel()
+        asyncio.create_task(self._close(connection.websocket))
+
+    async def _close(self, websocket: WebSocket):
+        try:
+            await websocket.close(code=1013)
+        except Exception:
+            pass
 
     def disconnect(self, websocket: WebSocket, session_id: str):
-        self.active_connections[session_id].remove(websocket)
-        if not self.active_connections[session_id]:
-            del self.active_connections[session_id]
+        for connection in list(self.active_connections.get(session_id, [])):
+            if connection.websocket is websocket:
+                self._remove(connection)
+                if connection.writer:
+                    connection.writer.cancel()
 
-    async def broadcast(self, session_id: str, message: dict):
+    def replayed(self, connection: Connection, messages: int):
+        """The history replay of a connection is queued; its held live frames follow."""
+        self.replays += 1
+        self.replayed_messages += messages
+        connection.release()
+
+    async def send_personal(self, websocket: WebSocket, session_id: str, message: dict):
+        """Queue a frame for one socket, e.g. an error, ahead of later broadcasts."""
         for connection in self.active_connections.get(session_id, []):
-            await connection.send_json(message)
+            if connection.websocket is websocket:
+                connection.enqueue(message, bounded=False)
+
+    def has_viewers(self, session_id: str) -> bool:
+        """Whether any socket, on this worker or (through the backend) another, watches the session."""
+        return session_id in self.active_connections or self.backend.has_viewers(session_id)
+
+    async def broadcast(self, session_id: str, message: dict):
+        await self.backend.publish(session_id, message)
+
+    def deliver(self, session_id: str, message: dict):
+        # Only queues the frame; each connection's writer sends it, so one
+        # slow socket never blocks the caller or the other viewers.
+        for connection in list(self.active_connections.get(session_id, [])):
+            if not connection.deliver(message):
+                self._evict(connection)
+
+    def metrics(self) -> dict:
+        return {
+            "sessions": len(self.active_connections),
+            "connections": sum(len(c) for c in self.active_connections.values()),
+            "evicted": self.evicted,
+            "replays": self.replays,
+            "replayed_messages": self.replayed_messages,
+            "broadcast": self.backend.metrics(),
+            "per_session": {
+                session_id: [c.stats() for c in connections]
+                for session_id, connections in self.active_connections.items()
+            },
+        }
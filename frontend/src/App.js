@@ -36,6 +36,52 @@ import { oneDark } from "react-syntax-highlighter/dist/esm/styles/prism";
 import Login from "./Login";
 import InputBox from "./InputBox";
 
+const STREAM_AUDIO_OVER_SOCKET = true;
+const AUDIO_CHUNK_MS = 250;
+const RECONNECT_MIN_MS = 1000;
+const RECONNECT_MAX_MS = 10000;
+
+// Applies a frame to the message on screen with the same message_id:
+// deltas newer than what it has are appended, and full frames replace it
+// unless it is complete and the frame is not. A checkpoint replayed from
+// another worker has no seq, so deltas are not known to continue it; the
+// answer's final frame replaces it instead.
+const mergeFrame = (existing, frame) => {
+  if (frame.delta !== undefined) {
+    const { delta, ...rest } = frame;
+    if (existing.is_complete || existing.seq === undefined || frame.seq <= existing.seq) return existing;
+    return { ...existing, ...rest, content: existing.content + delta };
+  }
+  if (existing.is_complete && !frame.is_complete) return existing;
+  return { ...existing, ...frame };
+};
+
+const indexOfMessage = (messages, messageId) => {
+  for (let i = messages.length - 1; i >= 0; i--) {
+    if (messages[i].message_id === messageId) return i;
+  }
+  return -1;
+};
+
+// Adds a page of replayed history, merging messages already on screen.
+const mergeHistory = (prevMessages, history) => {
+  const merged = [...prevMessages];
+  const index = new Map();
+  merged.forEach((message, i) => {
+    if (message.message_id) index.set(message.message_id, i);
+  });
+  history.forEach((message) => {
+    const i = index.get(message.message_id);
+    if (i === undefined) {
+      index.set(message.message_id, merged.length);
+      merged.push(message);
+    } else {
+      merged[i] = mergeFrame(merged[i], message);
+    }
+  });
+  return merged;
+};
+
 const App = () => {
   const [messages, setMessages] = useState([]);
   const [input, setInput] = useState("");
@@ -54,6 +100,14 @@ const App = () => {
 
   const messagesEndRef = useRef(null);
   const isPrimaryUser = useRef(false);
+  // Highest history_seq of a complete message received; a reconnect asks
+  // for what came after it.
+  const historySeq = useRef(0);
+  const reconnectDelay = useRef(RECONNECT_MIN_MS);
+  const socketRef = useRef(null);
+  const socketSession = useRef(null);
+  const reconnectTimer = useRef(null);
+  const closedIntentionally = useRef(false);
 
   useEffect(() => {
     if (localStorage.getItem("Token")) setIsloggedIn(true);
@@ -107,22 +161,110 @@ const App = () => {
 
   useEffect(() => {
     initializeSession();
+    return closeWebSocket;
     //eslint-disable-next-line
   }, []);
 
+  // Tells the backend how long the first and the final frame of an answer
+  // took from arriving to being on screen: the callback of the next
+  // animation frame runs just before the paint, the timeout just after it.
+  const reportRender = (websocket, messageData) => {
+    const frame = messageData.is_complete
+      ? "final"
+      : messageData.seq === 0
+      ? "first"
+      : null;
+    if (!frame) return;
+    const receivedAt = performance.now();
+    requestAnimationFrame(() =>
+      setTimeout(() => {
+        if (websocket.readyState !== WebSocket.OPEN) return;
+        websocket.send(
+          JSON.stringify({
+            type: "render",
+            request_id: messageData.request_id,
+            frame,
+            render_ms: performance.now() - receivedAt,
+          })
+        );
+      }, 0)
+    );
+  };
+
+  // Closes the socket without reconnecting, e.g. on unmount or before
+  // opening another.
+  const closeWebSocket = () => {
+    closedIntentionally.current = true;
+    clearTimeout(reconnectTimer.current);
+    reconnectTimer.current = null;
+    if (socketRef.current) socketRef.current.close();
+    socketRef.current = null;
+  };
+
   const setupWebSocket = (sessId) => {
-    const websocket = new WebSocket(`ws://localhost:8001/ws/${sessId}`);
+    closeWebSocket();
+    closedIntentionally.current = false;
+    if (socketSession.current !== sessId) {
+      socketSession.current = sessId;
+      historySeq.current = 0;
+    }
+    const websocket = new WebSocket(
+      `ws://localhost:8001/ws/${sessId}?after=${historySeq.current}`
+    );
+    socketRef.current = websocket;
+
+    const seen = (message) => {
+      if (message.is_complete && message.history_seq > historySeq.current)
+        historySeq.current = message.history_seq;
+    };
 
     websocket.onopen = () => {
       console.log("WebSocket connected");
       setIsConnected(true);
+      reconnectDelay.current = RECONNECT_MIN_MS;
     };
 
     websocket.onmessage = (event) => {
       const messageData = JSON.parse(event.data);
+      if (messageData.type === "error") {
+        console.error("Server error:", messageData.error);
+        return;
+      }
+      if (messageData.type === "history") {
+        // What was stored since historySeq, a page at a time.
+        messageData.messages.forEach(seen);
+        setMessages((prevMessages) =>
+          mergeHistory(prevMessages, messageData.messages)
+        );
+        return;
+      }
+      seen(messageData);
+      if (messageData.request_id && messageData.role === "assistant") {
+        reportRender(websocket, messageData);
+      }
       setMessages((prevMessages) => {
         const lastMessage = prevMessages[prevMessages.length - 1];
 
+        // A frame of a message already on screen, e.g. one replayed on
+        // reconnect, updates it in place.
+        const existing = messageData.message_id
+          ? indexOfMessage(prevMessages, messageData.message_id)
+          : -1;
+        if (existing !== -1) {
+          const merged = mergeFrame(prevMessages[existing], messageData);
+          if (merged === prevMessages[existing]) return prevMessages;
+          const next = [...prevMessages];
+          next[existing] = merged;
+          return next;
+        }
+
+        // Delta frames only carry the text generated since the previous
+        // frame of the same message_id; the first one starts the message.
+        if (messageData.delta !== undefined) {
+          const { delta, ...frame } = messageData;
+          return [...prevMessages, { ...frame, content: delta }];
+        }
+
         if (
           lastMessage &&
           lastMessage.role === "assistant" &&
@@ -162,7 +304,14 @@ const App = () => {
 
     websocket.onclose = () => {
       console.log("WebSocket closed");
+      // Replaced or closed on purpose: nothing to reconnect.
+      if (socketRef.current !== websocket || closedIntentionally.current)
+        return;
       setIsConnected(false);
+      // Reconnect with backoff; only messages after historySeq are replayed.
+      const delay = reconnectDelay.current;
+      reconnectDelay.current = Math.min(delay * 2, RECONNECT_MAX_MS);
+      reconnectTimer.current = setTimeout(() => setupWebSocket(sessId), delay);
     };
 
     websocket.onerror = (error) => {
@@ -202,12 +351,16 @@ const App = () => {
     try {
       const formData = new FormData();
       formData.append("sessionId", sessionId);
-      formData.append("file", audioBlob, "audio.wav");
+      // The server detects the format from the bytes, not the name.
+      formData.append("file", audioBlob, "audio");
 
-      await fetch("http://localhost:8001/ask-audio", {
+      const response = await fetch("http://localhost:8001/ask-audio", {
         method: "POST",
         body: formData,
       });
+      if (!response.ok) {
+        console.error("Audio rejected:", await response.text());
+      }
     } catch (error) {
       console.error("Error sending audio:", error);
     }
@@ -228,16 +381,40 @@ const App = () => {
       setStream(mediaStream);
       setMediaRecorder(recorder);
 
+      // Stream the recording over the socket while speaking so the server
+      // can transcribe and retrieve context before we stop; fall back to
+      // uploading the whole clip when the socket is not open.
+      const streamOverSocket =
+        STREAM_AUDIO_OVER_SOCKET &&
+        socket &&
+        socket.readyState === WebSocket.OPEN;
+      if (streamOverSocket) {
+        socket.send(
+          JSON.stringify({ type: "audio_start", mime: recorder.mimeType })
+        );
+      }
+
       const audioChunks = [];
       recorder.ondataavailable = (event) => {
-        audioChunks.push(event.data);
+        if (streamOverSocket) {
+          if (event.data.size) socket.send(event.data);
+        } else {
+          audioChunks.push(event.data);
+        }
       };
       recorder.onstop = async () => {
-        const audioBlob = new Blob(audioChunks, { type: "audio/wav" });
+        if (streamOverSocket) {
+          socket.send(JSON.stringify({ type: "audio_end" }));
+          return;
+        }
+        const audioBlob = new Blob(audioChunks, {
+          type: recorder.mimeType || "audio/webm",
+        });
         await handleAudioMessage(audioBlob);
       };
 
-      recorder.start();
+      if (streamOverSocket) recorder.start(AUDIO_CHUNK_MS);
+      else recorder.start();
       setRecording(true);
     } catch (error) {
       console.error("Mic error:", error);